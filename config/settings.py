@@ -1,7 +1,145 @@
 # config/settings.py
+import os
 from dataclasses import dataclass
+from typing import ClassVar, Dict, Tuple
 
 @dataclass
 class AppConfig:
     PAGE_TITLE: str = "认知黑匣子"
     PAGE_ICON: str = "🧠"
+
+    # 指标输出：独立端口上的Prometheus文本格式端点（/metrics），不经过Streamlit服务
+    # 默认只监听本机；同一主机上的多个副本通过环境变量METRICS_PORT各用一个端口，
+    # 需要从其他主机抓取时设置METRICS_HOST（如0.0.0.0）
+    METRICS_ENABLED: bool = True
+    METRICS_HOST: str = os.environ.get('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT: int = int(os.environ.get('METRICS_PORT', '9464'))
+
+    # 生成进行中时页面片段的自动刷新间隔（秒），脚本线程不等待AI结果
+    UI_POLL_INTERVAL_S: float = 0.5
+
+@dataclass
+class EngineConfig:
+    # 生成后端：gemini（google.generativeai）/ openai（OpenAI兼容的自建推理服务）/
+    # gemini_rest（直接调用REST接口，默认指向 python -m core.fake_gemini 启动的本地替身服务）/ fake（进程内替身，离线测试）
+    GENERATION_BACKEND: str = 'gemini'
+    # OpenAI兼容服务：逻辑模型名（路由、调用类型偏好沿用）-> 服务端模型名；API Key可选，读取OPENAI_COMPAT_API_KEY
+    OPENAI_COMPAT_BASE_URL: str = 'http://127.0.0.1:8000/v1'
+    OPENAI_COMPAT_MODELS: ClassVar[Dict[str, str]] = {
+        'gemini-1.5-flash': 'local-small',
+        'gemini-1.5-pro': 'local-large',
+        'gemini-2.5-pro': 'local-large',
+    }
+    OPENAI_COMPAT_RATE_LIMIT: Tuple[int, int] = (600, 10000000)
+    OPENAI_COMPAT_POOL_SIZE: int = 16
+    OPENAI_COMPAT_CONNECT_TIMEOUT_S: float = 5.0
+    GEMINI_REST_BASE_URL: str = 'http://127.0.0.1:8765/v1beta'
+    GEMINI_REST_POOL_SIZE: int = 16
+    GEMINI_REST_CONNECT_TIMEOUT_S: float = 5.0
+    FAKE_BACKEND_LATENCY_S: float = 0.2
+
+    # 录制/回放（默认关闭）：record把每次模型调用的请求、响应与耗时追加到cassette文件（JSON Lines）；
+    # replay按规范化prompt取回录制的响应，不发网络请求，耗时乘以CASSETTE_TIME_SCALE（1为原始耗时，0为立即返回）
+    CASSETTE_MODE: str = 'off'
+    CASSETTE_PATH: str = '.cache/cassette.jsonl'
+    CASSETTE_TIME_SCALE: float = 1.0
+
+    # Damien质疑问题结果缓存：键为(案例, 第一幕选择)，每个键保留若干变体
+    QUESTION_CACHE_ENABLED: bool = True
+    QUESTION_CACHE_MAX_KEYS: int = 64
+    QUESTION_CACHE_TTL_S: float = 3600.0
+    QUESTION_CACHE_VARIANTS: int = 3
+
+    # 后台预取：在转场动画期间提前发起生成；等待执行的任务达到上限时拒绝新任务（线程池饱和），
+    # 被拒绝的任务由轮询重新提交，超过重试次数后使用备选结果
+    BACKGROUND_WORKERS: int = 8
+    BACKGROUND_MAX_PENDING: int = 64
+    BACKGROUND_SATURATION_RETRIES: int = 5
+    PREFETCH_ON_SELECT: bool = False
+    PREFETCH_WAIT_TIMEOUT_S: float = 30.0
+    TOOL_WAIT_TIMEOUT_S: float = 120.0
+
+    # 模型路由熔断：连续失败阈值、熔断冷却时间与EWMA平滑系数
+    ROUTER_FAILURE_THRESHOLD: int = 3
+    ROUTER_OPEN_SECONDS: float = 60.0
+    ROUTER_EWMA_ALPHA: float = 0.3
+
+    # 跨会话限流：每个模型的(请求数/分钟, 令牌数/分钟)，超出时排队，等待过久则回退
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMITS: ClassVar[Dict[str, Tuple[int, int]]] = {
+        'gemini-1.5-flash': (15, 1000000),
+        'gemini-1.5-pro': (2, 32000),
+        'gemini-2.5-pro': (5, 250000),
+    }
+    RATE_LIMIT_DEFAULT: Tuple[int, int] = (60, 1000000)
+    RATE_LIMIT_MAX_QUEUE: int = 200
+    RATE_LIMIT_MAX_WAIT_S: float = 20.0
+
+    # 按错误类型的重试策略：(动作, 最大重试次数, 基础退避秒数, 退避上限秒数)
+    # retry为退避后重试同一模型（用尽后切换模型），switch为立即切换模型，stop为不重试直接返回fallback
+    RETRY_POLICY: ClassVar[Dict[str, Tuple[str, int, float, float]]] = {
+        '网络错误': ('retry', 2, 0.3, 2.0),
+        '未知错误': ('retry', 1, 0.3, 1.0),
+        '配额限制': ('switch', 0, 0.0, 0.0),
+        '超时': ('switch', 0, 0.0, 0.0),
+        '内容拦截': ('stop', 0, 0.0, 0.0),
+    }
+    RETRY_POLICY_DEFAULT: Tuple[str, int, float, float] = ('switch', 0, 0.0, 0.0)
+
+    # 相同prompt + 生成配置的在途请求合并为一次上游调用
+    SINGLE_FLIGHT_ENABLED: bool = True
+
+    # 对冲请求（默认关闭）：主请求超过近期延迟分位数仍未返回时，再向下一个模型发一路请求
+    HEDGING_ENABLED: bool = False
+    HEDGING_PROFILES: Tuple[str, ...] = ('memo', 'memo_fields')
+    HEDGING_PERCENTILE: float = 0.9
+    HEDGING_MIN_SAMPLES: int = 10
+    HEDGING_DEFAULT_DELAY_S: float = 8.0
+    HEDGING_WORKERS: int = 8
+
+    # 截止时间：各类调用的默认预算见generation_profiles；剩余时间不足时不再发起新的模型尝试
+    DEADLINE_MIN_ATTEMPT_S: float = 1.0
+
+    # 持久化结果存储：多副本共享的SQLite（WAL），按模型 + prompt + 生成配置 + 变体序号缓存成功结果
+    RESPONSE_STORE_ENABLED: bool = True
+    RESPONSE_STORE_PATH: str = '.cache/response_store.sqlite3'
+    RESPONSE_STORE_MAX_BYTES: int = 64 * 1024 * 1024
+    RESPONSE_STORE_TTL_S: float = 7 * 24 * 3600.0
+    # 备忘录个性化字段取决于用户的个人原则，不做持久化
+    RESPONSE_STORE_PROFILES: Tuple[str, ...] = ('question', 'feedback', 'feedback_batch', 'memo')
+
+    # 骨架优先的备忘录（默认关闭）：固定结构由代码渲染，模型只生成个性化建议与两个工具（JSON字段）
+    # 开启后备忘录只能在标题之后等待完整JSON再输出其余部分（不再逐段流式），也不使用上下文缓存
+    MEMO_SKELETON_ENABLED: bool = False
+
+    # 上下文缓存：完整备忘录（非骨架模式）中每个案例固定的前言注册为缓存内容，请求只发送用户相关部分
+    # backend为gemini（API上下文缓存，需带版本号的模型名；前言的令牌数（count_tokens）低于最小值时不拆分，
+    # 发送原始的完整prompt）或local（离线替身）
+    CONTEXT_CACHE_ENABLED: bool = True
+    CONTEXT_CACHE_BACKEND: str = 'gemini'
+    CONTEXT_CACHE_TTL_S: float = 3600.0
+    CONTEXT_CACHE_REFRESH_MARGIN_S: float = 300.0
+    CONTEXT_CACHE_RETRY_S: float = 600.0
+    CONTEXT_CACHE_MIN_TOKENS: int = 4096
+    CONTEXT_CACHE_MODEL_VERSIONS: ClassVar[Dict[str, str]] = {
+        'gemini-1.5-flash': 'models/gemini-1.5-flash-002',
+        'gemini-1.5-pro': 'models/gemini-1.5-pro-002',
+        'gemini-2.5-pro': 'models/gemini-2.5-pro',
+    }
+
+    # 独立worker进程（默认关闭）：上游调用写入本地SQLite任务队列，由 python -m core.llm_worker 启动的进程池执行
+    # Streamlit进程只提交与轮询；worker未运行时调用会在截止时间到期后返回fallback
+    WORKER_MODE_ENABLED: bool = False
+    WORKER_QUEUE_PATH: str = '.cache/job_queue.sqlite3'
+    WORKER_PROCESSES: int = 2
+    WORKER_THREADS: int = 4
+    WORKER_POLL_INTERVAL_S: float = 0.05
+    WORKER_IDLE_POLL_S: float = 0.2
+    WORKER_STREAM_FLUSH_S: float = 0.1
+    WORKER_HEARTBEAT_S: float = 5.0
+    WORKER_STALE_S: float = 30.0
+    WORKER_JOB_RETENTION_S: float = 3600.0
+
+    # 诊断采集级别：off（只保留错误类型等精简字段）/ sampled（按比例完整采集）/ full（每次完整采集）
+    DIAGNOSTICS_LEVEL: str = 'sampled'
+    DIAGNOSTICS_SAMPLE_RATE: float = 0.05
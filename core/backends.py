@@ -0,0 +1,503 @@
+# core/backends.py - 可插拔的生成后端
+# 引擎只依赖"模型对象.generate_content"这一读取方式，后端负责把具体服务适配成Gemini SDK的响应形状
+
+import http.client
+import json
+import random
+import threading
+import time
+import urllib.parse
+from types import SimpleNamespace
+from typing import Dict, Any, Tuple, Iterator, Optional, List, Callable
+from config.settings import EngineConfig
+
+
+class BackendResponse:
+    """与Gemini GenerateContentResponse读取方式一致的响应：parts / text / usage_metadata / prompt_feedback"""
+
+    def __init__(self, text: str = "", total_tokens: Optional[int] = None,
+                 finish_reason: Optional[str] = None, block_reason: Optional[str] = None,
+                 cached_tokens: Optional[int] = None):
+        self.parts = [text] if text else []
+        self._text = text
+        self.finish_reason = finish_reason
+        self.usage_metadata = (SimpleNamespace(total_token_count=total_tokens, cached_content_token_count=cached_tokens)
+                               if total_tokens is not None else None)
+        self.prompt_feedback = SimpleNamespace(block_reason=block_reason) if block_reason else None
+
+    @property
+    def text(self) -> str:
+        # 与SDK一致：没有可用内容时读取text抛出异常，错误信息带finish_reason
+        if not self.parts:
+            raise ValueError(f"响应没有可用的文本内容 finish_reason: {self.finish_reason}")
+        return self._text
+
+    def __repr__(self):
+        return (f"BackendResponse(text={self._text[:200]!r}, finish_reason={self.finish_reason!r}, "
+                f"usage_metadata={self.usage_metadata!r}, prompt_feedback={self.prompt_feedback!r})")
+
+
+class BackendStream:
+    """流式响应：逐块迭代，迭代结束后usage_metadata为最后一次报告的用量"""
+
+    def __init__(self, chunks: Iterator[BackendResponse]):
+        self._chunks = chunks
+        self.usage_metadata = None
+        self.prompt_feedback = None
+
+    def __iter__(self) -> Iterator[BackendResponse]:
+        for chunk in self._chunks:
+            if chunk.usage_metadata is not None:
+                self.usage_metadata = chunk.usage_metadata
+            if chunk.prompt_feedback is not None:
+                self.prompt_feedback = chunk.prompt_feedback
+            yield chunk
+
+    def __repr__(self):
+        return f"BackendStream(usage_metadata={self.usage_metadata!r})"
+
+
+def _request_timeout(request_options: Optional[Dict[str, Any]]) -> Optional[float]:
+    timeout = (request_options or {}).get('timeout')
+    return max(0.1, timeout) if timeout is not None else None
+
+
+# =============================================================================
+# Gemini
+# =============================================================================
+
+class GeminiBackend:
+    """google.generativeai：原有的调用方式"""
+    name = "gemini"
+    api_key_name = "GEMINI_API_KEY"
+    requires_api_key = True
+    supports_context_cache = True
+
+    def configure(self, api_key: Optional[str]):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+
+    def create_model(self, model_name: str):
+        import google.generativeai as genai
+        return genai.GenerativeModel(model_name)
+
+    def rate_limits(self) -> Tuple[Dict[str, Tuple[int, int]], Tuple[int, int]]:
+        return EngineConfig.RATE_LIMITS, EngineConfig.RATE_LIMIT_DEFAULT
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'name': self.name}
+
+
+# =============================================================================
+# OpenAI兼容的HTTP服务
+# =============================================================================
+
+class BackendHTTPError(Exception):
+    """推理服务返回了错误状态码；消息以状态码开头，引擎据此归类（如429为配额限制）"""
+
+    def __init__(self, status: int, reason: str, detail: str):
+        super().__init__(f"{status} {reason}: {detail}")
+        self.status = status
+
+
+class HTTPConnectionPool:
+    """
+    keep-alive连接池
+
+    设计原则：
+    1. 进程内共享：挂在共享引擎的后端上，所有会话复用同一组TCP连接，省去每次请求的握手
+    2. 后进先出：优先复用最近归还的连接，空闲过久的连接自然沉底
+    3. 失效重连：复用的连接可能已被服务端在空闲期间关闭，此时换新连接重发一次
+    """
+
+    def __init__(self, base_url: str, max_idle: int = 16, connect_timeout_s: float = 5.0):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.scheme = parsed.scheme or 'http'
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.base_path = parsed.path.rstrip('/')
+        self.max_idle = max_idle
+        self.connect_timeout_s = connect_timeout_s
+        self._idle: List[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self.in_use = 0
+
+    def _acquire(self) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            self.in_use += 1
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop(), True
+            self.created += 1
+        connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        return connection_class(self.host, self.port, timeout=self.connect_timeout_s), False
+
+    def release(self, conn: http.client.HTTPConnection, response: Optional[http.client.HTTPResponse]):
+        """归还连接：响应已读完且服务端未要求关闭时放回空闲列表，否则关闭"""
+        reusable = response is not None and response.isclosed() and not response.will_close
+        with self._lock:
+            self.in_use -= 1
+            if reusable and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+            self.discarded += 1
+        conn.close()
+
+    def open(self, method: str, path: str, body: bytes, headers: Dict[str, str],
+             timeout: Optional[float]) -> Tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        """发送请求并返回(连接, 响应)；读完响应后须调用release归还连接"""
+        for attempt in range(2):
+            conn, reused = self._acquire()
+            try:
+                if conn.sock is None:
+                    conn.connect()
+                conn.sock.settimeout(timeout)
+                conn.request(method, self.base_path + path, body=body, headers=headers)
+                return conn, conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.release(conn, None)
+                if reused and attempt == 0:
+                    continue
+                raise
+            except BaseException:
+                self.release(conn, None)
+                raise
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'idle': len(self._idle),
+                'in_use': self.in_use,
+                'created': self.created,
+                'reused': self.reused,
+                'discarded': self.discarded
+            }
+
+
+def _open_json(pool: HTTPConnectionPool, path: str, body: Dict[str, Any], headers: Dict[str, str],
+               request_options: Optional[Dict[str, Any]]) -> Tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+    """POST一个JSON请求；错误状态码读完响应体后归还连接并抛出BackendHTTPError"""
+    conn, response = pool.open('POST', path, json.dumps(body, ensure_ascii=False).encode('utf-8'),
+                               headers, _request_timeout(request_options))
+    if response.status >= 400:
+        detail = response.read().decode('utf-8', errors='replace')[:300]
+        pool.release(conn, response)
+        raise BackendHTTPError(response.status, response.reason, detail)
+    return conn, response
+
+
+def _read_json(pool: HTTPConnectionPool, conn: http.client.HTTPConnection,
+               response: http.client.HTTPResponse) -> Dict[str, Any]:
+    try:
+        return json.loads(response.read())
+    finally:
+        pool.release(conn, response)
+
+
+def _iter_sse(pool: HTTPConnectionPool, conn: http.client.HTTPConnection, response: http.client.HTTPResponse,
+              is_final: Callable[[Dict[str, Any]], bool]) -> Iterator[Dict[str, Any]]:
+    """
+    解析SSE事件流（data: JSON）；中途放弃消费时连接直接关闭
+    分块传输被截断时http.client按正常结束处理，因此要求流以[DONE]或is_final判定的事件结束，否则视为连接中断
+    """
+    finished = False
+    try:
+        completed = False
+        for raw_line in response:
+            line = raw_line.decode('utf-8').strip()
+            if not line.startswith('data:'):
+                continue
+            data = line[len('data:'):].strip()
+            if data == '[DONE]':
+                completed = True
+                break
+            event = json.loads(data)
+            completed = completed or is_final(event)
+            yield event
+        if not completed:
+            raise ConnectionError("connection closed before the stream finished")
+        # 读完分块结尾，连接才能复用
+        response.read()
+        finished = True
+    finally:
+        if not finished:
+            response.close()
+        pool.release(conn, response)
+
+
+class OpenAICompatibleModel:
+    """把一次generate_content转换为/chat/completions请求"""
+
+    def __init__(self, backend: "OpenAICompatibleBackend", model_id: str):
+        self.backend = backend
+        self.model_name = model_id
+
+    def _request_body(self, prompt: str, generation_config: Optional[Dict[str, Any]], stream: bool) -> Dict[str, Any]:
+        generation_config = generation_config or {}
+        body: Dict[str, Any] = {
+            'model': self.model_name,
+            'messages': [{'role': 'user', 'content': prompt}],
+            'stream': stream
+        }
+        for source, target in (('max_output_tokens', 'max_tokens'), ('temperature', 'temperature'),
+                               ('top_p', 'top_p'), ('stop_sequences', 'stop')):
+            if source in generation_config:
+                body[target] = generation_config[source]
+        if stream:
+            body['stream_options'] = {'include_usage': True}
+        return body
+
+    @staticmethod
+    def _to_response(text: str, finish_reason: Optional[str], usage: Optional[Dict[str, Any]]) -> BackendResponse:
+        blocked = finish_reason == 'content_filter'
+        return BackendResponse(
+            text=text or "",
+            total_tokens=(usage or {}).get('total_tokens'),
+            finish_reason='SAFETY' if blocked else finish_reason,
+            block_reason='CONTENT_FILTER' if blocked and not text else None
+        )
+
+    def generate_content(self, prompt: str, safety_settings=None, generation_config=None,
+                         stream: bool = False, request_options=None):
+        # 安全设置由推理服务自身决定，这里不转发
+        pool = self.backend.pool
+        conn, response = _open_json(pool, '/chat/completions', self._request_body(prompt, generation_config, stream),
+                                    self.backend.headers(), request_options)
+        if stream:
+            events = _iter_sse(pool, conn, response,
+                               lambda event: any(c.get('finish_reason') for c in event.get('choices') or []))
+            return BackendStream(self._iter_stream(events))
+
+        data = _read_json(pool, conn, response)
+        choice = (data.get('choices') or [{}])[0]
+        return self._to_response((choice.get('message') or {}).get('content'),
+                                 choice.get('finish_reason'), data.get('usage'))
+
+    def _iter_stream(self, events: Iterator[Dict[str, Any]]) -> Iterator[BackendResponse]:
+        for event in events:
+            choice = (event.get('choices') or [{}])[0]
+            yield self._to_response((choice.get('delta') or {}).get('content'),
+                                    choice.get('finish_reason'), event.get('usage'))
+
+
+class OpenAICompatibleBackend:
+    """OpenAI兼容的自建推理服务（vLLM、llama.cpp server等），逻辑模型名按配置映射为服务端模型"""
+    name = "openai"
+    api_key_name = "OPENAI_COMPAT_API_KEY"
+    requires_api_key = False
+    supports_context_cache = False
+
+    def __init__(self, base_url: str, model_map: Dict[str, str], rate_limit: Tuple[int, int],
+                 pool_size: int = 16, connect_timeout_s: float = 5.0):
+        self.base_url = base_url
+        self.model_map = dict(model_map)
+        self.rate_limit = rate_limit
+        self.api_key: Optional[str] = None
+        self.pool = HTTPConnectionPool(base_url, max_idle=pool_size, connect_timeout_s=connect_timeout_s)
+
+    def configure(self, api_key: Optional[str]):
+        self.api_key = api_key
+
+    def headers(self) -> Dict[str, str]:
+        headers = {'Content-Type': 'application/json', 'Accept': 'application/json, text/event-stream'}
+        if self.api_key:
+            headers['Authorization'] = f"Bearer {self.api_key}"
+        return headers
+
+    def create_model(self, model_name: str) -> OpenAICompatibleModel:
+        return OpenAICompatibleModel(self, self.model_map.get(model_name, model_name))
+
+    def rate_limits(self) -> Tuple[Dict[str, Tuple[int, int]], Tuple[int, int]]:
+        # 自建服务没有按模型的配额，统一使用一个较宽的限额
+        return {}, self.rate_limit
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'name': self.name, 'base_url': self.base_url, 'models': self.model_map,
+                'connection_pool': self.pool.get_stats()}
+
+
+# =============================================================================
+# Gemini REST
+# =============================================================================
+
+class GeminiRESTModel:
+    """直接调用Gemini REST接口（models/{model}:generateContent），与本地替身服务core.fake_gemini配套"""
+
+    _CONFIG_FIELDS = (('temperature', 'temperature'), ('top_p', 'topP'), ('top_k', 'topK'),
+                      ('max_output_tokens', 'maxOutputTokens'), ('stop_sequences', 'stopSequences'))
+
+    def __init__(self, backend: "GeminiRESTBackend", model_name: str):
+        self.backend = backend
+        self.model_name = model_name
+
+    def _request_body(self, prompt: str, safety_settings, generation_config) -> Dict[str, Any]:
+        generation_config = generation_config or {}
+        body: Dict[str, Any] = {
+            'contents': [{'role': 'user', 'parts': [{'text': prompt}]}],
+            'generationConfig': {target: generation_config[source]
+                                 for source, target in self._CONFIG_FIELDS if source in generation_config}
+        }
+        if safety_settings:
+            body['safetySettings'] = safety_settings
+        return body
+
+    @staticmethod
+    def _to_response(data: Dict[str, Any]) -> BackendResponse:
+        candidate = (data.get('candidates') or [{}])[0]
+        parts = (candidate.get('content') or {}).get('parts') or []
+        usage = data.get('usageMetadata') or {}
+        return BackendResponse(
+            text="".join(part.get('text', '') for part in parts),
+            total_tokens=usage.get('totalTokenCount'),
+            finish_reason=candidate.get('finishReason'),
+            block_reason=(data.get('promptFeedback') or {}).get('blockReason'),
+            cached_tokens=usage.get('cachedContentTokenCount')
+        )
+
+    def generate_content(self, prompt: str, safety_settings=None, generation_config=None,
+                         stream: bool = False, request_options=None):
+        pool = self.backend.pool
+        method = 'streamGenerateContent?alt=sse' if stream else 'generateContent'
+        conn, response = _open_json(pool, f"/models/{self.model_name}:{method}",
+                                    self._request_body(prompt, safety_settings, generation_config),
+                                    self.backend.headers(), request_options)
+        if stream:
+            events = _iter_sse(pool, conn, response,
+                               lambda event: any(c.get('finishReason') for c in event.get('candidates') or [])
+                               or bool((event.get('promptFeedback') or {}).get('blockReason')))
+            return BackendStream(self._to_response(event) for event in events)
+        return self._to_response(_read_json(pool, conn, response))
+
+
+class GeminiRESTBackend:
+    """
+    不经过SDK的Gemini REST后端：同样使用共享的keep-alive连接池
+    默认指向本地替身服务；改为https://generativelanguage.googleapis.com/v1beta即为真实API
+    """
+    name = "gemini_rest"
+    api_key_name = "GEMINI_API_KEY"
+    requires_api_key = False
+    supports_context_cache = False
+
+    def __init__(self, base_url: str, pool_size: int = 16, connect_timeout_s: float = 5.0):
+        self.base_url = base_url
+        self.api_key: Optional[str] = None
+        self.pool = HTTPConnectionPool(base_url, max_idle=pool_size, connect_timeout_s=connect_timeout_s)
+
+    def configure(self, api_key: Optional[str]):
+        self.api_key = api_key
+
+    def headers(self) -> Dict[str, str]:
+        headers = {'Content-Type': 'application/json'}
+        if self.api_key:
+            headers['x-goog-api-key'] = self.api_key
+        return headers
+
+    def create_model(self, model_name: str) -> GeminiRESTModel:
+        return GeminiRESTModel(self, model_name)
+
+    def rate_limits(self) -> Tuple[Dict[str, Tuple[int, int]], Tuple[int, int]]:
+        return EngineConfig.RATE_LIMITS, EngineConfig.RATE_LIMIT_DEFAULT
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'name': self.name, 'base_url': self.base_url, 'connection_pool': self.pool.get_stats()}
+
+
+# =============================================================================
+# 进程内替身
+# =============================================================================
+
+class FakeModel:
+    """按固定延迟返回确定性文本的模型"""
+
+    def __init__(self, backend: "FakeBackend", model_name: str):
+        self.backend = backend
+        self.model_name = model_name
+
+    def generate_content(self, prompt: str, safety_settings=None, generation_config=None,
+                         stream: bool = False, request_options=None):
+        timeout = _request_timeout(request_options)
+        self.backend.record_call()
+        if timeout is not None and timeout < self.backend.latency_s:
+            time.sleep(timeout)
+            raise TimeoutError("离线替身: 请求超时")
+        time.sleep(self.backend.latency_s)
+
+        text = self.backend.respond(self.model_name, prompt)
+        total_tokens = len(prompt) + len(text)
+        if not stream:
+            return BackendResponse(text, total_tokens=total_tokens, finish_reason='STOP')
+        pieces = [text[i:i + 8] for i in range(0, len(text), 8)]
+        chunks = [BackendResponse(piece) for piece in pieces[:-1]]
+        chunks.append(BackendResponse(pieces[-1], total_tokens=total_tokens, finish_reason='STOP'))
+        return BackendStream(iter(chunks))
+
+
+class FakeBackend:
+    """进程内替身：不发网络请求，相同prompt总是得到相同回复，供离线测试引擎的调度逻辑（故障注入见core.fake_gemini）"""
+    name = "fake"
+    api_key_name = "GEMINI_API_KEY"
+    requires_api_key = False
+    supports_context_cache = False
+
+    def __init__(self, latency_s: float = 0.0):
+        self.latency_s = latency_s
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def configure(self, api_key: Optional[str]):
+        pass
+
+    def create_model(self, model_name: str) -> FakeModel:
+        return FakeModel(self, model_name)
+
+    def record_call(self):
+        with self._lock:
+            self.calls += 1
+
+    @staticmethod
+    def respond(model_name: str, prompt: str) -> str:
+        # 与本地替身服务相同的回复内容（按prompt类型模仿），相同的模型与prompt得到相同回复；
+        # 替身服务模块只在使用fake后端时导入
+        from core.fake_gemini import compose_reply
+        return compose_reply(prompt, random.Random(f"{model_name}|{prompt}"))
+
+    def rate_limits(self) -> Tuple[Dict[str, Tuple[int, int]], Tuple[int, int]]:
+        # 沿用Gemini的限额，使限流与排队的表现与线上一致
+        return EngineConfig.RATE_LIMITS, EngineConfig.RATE_LIMIT_DEFAULT
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'name': self.name, 'latency_s': self.latency_s, 'calls': self.calls}
+
+
+def create_backend(name: str):
+    """按名称创建生成后端：gemini / openai / gemini_rest / fake"""
+    if name == 'gemini':
+        return GeminiBackend()
+    if name == 'openai':
+        return OpenAICompatibleBackend(
+            EngineConfig.OPENAI_COMPAT_BASE_URL,
+            EngineConfig.OPENAI_COMPAT_MODELS,
+            EngineConfig.OPENAI_COMPAT_RATE_LIMIT,
+            pool_size=EngineConfig.OPENAI_COMPAT_POOL_SIZE,
+            connect_timeout_s=EngineConfig.OPENAI_COMPAT_CONNECT_TIMEOUT_S
+        )
+    if name == 'gemini_rest':
+        return GeminiRESTBackend(
+            EngineConfig.GEMINI_REST_BASE_URL,
+            pool_size=EngineConfig.GEMINI_REST_POOL_SIZE,
+            connect_timeout_s=EngineConfig.GEMINI_REST_CONNECT_TIMEOUT_S
+        )
+    if name == 'fake':
+        return FakeBackend(latency_s=EngineConfig.FAKE_BACKEND_LATENCY_S)
+    raise ValueError(f"未知的生成后端: {name}")
@@ -0,0 +1,131 @@
+# core/cache_warmer.py - 部署时的缓存预热命令行工具
+# 质疑问题只取决于(案例, 第一幕选择)，可以在上线前全部生成并写入持久化存储
+# （备忘录取决于用户的姓名与个人原则，不预热）
+#
+# 用法：python -m core.cache_warmer --variants 3 --workers 4 --budget 0.5
+# API Key从环境变量GEMINI_API_KEY读取（或.streamlit/secrets.toml）
+
+import argparse
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Any, List, Tuple, Optional
+
+from config.settings import EngineConfig
+from core.engine import AIEngine
+
+CASES_DIR = Path(__file__).resolve().parent.parent / "config" / "cases"
+
+# 一个预热任务：(类型, 案例ID, 第一幕选择, 变体序号)
+WarmTask = Tuple[str, str, str, int]
+
+
+def load_case_options(cases_dir: Path, case_ids: Optional[List[str]] = None) -> Dict[str, List[str]]:
+    """读取每个案例的第一幕选项"""
+    options = {}
+    for case_file in sorted(cases_dir.glob("*.json")):
+        with open(case_file, 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+        case_id = metadata.get('id')
+        if not case_id or (case_ids and case_id not in case_ids):
+            continue
+        if metadata.get('act_1_options'):
+            options[case_id] = list(metadata['act_1_options'])
+    return options
+
+
+def build_tasks(case_options: Dict[str, List[str]], variants: int) -> List[WarmTask]:
+    """展开全部(案例 × 选项)的预热任务"""
+    tasks = []
+    for case_id, choices in case_options.items():
+        for choice in choices:
+            tasks.extend(('question', case_id, choice, variant) for variant in range(variants))
+    return tasks
+
+
+def apply_rate_budget(budget: float, max_wait_s: float):
+    """批处理进程（预热、批量备忘录）只使用配额的一部分，线上副本仍有余量"""
+    EngineConfig.RATE_LIMITS = {
+        name: (max(1, int(rpm * budget)), max(1, int(tpm * budget)))
+        for name, (rpm, tpm) in EngineConfig.RATE_LIMITS.items()
+    }
+    rpm, tpm = EngineConfig.RATE_LIMIT_DEFAULT
+    EngineConfig.RATE_LIMIT_DEFAULT = (max(1, int(rpm * budget)), max(1, int(tpm * budget)))
+    rpm, tpm = EngineConfig.OPENAI_COMPAT_RATE_LIMIT
+    EngineConfig.OPENAI_COMPAT_RATE_LIMIT = (max(1, int(rpm * budget)), max(1, int(tpm * budget)))
+    EngineConfig.RATE_LIMIT_MAX_WAIT_S = max_wait_s
+
+
+def run_task(engine, task: WarmTask, deadline_s: float) -> Dict[str, Any]:
+    """执行一个预热任务（已存储的条目直接命中，不产生API调用）"""
+    _, case_id, choice, variant = task
+    context = {'case_id': case_id, 'act1_choice': choice}
+    return engine.generate_question_variant(context, variant, deadline=deadline_s)
+
+
+def warm(engine, tasks: List[WarmTask], workers: int, deadline_s: float) -> Dict[str, int]:
+    """并发执行预热任务，返回统计"""
+    summary = {'total': len(tasks), 'generated': 0, 'already_stored': 0, 'failed': 0}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cache-warmer") as pool:
+        futures = {pool.submit(run_task, engine, task, deadline_s): task for task in tasks}
+        for future in as_completed(futures):
+            kind, case_id, choice, variant = futures[future]
+            label = f"{kind} {case_id} {choice[:12]}… #{variant}"
+            try:
+                result = future.result()
+            except Exception as e:
+                summary['failed'] += 1
+                logging.error(f"[warm] {label}: {e}")
+                continue
+            if not result["success"]:
+                summary['failed'] += 1
+                logging.warning(f"[warm] {label}: {result['error_message']}")
+            elif result["debug_info"].get("response_store"):
+                summary['already_stored'] += 1
+                logging.info(f"[warm] {label}: 已存储")
+            else:
+                summary['generated'] += 1
+                logging.info(f"[warm] {label}: 已生成 ({result['model_used']})")
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="预热质疑问题的持久化结果存储")
+    parser.add_argument('--variants', type=int, default=EngineConfig.QUESTION_CACHE_VARIANTS,
+                        help="每个(案例, 选项)生成的质疑问题变体数")
+    parser.add_argument('--workers', type=int, default=4, help="并发请求数")
+    parser.add_argument('--budget', type=float, default=0.5, help="预热可使用的配额比例(0-1]")
+    parser.add_argument('--deadline', type=float, default=120.0, help="单个请求的截止时间（秒，含排队）")
+    parser.add_argument('--cases', nargs='*', help="只预热指定案例ID")
+    parser.add_argument('--cases-dir', type=Path, default=CASES_DIR)
+    args = parser.parse_args(argv)
+
+    if not EngineConfig.RESPONSE_STORE_ENABLED:
+        logging.error("持久化结果存储未启用(RESPONSE_STORE_ENABLED)，预热没有意义")
+        return 2
+
+    apply_rate_budget(min(1.0, max(0.01, args.budget)), args.deadline)
+
+    # 限流配置在引擎创建时读取，必须先调整配额再创建引擎
+    engine = AIEngine()
+    if not engine.is_initialized:
+        logging.error(engine.error_message)
+        return 2
+
+    case_options = load_case_options(args.cases_dir, args.cases)
+    tasks = build_tasks(case_options, max(1, args.variants))
+    logging.info(f"[warm] {len(case_options)}个案例，{len(tasks)}个预热任务")
+
+    started_at = time.time()
+    summary = warm(engine, tasks, max(1, args.workers), args.deadline)
+    summary['elapsed_s'] = round(time.time() - started_at, 1)
+    print(json.dumps(summary, ensure_ascii=False))
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,284 @@
+# core/cassette.py - 模型调用的录制与回放
+# 录制：把每次模型调用的请求与响应（含耗时、流式分块的到达时间、错误）追加到cassette文件
+# 回放：按规范化prompt取回录制的响应并按原始或缩放后的时间返回，压测时内容与延迟都接近真实且不发网络请求
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, Any, List, Optional, Iterator, Tuple
+from core.backends import BackendResponse, BackendStream
+
+
+def normalize_prompt(prompt: str) -> str:
+    """规范化prompt：合并空白字符，缩进与换行的差异不影响匹配"""
+    return re.sub(r'\s+', ' ', prompt).strip()
+
+
+def cassette_key(prompt: str) -> str:
+    return hashlib.sha256(normalize_prompt(prompt).encode('utf-8')).hexdigest()
+
+
+class CassetteMissError(Exception):
+    """回放时cassette中没有该prompt的录制"""
+
+
+class ReplayedError(Exception):
+    """回放录制时发生的错误"""
+
+
+def _replayed_error(entry: Dict[str, Any]) -> Exception:
+    """还原录制时的错误：类名与消息都与原错误一致（引擎按二者归类）"""
+    error_type = entry.get('error_type') or 'ReplayedError'
+    base = TimeoutError if error_type == 'TimeoutError' else ReplayedError
+    return type(error_type, (base,), {})(entry['error'])
+
+
+def _finish_reason(response) -> Optional[str]:
+    reason = getattr(response, 'finish_reason', None)
+    if reason is None:
+        candidates = getattr(response, 'candidates', None) or []
+        reason = getattr(candidates[0], 'finish_reason', None) if candidates else None
+    return getattr(reason, 'name', None) or (str(reason) if reason is not None else None)
+
+
+def _usage(response) -> Tuple[Optional[int], Optional[int]]:
+    usage = getattr(response, 'usage_metadata', None)
+    if not usage:
+        return None, None
+    return getattr(usage, 'total_token_count', None), getattr(usage, 'cached_content_token_count', None)
+
+
+def _block_reason(response) -> Optional[str]:
+    reason = getattr(getattr(response, 'prompt_feedback', None), 'block_reason', None)
+    return getattr(reason, 'name', None) or (str(reason) if reason else None)
+
+
+class Cassette:
+    """
+    cassette文件：每行一条录制（JSON Lines），多个进程可同时追加
+
+    同一prompt可有多条录制（变体、重试），回放时按出现顺序轮流取用；
+    优先使用同一模型的录制，没有时使用其他模型的录制。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: Optional[Dict[str, List[Dict[str, Any]]]] = None
+        self._cursors: Dict[Tuple[str, Optional[str]], int] = {}
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+
+    def append(self, entry: Dict[str, Any]):
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+            self.recorded += 1
+
+    def _load(self) -> Dict[str, List[Dict[str, Any]]]:
+        if self._entries is None:
+            self._entries = {}
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    for line_no, line in enumerate(f, 1):
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            logging.warning(f"Cassette {self.path}:{line_no} 无法解析，已跳过")
+                            continue
+                        self._entries.setdefault(entry['key'], []).append(entry)
+            logging.info(f"Cassette loaded {sum(map(len, self._entries.values()))} recordings from {self.path}")
+        return self._entries
+
+    def next_entry(self, key: str, model: str) -> Dict[str, Any]:
+        """取出该prompt的下一条录制"""
+        with self._lock:
+            recordings = self._load().get(key, [])
+            same_model = [entry for entry in recordings if entry.get('model') == model]
+            pool, cursor_key = (same_model, (key, model)) if same_model else (recordings, (key, None))
+            if not pool:
+                self.misses += 1
+                raise CassetteMissError(f"cassette miss: 没有该prompt的录制 ({key[:12]})")
+            cursor = self._cursors.get(cursor_key, 0)
+            self._cursors[cursor_key] = cursor + 1
+            self.replayed += 1
+            return pool[cursor % len(pool)]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'path': self.path,
+                'prompts': len(self._entries) if self._entries is not None else None,
+                'recorded': self.recorded,
+                'replayed': self.replayed,
+                'misses': self.misses
+            }
+
+
+class RecordingModel:
+    """透明地转发调用，并把请求、响应与耗时写入cassette"""
+
+    def __init__(self, inner, model_name: str, cassette: Cassette):
+        self.inner = inner
+        self.model_name = model_name
+        self.cassette = cassette
+
+    def _entry(self, prompt: str, generation_config, stream: bool) -> Dict[str, Any]:
+        return {
+            'key': cassette_key(prompt),
+            'model': self.model_name,
+            'prompt': normalize_prompt(prompt),
+            'generation_config': generation_config,
+            'stream': stream,
+            'recorded_at': time.time()
+        }
+
+    def generate_content(self, prompt: str, safety_settings=None, generation_config=None,
+                         stream: bool = False, request_options=None):
+        entry = self._entry(prompt, generation_config, stream)
+        started_at = time.time()
+        try:
+            response = self.inner.generate_content(prompt, safety_settings=safety_settings,
+                                                   generation_config=generation_config,
+                                                   stream=stream, request_options=request_options)
+        except Exception as e:
+            entry.update(latency_s=round(time.time() - started_at, 3), error=str(e), error_type=type(e).__name__)
+            self.cassette.append(entry)
+            raise
+        if stream:
+            return BackendStream(self._record_stream(entry, response, started_at))
+
+        entry['latency_s'] = round(time.time() - started_at, 3)
+        entry.update(self._response_fields(response))
+        self.cassette.append(entry)
+        return response
+
+    @staticmethod
+    def _response_fields(response) -> Dict[str, Any]:
+        text, text_error = "", None
+        if response is not None and getattr(response, 'parts', None):
+            try:
+                text = response.text or ""
+            except Exception as e:
+                text_error = str(e)
+        total_tokens, cached_tokens = _usage(response)
+        return {'text': text, 'text_error': text_error, 'finish_reason': _finish_reason(response),
+                'block_reason': _block_reason(response), 'total_tokens': total_tokens, 'cached_tokens': cached_tokens}
+
+    def _record_stream(self, entry: Dict[str, Any], response, started_at: float) -> Iterator[Any]:
+        """逐块转发并记录到达时间；调用方中途放弃消费时不写入（录制不完整）"""
+        chunks = []
+        try:
+            for chunk in response:
+                if getattr(chunk, 'parts', None):
+                    chunks.append([round(time.time() - started_at, 3), chunk.text])
+                yield chunk
+        except Exception as e:
+            entry.update(error=str(e), error_type=type(e).__name__)
+            self._finish_stream(entry, response, chunks, started_at)
+            raise
+        self._finish_stream(entry, response, chunks, started_at)
+
+    def _finish_stream(self, entry: Dict[str, Any], response, chunks: List[list], started_at: float):
+        entry['latency_s'] = round(time.time() - started_at, 3)
+        entry['chunks'] = chunks
+        entry['total_tokens'], entry['cached_tokens'] = _usage(response)
+        self.cassette.append(entry)
+
+
+class ReplayModel:
+    """从cassette取回响应，按time_scale缩放录制时的耗时（0为立即返回）"""
+
+    def __init__(self, model_name: str, cassette: Cassette, time_scale: float):
+        self.model_name = model_name
+        self.cassette = cassette
+        self.time_scale = time_scale
+
+    def _sleep_until(self, offset_s: float, started_at: float, deadline_at: Optional[float]):
+        target = started_at + offset_s * self.time_scale
+        if deadline_at is not None and target > deadline_at:
+            time.sleep(max(0.0, deadline_at - time.time()))
+            raise TimeoutError("回放: 请求超时")
+        time.sleep(max(0.0, target - time.time()))
+
+    def generate_content(self, prompt: str, safety_settings=None, generation_config=None,
+                         stream: bool = False, request_options=None):
+        started_at = time.time()
+        timeout = (request_options or {}).get('timeout')
+        deadline_at = started_at + timeout if timeout is not None else None
+        entry = self.cassette.next_entry(cassette_key(prompt), self.model_name)
+
+        if 'chunks' in entry and stream:
+            return BackendStream(self._replay_stream(entry, started_at, deadline_at))
+        self._sleep_until(entry.get('latency_s', 0.0), started_at, deadline_at)
+        if entry.get('error'):
+            raise _replayed_error(entry)
+        text = entry.get('text')
+        if text is None:
+            # 流式录制以非流式回放：拼接全部分块
+            text = "".join(piece for _, piece in entry.get('chunks', []))
+        response = BackendResponse(text, total_tokens=entry.get('total_tokens'),
+                                   finish_reason=entry.get('finish_reason'), block_reason=entry.get('block_reason'),
+                                   cached_tokens=entry.get('cached_tokens'))
+        if not stream:
+            return response
+        return BackendStream(iter([response]))
+
+    def _replay_stream(self, entry: Dict[str, Any], started_at: float,
+                       deadline_at: Optional[float]) -> Iterator[BackendResponse]:
+        chunks = entry.get('chunks', [])
+        for index, (offset_s, text) in enumerate(chunks):
+            self._sleep_until(offset_s, started_at, deadline_at)
+            last = index == len(chunks) - 1 and not entry.get('error')
+            yield BackendResponse(text, total_tokens=entry.get('total_tokens') if last else None,
+                                  cached_tokens=entry.get('cached_tokens') if last else None)
+        self._sleep_until(entry.get('latency_s', 0.0), started_at, deadline_at)
+        if entry.get('error'):
+            raise _replayed_error(entry)
+
+
+class CassetteBackend:
+    """
+    包装任意生成后端的录制/回放层
+
+    上下文缓存返回的模型不经过后端，会绕开录制，因此声明不支持上下文缓存（引擎发送并录制原始的完整prompt）。
+    回放模式不访问内层后端，不需要API Key与网络。
+    """
+    supports_context_cache = False
+
+    def __init__(self, inner, mode: str, path: str, time_scale: float = 1.0):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"未知的cassette模式: {mode}")
+        self.inner = inner
+        self.mode = mode
+        self.time_scale = time_scale
+        self.cassette = Cassette(path)
+        # 录制对引擎透明，沿用内层后端名；回放的结果不应与真实调用的持久化结果混用
+        self.name = inner.name if mode == 'record' else 'replay'
+        self.api_key_name = inner.api_key_name
+        self.requires_api_key = inner.requires_api_key and mode == 'record'
+
+    def configure(self, api_key: Optional[str]):
+        if self.mode == 'record':
+            self.inner.configure(api_key)
+
+    def create_model(self, model_name: str):
+        if self.mode == 'record':
+            return RecordingModel(self.inner.create_model(model_name), model_name, self.cassette)
+        return ReplayModel(model_name, self.cassette, self.time_scale)
+
+    def rate_limits(self):
+        return self.inner.rate_limits()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'name': self.name, 'cassette_mode': self.mode, 'time_scale': self.time_scale,
+                'cassette': self.cassette.get_stats(), 'inner': self.inner.get_stats()}
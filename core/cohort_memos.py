@@ -0,0 +1,263 @@
+# core/cohort_memos.py - 企业工作坊的批量备忘录生成
+# 读取学员CSV（姓名、案例、第一幕选择、个人原则），并发生成每人的认知免疫系统备忘录，
+# 写出Markdown文件与清单（manifest.jsonl）；中断后重新运行会跳过已完成的学员
+#
+# 用法：python -m core.cohort_memos cohort.csv --out memos/ --workers 8 --budget 0.5
+# CSV表头：name,case_id,act1_choice,principle（也接受 姓名/案例/选择/原则 等别名，可选id列）
+# 第一幕选择可以写完整选项或选项字母（A-D）；API Key从环境变量GEMINI_API_KEY读取（或.streamlit/secrets.toml）
+
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+from core.cache_warmer import CASES_DIR, load_case_options, apply_rate_budget
+from core.engine import AIEngine
+
+MANIFEST_NAME = "manifest.jsonl"
+
+# 表头别名 -> 字段
+COLUMN_ALIASES = {
+    'id': ('id', 'participant_id', '编号'),
+    'user_name': ('name', 'user_name', '姓名'),
+    'case_id': ('case', 'case_id', '案例'),
+    'act1_choice': ('act1_choice', 'choice', '选择', '第一幕选择'),
+    'user_principle': ('principle', 'user_principle', '原则', '个人原则'),
+}
+
+
+def _safe_component(text: str, limit: int = 40) -> str:
+    """只保留字母、数字、下划线与连字符，可安全用作文件名的一部分（不含路径分隔符与..）"""
+    return re.sub(r'[^\w-]+', '_', text).strip('_')[:limit]
+
+
+@dataclass(frozen=True)
+class Participant:
+    """一名学员的备忘录输入"""
+    participant_id: str
+    user_name: str
+    case_id: str
+    act1_choice: str
+    user_principle: str
+
+    def context(self) -> Dict[str, Any]:
+        """与UI流程一致的上下文字段"""
+        return {
+            'case_id': self.case_id,
+            'user_name': self.user_name,
+            'act1_choice': self.act1_choice,
+            'user_principle': self.user_principle
+        }
+
+    def filename(self) -> str:
+        safe_name = _safe_component(self.user_name) or 'participant'
+        return f"{_safe_component(self.participant_id)}_{safe_name}.md"
+
+
+def _resolve_choice(choice: str, options: List[str]) -> str:
+    """选项字母（A/B/C/D）换成案例的完整选项文本，使prompt与UI一致、可命中已预热的存储"""
+    letter = choice.strip().rstrip('.．、').upper()
+    if len(letter) == 1 and options:
+        for option in options:
+            if option.upper().startswith(letter):
+                return option
+    return choice.strip()
+
+
+def load_participants(csv_path: Path, case_options: Dict[str, List[str]]) -> Tuple[List[Participant], int]:
+    """
+    读取学员CSV，返回(学员列表, 无效行数)
+    id列的值只保留文件名安全的字符；没有id列（或清理后为空）时用行内容的指纹作为编号，调整行顺序不影响续跑
+    编号重复（清理后相同的id、同名同选择的学员）时追加后缀，避免并发写入同一文件、续跑时被误跳过
+    """
+    participants = []
+    invalid = 0
+    seen: Set[str] = set()
+    with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.DictReader(f)
+        header = {(name or '').strip().lower(): name for name in reader.fieldnames or []}
+        columns = {field: next((header[a.lower()] for a in aliases if a.lower() in header), None)
+                   for field, aliases in COLUMN_ALIASES.items()}
+        missing = [field for field in ('user_name', 'case_id', 'act1_choice') if columns[field] is None]
+        if missing:
+            raise ValueError(f"CSV缺少必要的列: {', '.join(missing)}")
+
+        for line_no, row in enumerate(reader, 2):
+            values = {field: (row.get(column) or '').strip() if column else '' for field, column in columns.items()}
+            case_id = values['case_id'].lower()
+            if not values['user_name'] or not case_id or not values['act1_choice']:
+                invalid += 1
+                logging.warning(f"[cohort] 第{line_no}行缺少姓名、案例或选择，已跳过")
+                continue
+            if case_id not in case_options:
+                logging.warning(f"[cohort] 第{line_no}行的案例 {case_id} 未知，将使用通用框架")
+            choice = _resolve_choice(values['act1_choice'], case_options.get(case_id, []))
+            principle = values['user_principle'] or '理性决策'
+            participant_id = _safe_component(values['id']) or hashlib.sha256(
+                "\n".join((values['user_name'], case_id, choice, principle)).encode('utf-8')
+            ).hexdigest()[:12]
+            if participant_id in seen:
+                base_id = participant_id
+                if values['id'] and values['id'] != base_id:
+                    # 清理前不同的id：用原始id的指纹区分，与行顺序无关
+                    participant_id = f"{base_id}-{hashlib.sha256(values['id'].encode('utf-8')).hexdigest()[:6]}"
+                suffix = 2
+                while participant_id in seen:
+                    participant_id = f"{base_id}-{suffix}"
+                    suffix += 1
+                logging.warning(f"[cohort] 第{line_no}行的编号 {base_id} 与前面的行重复，改用 {participant_id}")
+            seen.add(participant_id)
+            participants.append(Participant(participant_id, values['user_name'], case_id, choice, principle))
+    return participants, invalid
+
+
+def load_completed(out_dir: Path, include_fallbacks: bool) -> Set[str]:
+    """清单中已完成的学员（以最后一条记录为准，且Markdown文件仍在）"""
+    manifest_path = out_dir / MANIFEST_NAME
+    latest: Dict[str, Dict[str, Any]] = {}
+    if manifest_path.exists():
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                latest[record['id']] = record
+    return {
+        participant_id for participant_id, record in latest.items()
+        if (record['source'] == 'ai' or include_fallbacks) and (out_dir / record['file']).exists()
+    }
+
+
+class CohortWriter:
+    """写出Markdown文件并追加清单；先写文件再记清单，清单中的每条记录都有对应文件"""
+
+    def __init__(self, out_dir: Path):
+        self.out_dir = out_dir
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def write(self, participant: Participant, content: str, record: Dict[str, Any]):
+        path = self.out_dir / participant.filename()
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(content, encoding='utf-8')
+        os.replace(tmp_path, path)
+        line = json.dumps(dict(record, id=participant.participant_id, file=path.name,
+                               at=time.strftime('%Y-%m-%d %H:%M:%S')), ensure_ascii=False)
+        with self._lock:
+            with open(self.out_dir / MANIFEST_NAME, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+
+
+def generate_memo(engine, participant: Participant, writer: CohortWriter, deadline_s: float) -> Dict[str, Any]:
+    """为一名学员生成备忘录：与UI相同的prompt构建，失败时写入_get_premium_fallback_tool的备选版本"""
+    started_at = time.time()
+    context = participant.context()
+    try:
+        result = engine.generate_personalized_tool(context, deadline=deadline_s)
+    except Exception as e:
+        logging.exception(f"[cohort] {participant.participant_id} 生成异常")
+        result = {"success": False, "error_message": f"生成异常: {e}",
+                  "fallback_content": engine._get_premium_fallback_tool(context, participant.case_id)}
+    record = {
+        'name': participant.user_name,
+        'case_id': participant.case_id,
+        'act1_choice': participant.act1_choice,
+        'source': 'ai' if result["success"] else 'fallback',
+        'model': result.get("model_used") if result["success"] else None,
+        'error': result.get("error_message"),
+        'elapsed_s': round(time.time() - started_at, 2)
+    }
+    content = result["content"] if result["success"] else result["fallback_content"]
+    writer.write(participant, content, record)
+    return record
+
+
+def generate_cohort(engine, participants: List[Participant], out_dir: Path, workers: int,
+                    deadline_s: float, retry_fallbacks: bool = True) -> Dict[str, Any]:
+    """
+    并发生成一批学员的备忘录，返回统计
+    已完成的学员直接跳过；retry_fallbacks时上次以备选版本完成的学员重新生成
+    中断（Ctrl+C）时取消未开始的任务，已完成的部分保留在清单中，重新运行即可续跑
+    """
+    completed = load_completed(out_dir, include_fallbacks=not retry_fallbacks)
+    pending = [p for p in participants if p.participant_id not in completed]
+    summary = {'total': len(participants), 'skipped': len(participants) - len(pending),
+               'ai': 0, 'fallback': 0, 'failed': 0, 'interrupted': False}
+    writer = CohortWriter(out_dir)
+    logging.info(f"[cohort] {len(participants)}名学员，{summary['skipped']}名已完成，本次生成{len(pending)}份")
+
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cohort-memo")
+    try:
+        futures = {pool.submit(generate_memo, engine, p, writer, deadline_s): p for p in pending}
+        for done_count, future in enumerate(as_completed(futures), 1):
+            participant = futures[future]
+            try:
+                record = future.result()
+            except Exception as e:
+                summary['failed'] += 1
+                logging.error(f"[cohort] {participant.participant_id} {participant.user_name}: {e}")
+                continue
+            summary[record['source']] += 1
+            if record['source'] == 'fallback':
+                logging.warning(f"[cohort] {participant.participant_id} {participant.user_name}: "
+                                f"使用备选版本（{record['error']}）")
+            if done_count % 50 == 0 or done_count == len(pending):
+                logging.info(f"[cohort] 进度 {done_count}/{len(pending)}")
+    except KeyboardInterrupt:
+        summary['interrupted'] = True
+        logging.warning("[cohort] 已中断：取消未开始的任务，进行中的任务完成后写入清单")
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="按学员CSV批量生成认知免疫系统备忘录")
+    parser.add_argument('csv', type=Path, help="学员CSV文件")
+    parser.add_argument('--out', type=Path, default=Path('cohort_memos'), help="输出目录（Markdown文件与清单）")
+    parser.add_argument('--workers', type=int, default=8, help="并发请求数")
+    parser.add_argument('--budget', type=float, default=0.5, help="可使用的配额比例(0-1]，线上服务仍有余量")
+    parser.add_argument('--deadline', type=float, default=180.0, help="单份备忘录的截止时间（秒，含排队）")
+    parser.add_argument('--keep-fallbacks', action='store_true', help="续跑时不重新生成上次使用备选版本的学员")
+    parser.add_argument('--cases-dir', type=Path, default=CASES_DIR)
+    args = parser.parse_args(argv)
+
+    case_options = load_case_options(args.cases_dir)
+    try:
+        participants, invalid = load_participants(args.csv, case_options)
+    except (OSError, ValueError) as e:
+        logging.error(f"[cohort] 无法读取 {args.csv}: {e}")
+        return 2
+
+    # 限流配置在引擎创建时读取，必须先调整配额再创建引擎
+    apply_rate_budget(min(1.0, max(0.01, args.budget)), args.deadline)
+    engine = AIEngine()
+    if not engine.is_initialized:
+        logging.error(engine.error_message)
+        return 2
+
+    started_at = time.time()
+    summary = generate_cohort(engine, participants, args.out, max(1, args.workers), args.deadline,
+                              retry_fallbacks=not args.keep_fallbacks)
+    summary['invalid_rows'] = invalid
+    summary['elapsed_s'] = round(time.time() - started_at, 1)
+    print(json.dumps(summary, ensure_ascii=False))
+    if summary['interrupted']:
+        return 130
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
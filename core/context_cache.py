@@ -0,0 +1,202 @@
+# core/context_cache.py - 长系统提示的上下文缓存
+# 每个案例固定的SYSTEM前言只注册一次，之后的请求只发送因用户而异的部分
+
+import datetime
+import hashlib
+import logging
+import threading
+import time
+from typing import Dict, Any, Optional, Set, Tuple
+
+# 无法调用count_tokens时的估算：中英混合文本约每3个字符1个令牌
+CHARS_PER_TOKEN_ESTIMATE = 3
+
+
+class GeminiContextCacheBackend:
+    """Gemini上下文缓存（google.generativeai.caching.CachedContent）"""
+    name = "gemini"
+
+    def __init__(self, model_versions: Dict[str, str], min_tokens: int):
+        # 上下文缓存要求带版本号的模型名
+        self.model_versions = dict(model_versions)
+        self.min_tokens = min_tokens
+
+    def create(self, model_name: str, system_instruction: str, ttl_s: float):
+        from google.generativeai import caching
+        return caching.CachedContent.create(
+            model=self.model_versions.get(model_name, f"models/{model_name}"),
+            display_name=f"athena-{hashlib.sha256(system_instruction.encode('utf-8')).hexdigest()[:12]}",
+            system_instruction=system_instruction,
+            ttl=datetime.timedelta(seconds=ttl_s)
+        )
+
+    def refresh(self, handle, ttl_s: float):
+        handle.update(ttl=datetime.timedelta(seconds=ttl_s))
+        return handle
+
+    def count_tokens(self, base_model, text: str) -> int:
+        return base_model.count_tokens(text).total_tokens
+
+    def model_for(self, handle, base_model):
+        import google.generativeai as genai
+        return genai.GenerativeModel.from_cached_content(cached_content=handle)
+
+
+class _PrefixedModel:
+    """本地替身返回的模型：把缓存的前言拼接到prompt前，再交给原模型"""
+
+    def __init__(self, base_model, system_instruction: str):
+        self._base_model = base_model
+        self._system_instruction = system_instruction
+
+    def generate_content(self, prompt, **kwargs):
+        return self._base_model.generate_content(f"{self._system_instruction}\n\n{prompt}", **kwargs)
+
+
+class LocalContextCacheBackend:
+    """离线替身：行为与上下文缓存一致（注册、过期、刷新），但不节省令牌，供离线测试使用"""
+    name = "local"
+    min_tokens = 0
+
+    def create(self, model_name: str, system_instruction: str, ttl_s: float):
+        return {"model": model_name, "system_instruction": system_instruction}
+
+    def refresh(self, handle, ttl_s: float):
+        return handle
+
+    def count_tokens(self, base_model, text: str) -> int:
+        return len(text) // CHARS_PER_TOKEN_ESTIMATE
+
+    def model_for(self, handle, base_model):
+        return _PrefixedModel(base_model, handle["system_instruction"])
+
+
+class ContextCacheManager:
+    """
+    上下文缓存管理器：按(模型, 前言)维护缓存句柄
+
+    设计原则：
+    1. 到期前刷新：剩余有效期不足refresh_margin_s时延长TTL，避免请求落在过期的缓存上
+    2. 失败退避：创建失败（如SDK不支持）后在retry_s内直接回退为内联前言；
+       前言的令牌数（count_tokens，每个前言只统计一次）低于API的最小缓存令牌数时不尝试创建
+    3. 回退透明：无法使用缓存时返回None，调用方改为发送原始的完整prompt
+    4. 不在锁内发起网络调用：统计令牌、创建与刷新时先在锁内占用该键，调用期间其他请求
+       使用仍有效的句柄或直接回退，不排队等待（一次慢调用不会阻塞其他模型与案例的请求）
+    """
+
+    def __init__(self, backend, ttl_s: float = 3600.0, refresh_margin_s: float = 300.0,
+                 retry_s: float = 300.0, enabled: bool = True):
+        self.backend = backend
+        self.ttl_s = ttl_s
+        self.refresh_margin_s = refresh_margin_s
+        self.retry_s = retry_s
+        self.enabled = enabled
+        # (模型, 前言指纹) -> (句柄, 过期时间)
+        self._entries: Dict[Tuple[str, str], Tuple[Any, float]] = {}
+        self._failures: Dict[Tuple[str, str], Tuple[float, str]] = {}
+        self._token_counts: Dict[Tuple[str, str], int] = {}
+        # 正在统计令牌、创建或刷新缓存的键
+        self._inflight: Set[Tuple[str, str]] = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.created = 0
+        self.refreshed = 0
+        self.fallbacks = 0
+
+    def _count_tokens(self, model_name: str, system_instruction: str, base_model) -> int:
+        """前言的令牌数（不持有锁）；count_tokens失败时按字符数估算"""
+        try:
+            return self.backend.count_tokens(base_model, system_instruction)
+        except Exception as e:
+            logging.warning(f"Context cache count_tokens failed for {model_name}: {e}")
+            return len(system_instruction) // CHARS_PER_TOKEN_ESTIMATE
+
+    def _get_handle(self, model_name: str, system_instruction: str, base_model, count_hit: bool) -> Optional[Any]:
+        """取得（必要时创建或刷新）缓存句柄；无法使用缓存时返回None"""
+        if not self.enabled:
+            return None
+        key = (model_name, hashlib.sha256(system_instruction.encode('utf-8')).hexdigest())
+        now = time.time()
+        with self._lock:
+            failure = self._failures.get(key)
+            if failure and now - failure[0] < self.retry_s:
+                self.fallbacks += 1
+                return None
+            token_count = self._token_counts.get(key)
+            if self.backend.min_tokens and token_count is not None and token_count < self.backend.min_tokens:
+                # 前言低于API要求的最小缓存令牌数，缓存不可用
+                self.fallbacks += 1
+                return None
+
+            handle, expires_at = self._entries.get(key, (None, 0.0))
+            if handle is not None and expires_at - now >= self.refresh_margin_s:
+                if count_hit:
+                    self.hits += 1
+                return handle
+            if key in self._inflight:
+                # 其他请求正在为该键发起调用：未过期的句柄照常使用，否则本次回退
+                if handle is not None and expires_at > now:
+                    if count_hit:
+                        self.hits += 1
+                    return handle
+                self.fallbacks += 1
+                return None
+            self._inflight.add(key)
+
+        try:
+            if self.backend.min_tokens and token_count is None:
+                token_count = self._count_tokens(model_name, system_instruction, base_model)
+                with self._lock:
+                    self._token_counts[key] = token_count
+                if token_count < self.backend.min_tokens:
+                    with self._lock:
+                        self.fallbacks += 1
+                    return None
+
+            refreshing = handle is not None and expires_at > now
+            if refreshing:
+                handle = self.backend.refresh(handle, self.ttl_s)
+            else:
+                handle = self.backend.create(model_name, system_instruction, self.ttl_s)
+            with self._lock:
+                if refreshing:
+                    self.refreshed += 1
+                else:
+                    self.created += 1
+                self._entries[key] = (handle, time.time() + self.ttl_s)
+                self._failures.pop(key, None)
+            return handle
+        except Exception as e:
+            with self._lock:
+                self._entries.pop(key, None)
+                self._failures[key] = (now, str(e))
+                self.fallbacks += 1
+            logging.warning(f"Context cache unavailable for {model_name}: {e}")
+            return None
+        finally:
+            with self._lock:
+                self._inflight.discard(key)
+
+    def acquire(self, model_name: str, system_instruction: str, base_model) -> bool:
+        """构建请求前确认该模型能使用缓存前言（必要时创建缓存）；只有能使用时调用方才拆分prompt"""
+        return self._get_handle(model_name, system_instruction, base_model, count_hit=False) is not None
+
+    def get_model(self, model_name: str, system_instruction: str, base_model) -> Optional[Any]:
+        """返回绑定了缓存前言的模型；无法使用缓存时返回None"""
+        handle = self._get_handle(model_name, system_instruction, base_model, count_hit=True)
+        return None if handle is None else self.backend.model_for(handle, base_model)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取上下文缓存统计信息"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'backend': self.backend.name,
+                'min_tokens': self.backend.min_tokens,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'created': self.created,
+                'refreshed': self.refreshed,
+                'fallbacks': self.fallbacks,
+                'last_errors': [error for _, error in self._failures.values()][-3:]
+            }
@@ -0,0 +1,71 @@
+# core/deadline.py - 调用截止时间
+# 每次生成调用都有明确的时间预算，超时即返回fallback，页面延迟有上界
+
+import threading
+import time
+from typing import Dict, Any, Union
+
+
+class Deadline:
+    """一次调用的截止时间，贯穿排队、合并等待、API请求与重试"""
+
+    def __init__(self, timeout_s: float):
+        self.timeout_s = timeout_s
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + timeout_s
+
+    @classmethod
+    def resolve(cls, deadline: Union["Deadline", float, None], default_timeout_s: float) -> "Deadline":
+        """接受Deadline对象、秒数或None（使用默认预算）"""
+        if isinstance(deadline, Deadline):
+            return deadline
+        return cls(deadline if deadline is not None else default_timeout_s)
+
+    def remaining(self) -> float:
+        """剩余秒数，已过期时为0"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def consumed_fraction(self) -> float:
+        """已消耗的预算比例"""
+        return self.elapsed() / self.timeout_s if self.timeout_s > 0 else 1.0
+
+
+class DeadlineHistogram:
+    """按生成配置统计截止时间预算消耗比例的分布"""
+
+    # 消耗比例的桶上界，最后一个桶表示超时
+    BUCKETS = (0.1, 0.25, 0.5, 0.75, 0.9, 1.0, float('inf'))
+
+    def __init__(self):
+        self._counts: Dict[str, list] = {}
+        self._timeouts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, profile_name: str, consumed_fraction: float, timed_out: bool):
+        with self._lock:
+            counts = self._counts.setdefault(profile_name, [0] * len(self.BUCKETS))
+            for index, upper in enumerate(self.BUCKETS):
+                if consumed_fraction <= upper:
+                    counts[index] += 1
+                    break
+            if timed_out:
+                self._timeouts[profile_name] = self._timeouts.get(profile_name, 0) + 1
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                name: {
+                    'buckets': {
+                        ('>1.0' if upper == float('inf') else f'<={upper}'): count
+                        for upper, count in zip(self.BUCKETS, counts)
+                    },
+                    'timeouts': self._timeouts.get(name, 0)
+                }
+                for name, counts in self._counts.items()
+            }
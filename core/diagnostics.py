@@ -0,0 +1,74 @@
+# core/diagnostics.py - 分级、延迟生成的调用诊断
+# 诊断信息默认只采样一小部分调用，原始响应等重字段只在调试面板读取时才生成
+
+from typing import Dict, Any, Callable
+
+# 诊断采集级别
+DIAGNOSTICS_OFF = "off"          # 只保留错误类型等精简字段
+DIAGNOSTICS_SAMPLED = "sampled"  # 按比例抽样完整采集
+DIAGNOSTICS_FULL = "full"        # 每次调用完整采集
+
+DIAGNOSTICS_LEVELS = (DIAGNOSTICS_OFF, DIAGNOSTICS_SAMPLED, DIAGNOSTICS_FULL)
+
+
+class GenerationResult(dict):
+    """
+    生成结果：保持原有dict结构，调用方无需改动
+
+    设计原则：
+    1. 精简热路径：__slots__只多出两个字段，未完整采集的调用不记录过程性诊断
+    2. 延迟生成：重字段（如raw_response）登记为工厂函数，第一次被读取时才生成
+    3. 序列化前展开：json等直接遍历dict的场景需先调用materialize()
+    """
+    __slots__ = ('full', '_lazy')
+
+    def __init__(self, *args, full: bool = True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.full = full
+        self._lazy: Dict[str, Callable[[], Any]] = {}
+
+    def trace(self, key: str, value: Any):
+        """记录过程性诊断，仅完整采集的调用生效"""
+        if self.full:
+            self["debug_info"][key] = value
+
+    def set_lazy(self, key: str, factory: Callable[[], Any]):
+        """登记延迟生成的字段，未完整采集的调用直接丢弃"""
+        if self.full:
+            self._lazy[key] = factory
+        dict.__setitem__(self, key, None)
+
+    def _resolve(self, key: str):
+        factory = self._lazy.pop(key, None)
+        if factory is not None:
+            dict.__setitem__(self, key, factory())
+
+    def __getitem__(self, key):
+        self._resolve(key)
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        self._lazy.pop(key, None)
+        dict.__setitem__(self, key, value)
+
+    def get(self, key, default=None):
+        self._resolve(key)
+        return dict.get(self, key, default)
+
+    def update(self, *args, **kwargs):
+        for source in args:
+            if isinstance(source, GenerationResult):
+                self._lazy.update(source._lazy)
+                self.full = source.full
+        dict.update(self, *args, **kwargs)
+
+    def materialize(self) -> Dict[str, Any]:
+        """生成全部延迟字段，返回可直接序列化的普通dict"""
+        for key in list(self._lazy):
+            self._resolve(key)
+        return dict(self)
+
+
+def materialize(result: Dict[str, Any]) -> Dict[str, Any]:
+    """展开结果中的延迟字段（普通dict原样返回）- 供调试面板显示"""
+    return result.materialize() if isinstance(result, GenerationResult) else result
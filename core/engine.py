@@ -1,35 +1,129 @@
 # core/engine.py - v4.1 强制诊断版本
 # 信息透明原则：无论成功失败，都要让用户知道真相
 import streamlit as st
-import google.generativeai as genai
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, Tuple, Iterator, Optional, Union, Callable
+from concurrent.futures import Future
 import logging
 import json
+import os
+import random
+import hashlib
+import sqlite3
+import threading
+import time
+from config.settings import EngineConfig
+from core.question_cache import QuestionCache
+from core.model_router import ModelRouter
+from core.rate_limiter import RateLimiter
+from core.single_flight import SingleFlight
+from core.generation_profiles import GenerationProfile, ProfileStats, get_profile
+from core.hedging import Hedger
+from core.deadline import Deadline, DeadlineHistogram
+from core.response_store import ResponseStore
+from core.retry_policy import RetryPolicy
+from core.job_queue import JobQueue, JOB_DONE, JOB_QUEUED, JOB_FINISHED_STATES
+from core.context_cache import ContextCacheManager, GeminiContextCacheBackend, LocalContextCacheBackend
+from core.backends import create_backend
+from core.cassette import CassetteBackend
+from core.diagnostics import GenerationResult, DIAGNOSTICS_FULL, DIAGNOSTICS_SAMPLED, DIAGNOSTICS_LEVELS
+from core.metrics import REGISTRY
+from core.executor import submit_background, get_executor_stats, StreamingJob
 
 logging.basicConfig(level=logging.INFO)
 
+# 引擎指标：profile即generate_*的调用类型，source区分上游调用、持久化存储命中与合并请求
+CALLS = REGISTRY.counter("ai_engine_calls_total", "生成调用次数", ("profile", "model", "outcome", "source"))
+CALL_LATENCY = REGISTRY.histogram("ai_engine_call_latency_seconds", "生成调用端到端延迟", ("profile",))
+MODEL_LATENCY = REGISTRY.histogram("ai_model_attempt_latency_seconds", "单个模型的单次尝试延迟", ("model", "outcome"))
+ERRORS = REGISTRY.counter("ai_engine_errors_total", "按错误类型统计的失败调用", ("profile", "category"))
+FALLBACKS = REGISTRY.counter("ai_engine_fallbacks_total", "返回fallback内容的调用次数", ("profile",))
+TOKENS = REGISTRY.counter("ai_engine_tokens_total", "上游调用消耗的令牌数", ("profile", "model"))
+RETRIES = REGISTRY.counter("ai_engine_retries_total", "按错误类型统计的同模型重试次数", ("profile", "category"))
+CACHED_TOKENS = REGISTRY.counter("ai_engine_cached_tokens_total", "其中由上下文缓存提供的令牌数", ("profile", "model"))
+
 class AIEngine:
+    # 配额感知的优先策略：在配额耗尽期间优先使用可用模型
+    MODEL_PRIORITY = [
+        'gemini-1.5-flash',        # 临时优先：配额限制最宽松，确保可用性
+        'gemini-1.5-pro',          # 备选选项：稳定高质量
+        'gemini-2.5-pro'           # 配额恢复后的首选：最高质量
+    ]
+
+    # 进程级实例计数：用于观察共享引擎池节省了多少引擎实例
+    _instance_count = 0
+    _instance_count_lock = threading.Lock()
+
     def __init__(self):
+        with AIEngine._instance_count_lock:
+            AIEngine._instance_count += 1
         self.model = None
+        self.models = {}
+        self.router = None
         self.is_initialized = False
         self.error_message = None
         self.debug_info = {}
         self.current_model = None
+        # 生成后端在_initialize中创建，创建失败（如未知的后端名）与其他初始化失败一样记录为未初始化
+        self.backend = None
         self._initialize()
+        self.question_cache = QuestionCache(
+            max_keys=EngineConfig.QUESTION_CACHE_MAX_KEYS,
+            ttl_seconds=EngineConfig.QUESTION_CACHE_TTL_S,
+            variants_per_key=EngineConfig.QUESTION_CACHE_VARIANTS,
+            enabled=EngineConfig.QUESTION_CACHE_ENABLED
+        )
+        self.rate_limiter = RateLimiter(
+            *(self.backend.rate_limits() if self.backend else (EngineConfig.RATE_LIMITS, EngineConfig.RATE_LIMIT_DEFAULT)),
+            max_queue=EngineConfig.RATE_LIMIT_MAX_QUEUE,
+            enabled=EngineConfig.RATE_LIMIT_ENABLED
+        )
+        self.single_flight = SingleFlight(enabled=EngineConfig.SINGLE_FLIGHT_ENABLED)
+        self.profile_stats = ProfileStats()
+        self.deadline_stats = DeadlineHistogram()
+        self.response_store = ResponseStore(
+            EngineConfig.RESPONSE_STORE_PATH,
+            max_bytes=EngineConfig.RESPONSE_STORE_MAX_BYTES,
+            ttl_seconds=EngineConfig.RESPONSE_STORE_TTL_S,
+            enabled=EngineConfig.RESPONSE_STORE_ENABLED
+        )
+        self.job_queue = (JobQueue(EngineConfig.WORKER_QUEUE_PATH, EngineConfig.WORKER_JOB_RETENTION_S)
+                          if EngineConfig.WORKER_MODE_ENABLED else None)
+        self.retry_policy = RetryPolicy(EngineConfig.RETRY_POLICY, EngineConfig.RETRY_POLICY_DEFAULT)
+        self.context_cache = ContextCacheManager(
+            self._create_context_cache_backend(),
+            ttl_s=EngineConfig.CONTEXT_CACHE_TTL_S,
+            refresh_margin_s=EngineConfig.CONTEXT_CACHE_REFRESH_MARGIN_S,
+            retry_s=EngineConfig.CONTEXT_CACHE_RETRY_S,
+            # 生成后端不支持上下文缓存时不拆分prompt（本地替身不节省令牌），除非显式选择local用于离线测试
+            enabled=EngineConfig.CONTEXT_CACHE_ENABLED and (
+                EngineConfig.CONTEXT_CACHE_BACKEND == 'local' or getattr(self.backend, 'supports_context_cache', False))
+        )
+        self.diagnostics_level = EngineConfig.DIAGNOSTICS_LEVEL
+        if self.diagnostics_level not in DIAGNOSTICS_LEVELS:
+            logging.warning(f"Unknown diagnostics level {self.diagnostics_level}, using {DIAGNOSTICS_SAMPLED}.")
+            self.diagnostics_level = DIAGNOSTICS_SAMPLED
+        self.diagnostics_captured = 0
+        self.hedger = Hedger(max_workers=EngineConfig.HEDGING_WORKERS) if EngineConfig.HEDGING_ENABLED else None
+        self._register_metrics()
 
     def _initialize(self):
         try:
             self.debug_info['init_step'] = '开始初始化'
             
-            api_key = st.secrets.get("GEMINI_API_KEY")
-            if not api_key:
+            self.backend = create_backend(EngineConfig.GENERATION_BACKEND)
+            if EngineConfig.CASSETTE_MODE != 'off':
+                self.backend = CassetteBackend(self.backend, EngineConfig.CASSETTE_MODE, EngineConfig.CASSETTE_PATH,
+                                               EngineConfig.CASSETTE_TIME_SCALE)
+            self.debug_info['backend'] = self.backend.name
+            api_key = self._get_api_key(self.backend.api_key_name)
+            if not api_key and self.backend.requires_api_key:
                 self.debug_info['init_error'] = 'API Key未找到'
-                raise ValueError("API Key is missing in st.secrets.")
+                raise ValueError("API Key is missing in st.secrets and environment.")
             
-            self.debug_info['api_key_status'] = f'API Key获取成功: {api_key[:10]}...'
+            self.debug_info['api_key_status'] = f'API Key获取成功: {api_key[:10]}...' if api_key else '未使用API Key'
             
-            genai.configure(api_key=api_key)
-            self.debug_info['genai_config'] = '已配置genai'
+            self.backend.configure(api_key)
+            self.debug_info['backend_config'] = f'已配置{self.backend.name}后端'
             
             # 升级规约：使用Gemini 2.5 Pro作为主要模型
             self._initialize_with_premium_model()
@@ -44,33 +138,85 @@ class AIEngine:
             self.debug_info['init_error'] = str(e)
             logging.error(self.error_message)
 
+    @staticmethod
+    def _get_api_key(name: str = "GEMINI_API_KEY") -> Optional[str]:
+        """优先读取st.secrets，命令行工具等没有secrets文件的场景回退到环境变量"""
+        try:
+            api_key = st.secrets.get(name)
+        except Exception:
+            api_key = None
+        return api_key or os.environ.get(name)
+
     def _initialize_with_premium_model(self):
-        """配额感知的优先策略：在配额耗尽期间优先使用可用模型"""
-        model_priority = [
-            'gemini-1.5-flash',        # 临时优先：配额限制最宽松，确保可用性
-            'gemini-1.5-pro',          # 备选选项：稳定高质量
-            'gemini-2.5-pro'           # 配额恢复后的首选：最高质量
-        ]
-        
-        for model_name in model_priority:
+        """初始化优先级列表中的全部模型，由路由器在每次调用时选择"""
+        for model_name in self.MODEL_PRIORITY:
             try:
-                self.model = genai.GenerativeModel(model_name)
-                self.current_model = model_name
-                self.debug_info['model_init'] = f'{model_name}模型已初始化'
-                break
+                self.models[model_name] = self.backend.create_model(model_name)
+                self.debug_info[f'model_init_{model_name}'] = f'{model_name}模型已初始化'
             except Exception as e:
                 self.debug_info[f'model_init_fail_{model_name}'] = str(e)
                 continue
         
-        if not self.model:
+        if not self.models:
             raise ValueError("所有模型初始化失败")
+        
+        # 首选模型，保持原有的current_model语义
+        self.current_model = next(iter(self.models))
+        self.model = self.models[self.current_model]
+        self.debug_info['model_init'] = f'{self.current_model}模型已初始化'
+        
+        self.router = ModelRouter(
+            list(self.models.keys()),
+            failure_threshold=EngineConfig.ROUTER_FAILURE_THRESHOLD,
+            open_seconds=EngineConfig.ROUTER_OPEN_SECONDS,
+            ewma_alpha=EngineConfig.ROUTER_EWMA_ALPHA
+        )
+
+    def _create_context_cache_backend(self):
+        """上下文缓存后端：gemini为API的上下文缓存，local为离线替身（生成后端不支持上下文缓存时缓存不启用）"""
+        if EngineConfig.CONTEXT_CACHE_BACKEND == 'local' or not getattr(self.backend, 'supports_context_cache', False):
+            return LocalContextCacheBackend()
+        return GeminiContextCacheBackend(EngineConfig.CONTEXT_CACHE_MODEL_VERSIONS,
+                                         EngineConfig.CONTEXT_CACHE_MIN_TOKENS)
 
-    def _generate(self, prompt: str) -> Dict[str, Any]:
+    def _register_metrics(self):
+        """把各组件已有的统计导出为抓取时读取的指标"""
+        def stat(source, key):
+            return lambda: {(): source.get_stats()[key]}
+        
+        REGISTRY.register_callback("ai_question_cache_hits_total", "质疑问题缓存命中次数", "counter",
+                                   stat(self.question_cache, 'hits'))
+        REGISTRY.register_callback("ai_question_cache_misses_total", "质疑问题缓存未命中次数", "counter",
+                                   stat(self.question_cache, 'misses'))
+        REGISTRY.register_callback("ai_response_store_hits_total", "持久化存储命中次数", "counter",
+                                   stat(self.response_store, 'hits'))
+        REGISTRY.register_callback("ai_response_store_misses_total", "持久化存储未命中次数", "counter",
+                                   stat(self.response_store, 'misses'))
+        REGISTRY.register_callback("ai_single_flight_saved_calls_total", "合并请求节省的上游调用", "counter",
+                                   stat(self.single_flight, 'saved_calls'))
+        REGISTRY.register_callback("ai_context_cache_hits_total", "上下文缓存复用次数", "counter",
+                                   stat(self.context_cache, 'hits'))
+        REGISTRY.register_callback("ai_context_cache_fallbacks_total", "上下文缓存不可用、回退为内联前言的次数", "counter",
+                                   stat(self.context_cache, 'fallbacks'))
+        REGISTRY.register_callback("ai_rate_limit_rejected_total", "限流拒绝次数", "counter",
+                                   stat(self.rate_limiter, 'rejected'))
+        REGISTRY.register_callback("ai_rate_limit_waiting", "正在排队的请求数", "gauge",
+                                   stat(self.rate_limiter, 'waiting'))
+        REGISTRY.register_callback(
+            "ai_model_circuit_open", "模型熔断器是否打开（半开计为0.5）", "gauge",
+            lambda: {(name,): {'open': 1.0, 'half_open': 0.5}.get(health['state'], 0.0)
+                     for name, health in (self.router.get_routing_table() if self.router else {}).items()},
+            ("model",)
+        )
+
+    def _new_result(self, prompt: str, full: Optional[bool] = None) -> GenerationResult:
         """
-        强制诊断版本的生成方法
-        返回完整的诊断信息，绝不静默失败
+        构建统一的诊断结果结构
+        full为是否完整采集诊断，不传时按诊断级别决定（同一次调用的各次尝试应沿用同一决定）
         """
-        result = {
+        if full is None:
+            full = self._sample_diagnostics()
+        return GenerationResult({
             "success": False,
             "content": "",
             "error_message": None,
@@ -78,99 +224,763 @@ class AIEngine:
             "model_used": self.current_model,
             "prompt_length": len(prompt),
             "debug_info": {}
-        }
-        
+        }, full=full)
+
+    def _sample_diagnostics(self) -> bool:
+        """按诊断级别决定本次调用是否完整采集"""
+        if self.diagnostics_level == DIAGNOSTICS_FULL:
+            full = True
+        elif self.diagnostics_level == DIAGNOSTICS_SAMPLED:
+            full = random.random() < EngineConfig.DIAGNOSTICS_SAMPLE_RATE
+        else:
+            full = False
+        if full:
+            self.diagnostics_captured += 1
+        return full
+
+    def _check_ready(self, result: Dict[str, Any]) -> bool:
+        """引擎与模型可用性检查，不可用时写入诊断信息"""
         # 引擎初始化检查
         if not self.is_initialized:
             result["error_message"] = f"AI引擎未初始化: {self.error_message}"
             result["debug_info"]["engine_status"] = "未初始化"
-            return result
+            return False
         
         # 模型可用性检查
         if not self.model:
             result["error_message"] = "AI模型不可用"
             result["debug_info"]["model_status"] = "模型未加载"
-            return result
+            return False
+        
+        return True
+
+    @staticmethod
+    def _get_request_settings(profile: GenerationProfile) -> Tuple[list, Dict[str, Any]]:
+        """安全设置与按调用类型区分的生成配置"""
+        # 安全设置
+        safety_settings = [
+            {'category': c, 'threshold': 'BLOCK_NONE'} 
+            for c in ['HARM_CATEGORY_HARASSMENT', 'HARM_CATEGORY_HATE_SPEECH', 
+                     'HARM_CATEGORY_SEXUALLY_EXPLICIT', 'HARM_CATEGORY_DANGEROUS_CONTENT']
+        ]
+        
+        # 生成配置
+        generation_config = profile.generation_config()
+        
+        return safety_settings, generation_config
+
+    @staticmethod
+    def _record_exception(result: Dict[str, Any], e: Exception):
+        """记录API调用异常并标记错误类型"""
+        error_msg = str(e)
+        result["error_message"] = f"API调用异常: {error_msg}"
+        result["debug_info"]["exception_type"] = type(e).__name__
+        result["debug_info"]["exception_details"] = error_msg
+        
+        # 特殊错误类型标记
+        if '429' in error_msg or 'quota' in error_msg.lower():
+            result["debug_info"]["error_category"] = "配额限制"
+        elif AIEngine._is_content_block(e):
+            result["debug_info"]["error_category"] = "内容拦截"
+        elif (isinstance(e, TimeoutError) or '504' in error_msg or 'deadline' in error_msg.lower()
+              or 'timed out' in error_msg.lower() or 'timeout' in error_msg.lower()):
+            result["debug_info"]["error_category"] = "超时"
+        elif 'network' in error_msg.lower() or 'connection' in error_msg.lower():
+            result["debug_info"]["error_category"] = "网络错误"
+        else:
+            result["debug_info"]["error_category"] = "未知错误"
+
+    @staticmethod
+    def _is_content_block(e: Exception) -> bool:
+        """prompt或生成内容被安全策略拦截（重试不会改变结果）"""
+        error_msg = str(e).lower()
+        return (type(e).__name__ in ('BlockedPromptException', 'StopCandidateException')
+                or 'block_reason' in error_msg or ('finish_reason' in error_msg and 'safety' in error_msg))
+
+    @staticmethod
+    def _record_timeout(result: Dict[str, Any], stage: str):
+        """截止时间已到，标记超时（调用方据此返回fallback）"""
+        result["error_message"] = f"调用超时: {stage}"
+        result["debug_info"]["error_category"] = "超时"
+
+    @staticmethod
+    def _estimate_tokens(prompt: str, profile: GenerationProfile) -> int:
+        """估算一次调用的令牌用量：prompt长度 + 输出上限"""
+        return len(prompt) + profile.max_output_tokens
+
+    def _admit(self, model_name: str, prompt: str, result: Dict[str, Any], profile: GenerationProfile,
+               deadline: Deadline) -> Optional[int]:
+        """
+        申请限流准入，可能在此排队等待；排队时间不超过截止时间留给API调用的余量
+        准入时返回预留的令牌数；被拒绝时写入诊断信息并返回None
+        """
+        estimated_tokens = self._estimate_tokens(prompt, profile)
+        max_wait_s = min(EngineConfig.RATE_LIMIT_MAX_WAIT_S,
+                         deadline.remaining() - EngineConfig.DEADLINE_MIN_ATTEMPT_S)
+        admission = self.rate_limiter.acquire(model_name, estimated_tokens, max_wait_s)
+        if not admission.admitted:
+            result["error_message"] = f"请求限流: {admission.reason}"
+            result["debug_info"]["error_category"] = "限流拒绝"
+            return None
+        
+        if admission.wait_s > 0:
+            result["debug_info"]["queue_wait_s"] = round(admission.wait_s, 2)
+            result["debug_info"]["queue_position"] = admission.queue_position
         
+        return estimated_tokens
+
+    @staticmethod
+    def _get_token_count(response) -> Optional[int]:
+        """从响应中读取实际令牌用量"""
+        usage = getattr(response, 'usage_metadata', None)
+        return getattr(usage, 'total_token_count', None) if usage else None
+
+    @staticmethod
+    def _get_cached_token_count(response) -> Optional[int]:
+        """从响应中读取由上下文缓存提供的令牌数"""
+        usage = getattr(response, 'usage_metadata', None)
+        return getattr(usage, 'cached_content_token_count', None) if usage else None
+
+    @staticmethod
+    def _full_prompt(prompt: str, system_instruction: Optional[str]) -> str:
+        """前言 + 请求部分的完整prompt，用于请求指纹、持久化存储与令牌估算"""
+        return prompt if system_instruction is None else f"{system_instruction}\n\n{prompt}"
+
+    def _resolve_model(self, model_name: str, prompt: str, system_instruction: Optional[str],
+                       result: Dict[str, Any]) -> Tuple[Any, str]:
+        """
+        选择本次调用的模型对象与实际发送的prompt
+        有前言时优先使用绑定了缓存前言的模型，只发送请求部分；缓存不可用时把前言内联到prompt
+        """
+        if system_instruction is None:
+            return self.models[model_name], prompt
+        cached_model = self.context_cache.get_model(model_name, system_instruction, self.models[model_name])
+        if cached_model is not None:
+            result["debug_info"]["context_cache"] = "使用缓存前言"
+            return cached_model, prompt
+        result["debug_info"]["context_cache"] = "前言内联"
+        return self.models[model_name], self._full_prompt(prompt, system_instruction)
+
+    def get_admission_status(self) -> Dict[str, Any]:
+        """获取限流排队状态 - 供等待界面显示排队进度；worker模式下为任务队列的排队情况"""
+        if self.job_queue is not None:
+            stats = self.job_queue.get_stats(EngineConfig.WORKER_STALE_S)
+            waiting = stats.get('jobs', {}).get(JOB_QUEUED, 0)
+            capacity = max(1, stats.get('worker_threads', 0))
+            return {
+                'waiting': waiting,
+                'waiting_by_model': {},
+                'expected_wait_s': round(waiting * (stats.get('avg_run_s') or 0.0) / capacity, 1),
+                'max_queue': None
+            }
+        primary = self.router.candidates()[:1] if self.router else []
+        return self.rate_limiter.get_status(primary[0] if primary else None)
+
+    def _call_model(self, model_name: str, prompt: str, result: Dict[str, Any], profile: GenerationProfile,
+                    deadline: Deadline, system_instruction: Optional[str] = None):
+        """对单个模型执行一次API调用，把结果与诊断写入result；请求超时取截止时间的剩余部分"""
         try:
-            result["debug_info"]["api_call_start"] = "开始API调用"
+            result.trace("api_call_start", "开始API调用")
             
-            # 安全设置
-            safety_settings = [
-                {'category': c, 'threshold': 'BLOCK_NONE'} 
-                for c in ['HARM_CATEGORY_HARASSMENT', 'HARM_CATEGORY_HATE_SPEECH', 
-                         'HARM_CATEGORY_SEXUALLY_EXPLICIT', 'HARM_CATEGORY_DANGEROUS_CONTENT']
-            ]
-            
-            # 生成配置
-            generation_config = {
-                'temperature': 0.8,
-                'top_p': 0.9,
-                'top_k': 40,
-                'max_output_tokens': 2000
-            }
+            safety_settings, generation_config = self._get_request_settings(profile)
+            model, request_prompt = self._resolve_model(model_name, prompt, system_instruction, result)
             
             # 执行API调用
-            response = self.model.generate_content(
-                prompt, 
+            response = model.generate_content(
+                request_prompt, 
                 safety_settings=safety_settings,
-                generation_config=generation_config
+                generation_config=generation_config,
+                request_options={'timeout': deadline.remaining()}
             )
             
-            result["debug_info"]["api_call_complete"] = "API调用完成"
-            result["raw_response"] = str(response) if response else "空响应"
+            result.trace("api_call_complete", "API调用完成")
+            result["debug_info"]["token_count"] = self._get_token_count(response)
+            result["debug_info"]["cached_token_count"] = self._get_cached_token_count(response)
+            # 原始响应只在被读取时才转换为字符串
+            result.set_lazy("raw_response", lambda: str(response) if response else "空响应")
             
             # 详细的响应检查
             if not response:
                 result["error_message"] = "API返回空响应"
                 result["debug_info"]["response_status"] = "空响应"
-                return result
+                return
             
             if not hasattr(response, 'parts') or not response.parts:
                 result["error_message"] = "API响应缺少内容部分"
                 result["debug_info"]["response_status"] = "无parts属性或parts为空"
-                result["debug_info"]["response_attributes"] = dir(response)
-                return result
+                block_reason = getattr(getattr(response, 'prompt_feedback', None), 'block_reason', None)
+                if block_reason:
+                    result["debug_info"]["error_category"] = "内容拦截"
+                    result["debug_info"]["block_reason"] = str(block_reason)
+                if result.full:
+                    result["debug_info"]["response_attributes"] = dir(response)
+                return
             
             # 提取文本内容
             try:
                 text_content = response.text
-                result["debug_info"]["text_extraction"] = "成功提取文本"
-                result["debug_info"]["text_length"] = len(text_content) if text_content else 0
+                result.trace("text_extraction", "成功提取文本")
+                result.trace("text_length", len(text_content) if text_content else 0)
                 
                 if not text_content or text_content.strip() == "":
                     result["error_message"] = "API返回空文本内容"
                     result["debug_info"]["content_status"] = "文本为空"
-                    return result
+                    return
                 
                 # 成功情况
                 result["success"] = True
                 result["content"] = text_content.strip()
-                result["debug_info"]["final_status"] = "成功"
-                
-                return result
+                result.trace("final_status", "成功")
                 
             except Exception as text_error:
                 result["error_message"] = f"文本提取失败: {str(text_error)}"
                 result["debug_info"]["text_extraction_error"] = str(text_error)
-                return result
+                if self._is_content_block(text_error):
+                    result["debug_info"]["error_category"] = "内容拦截"
             
         except Exception as e:
             # 捕获所有API调用异常
-            error_msg = str(e)
-            result["error_message"] = f"API调用异常: {error_msg}"
-            result["debug_info"]["exception_type"] = type(e).__name__
-            result["debug_info"]["exception_details"] = error_msg
-            
-            # 特殊错误类型标记
-            if '429' in error_msg or 'quota' in error_msg.lower():
-                result["debug_info"]["error_category"] = "配额限制"
-            elif 'network' in error_msg.lower() or 'connection' in error_msg.lower():
-                result["debug_info"]["error_category"] = "网络错误"
+            self._record_exception(result, e)
+
+    def _routing_candidates(self, result: Dict[str, Any], profile: GenerationProfile,
+                            prefer_alternate: bool = False) -> list:
+        """
+        获取本次调用的候选模型（偏好模型优先），全部熔断时写入诊断信息
+        prefer_alternate时首选模型排到最后，供对冲请求避开主请求所用的模型
+        """
+        candidates = profile.order_models(self.router.candidates())
+        if prefer_alternate and len(candidates) > 1:
+            candidates = candidates[1:] + candidates[:1]
+        if not candidates:
+            result["error_message"] = "所有模型均处于熔断状态"
+            result["debug_info"]["error_category"] = "熔断"
+            result["debug_info"]["routing_table"] = self.router.get_routing_table()
+        return candidates
+
+    def _request_key(self, prompt: str, profile: GenerationProfile, variant: int = 0) -> str:
+        """请求指纹：prompt + 生成配置 + 变体序号，用于识别完全相同的请求"""
+        _, generation_config = self._get_request_settings(profile)
+        payload = json.dumps({"prompt": prompt, "generation_config": generation_config, "variant": variant},
+                             ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _uses_response_store(self, profile: GenerationProfile) -> bool:
+        return profile.name in EngineConfig.RESPONSE_STORE_PROFILES
+
+    def _store_model_key(self, model_name: str) -> str:
+        """持久化存储中的模型标识：非gemini后端带上后端名，避免不同后端的结果互相命中"""
+        return model_name if self.backend.name == 'gemini' else f"{self.backend.name}:{model_name}"
+
+    def _load_stored(self, prompt: str, profile: GenerationProfile, variant: int) -> Optional[Dict[str, Any]]:
+        """按模型偏好顺序查找持久化存储中的成功结果"""
+        _, generation_config = self._get_request_settings(profile)
+        for model_name in profile.order_models(list(self.models)):
+            stored = self.response_store.get(
+                ResponseStore.make_key(self._store_model_key(model_name), prompt, generation_config, variant)
+            )
+            if stored is None:
+                continue
+            result = self._new_result(prompt)
+            result["success"] = True
+            result["content"] = stored["content"]
+            result["model_used"] = model_name
+            result["debug_info"]["profile"] = profile.name
+            result["debug_info"]["token_count"] = stored.get("token_count")
+            result["debug_info"]["response_store"] = "持久化存储命中"
+            result.trace("final_status", "成功")
+            return result
+        return None
+
+    def _save_stored(self, result: Dict[str, Any], prompt: str, profile: GenerationProfile, variant: int):
+        """把成功结果写入持久化存储，键使用实际应答的模型"""
+        _, generation_config = self._get_request_settings(profile)
+        self.response_store.put(
+            ResponseStore.make_key(self._store_model_key(result["model_used"]), prompt, generation_config, variant),
+            {"content": result["content"], "token_count": result["debug_info"].get("token_count")}
+        )
+
+    def _generate(self, prompt: str, profile_name: str = 'default',
+                  deadline: Union[Deadline, float, None] = None, variant: int = 0,
+                  validate: Optional[Callable[[str], bool]] = None,
+                  system_instruction: Optional[str] = None) -> Dict[str, Any]:
+        """
+        强制诊断版本的生成方法
+        返回完整的诊断信息，绝不静默失败；相同的在途请求（跨会话）合并为一次上游调用
+        profile_name选择该类调用的生成配置（输出上限、停止序列、模型偏好）
+        deadline为本次调用的时间预算（秒或Deadline），不传时使用该配置的默认预算；超时返回error_category为超时的结果
+        variant为持久化存储中的变体序号，同一prompt需要多个不同结果时使用
+        validate用于结构化输出：内容校验不通过的结果不写入持久化存储
+        system_instruction为固定前言，可用时注册为上下文缓存，prompt只包含每次请求不同的部分
+        """
+        profile = get_profile(profile_name)
+        deadline = Deadline.resolve(deadline, profile.timeout_s)
+        full_prompt = self._full_prompt(prompt, system_instruction)
+        use_store = self._uses_response_store(profile) and self.is_initialized
+        if use_store:
+            stored = self._load_stored(full_prompt, profile, variant)
+            if stored is not None:
+                self._record_outcome(stored, profile, deadline)
+                return stored
+        try:
+            result, coalesced = self.single_flight.do(
+                self._request_key(full_prompt, profile, variant),
+                lambda: self._execute(prompt, profile, deadline, system_instruction),
+                timeout=deadline.remaining()
+            )
+        except TimeoutError:
+            result, coalesced = self._new_result(prompt), False
+            result["debug_info"]["profile"] = profile.name
+            self._record_timeout(result, "等待合并请求的结果")
+        if coalesced:
+            result["debug_info"]["single_flight"] = "合并到进行中的相同请求"
+        elif use_store and result["success"] and (validate is None or validate(result["content"])):
+            self._save_stored(result, full_prompt, profile, variant)
+        self._record_outcome(result, profile, deadline)
+        return result
+
+    def _record_outcome(self, result: Dict[str, Any], profile: GenerationProfile, deadline: Deadline):
+        """一次调用结束：记录截止时间预算消耗与调用指标"""
+        consumed = deadline.consumed_fraction()
+        error_category = result["debug_info"].get("error_category")
+        self.deadline_stats.record(profile.name, consumed, error_category == "超时")
+        result["debug_info"]["deadline_budget_s"] = deadline.timeout_s
+        result["debug_info"]["deadline_consumed"] = round(consumed, 3)
+        
+        if result["debug_info"].get("response_store"):
+            source = "response_store"
+        elif result["debug_info"].get("single_flight"):
+            source = "single_flight"
+        else:
+            source = "api"
+        outcome = "success" if result["success"] else "fallback"
+        CALLS.inc(profile=profile.name, model=result["model_used"], outcome=outcome, source=source)
+        CALL_LATENCY.observe(deadline.elapsed(), profile=profile.name)
+        if not result["success"]:
+            FALLBACKS.inc(profile=profile.name)
+            ERRORS.inc(profile=profile.name, category=error_category or "内容异常")
+        token_count = result["debug_info"].get("token_count")
+        if source == "api" and token_count:
+            TOKENS.inc(token_count, profile=profile.name, model=result["model_used"])
+        cached_token_count = result["debug_info"].get("cached_token_count")
+        if source == "api" and cached_token_count:
+            CACHED_TOKENS.inc(cached_token_count, profile=profile.name, model=result["model_used"])
+
+    def _should_hedge(self, profile: GenerationProfile) -> bool:
+        return self.hedger is not None and profile.name in EngineConfig.HEDGING_PROFILES
+
+    def _hedge_delay(self, series: str) -> float:
+        """对冲触发阈值：近期延迟的分位数，样本不足时使用默认值"""
+        delay = self.profile_stats.latency_percentile(
+            series, EngineConfig.HEDGING_PERCENTILE, EngineConfig.HEDGING_MIN_SAMPLES
+        )
+        return delay if delay is not None else EngineConfig.HEDGING_DEFAULT_DELAY_S
+
+    def _execute(self, prompt: str, profile: GenerationProfile, deadline: Deadline,
+                 system_instruction: Optional[str] = None) -> Dict[str, Any]:
+        """执行一次上游生成：worker模式下提交到任务队列由worker进程执行，否则在本进程执行"""
+        if self.job_queue is not None:
+            return self._execute_remote(prompt, profile, deadline, system_instruction)
+        return self._execute_with_hedging(prompt, profile, deadline, system_instruction)
+
+    @staticmethod
+    def _job_payload(prompt: str, profile: GenerationProfile, system_instruction: Optional[str]) -> Dict[str, Any]:
+        return {"prompt": prompt, "profile": profile.name, "system_instruction": system_instruction}
+
+    def _wait_for_job(self, job_id: str, deadline: Deadline) -> Optional[Dict[str, Any]]:
+        """轮询任务直到结束；截止时间到期时取消任务并返回None"""
+        while True:
+            job = self.job_queue.get(job_id)
+            if job is None or job["status"] in JOB_FINISHED_STATES:
+                return job
+            if deadline.expired():
+                self.job_queue.cancel(job_id)
+                return None
+            time.sleep(EngineConfig.WORKER_POLL_INTERVAL_S)
+
+    @staticmethod
+    def _record_queue_error(result: Dict[str, Any], error: Exception):
+        """任务队列读写失败（数据库锁定、目录不可写、磁盘已满）：记录为失败结果，由调用方使用fallback"""
+        logging.error(f"Job queue unavailable: {error}")
+        result["error_message"] = f"任务队列不可用: {error}"
+        result["debug_info"]["error_category"] = "任务队列错误"
+
+    def _apply_job_result(self, result: Dict[str, Any], job_id: str, job: Optional[Dict[str, Any]]):
+        """把worker返回的结果（或失败原因）写入result"""
+        if job is None or job["status"] not in JOB_FINISHED_STATES:
+            self._record_timeout(result, "等待worker执行结果")
+        elif job["status"] == JOB_DONE:
+            debug_info = result["debug_info"]
+            result.update(job["result"])
+            result["debug_info"] = {**job["result"].get("debug_info", {}), **debug_info}
+        else:
+            result["error_message"] = f"worker任务未完成: {job['error'] or job['status']}"
+            result["debug_info"]["error_category"] = "超时" if job["error"] == "排队超过截止时间" else "worker错误"
+        if job is not None and job.get("started_at"):
+            result["debug_info"]["worker_queue_wait_s"] = round(job["started_at"] - job["created_at"], 3)
+
+    def _execute_remote(self, prompt: str, profile: GenerationProfile, deadline: Deadline,
+                        system_instruction: Optional[str] = None) -> Dict[str, Any]:
+        """提交生成任务并轮询结果，排队与执行都受同一截止时间约束"""
+        result = self._new_result(prompt)
+        result["debug_info"]["profile"] = profile.name
+        try:
+            job_id = self.job_queue.submit('generate', self._job_payload(prompt, profile, system_instruction),
+                                           deadline.remaining())
+            result["debug_info"]["worker_job"] = job_id
+            job = self._wait_for_job(job_id, deadline)
+        except (sqlite3.Error, OSError) as e:
+            self._record_queue_error(result, e)
+            return result
+        self._apply_job_result(result, job_id, job)
+        return result
+
+    def _execute_stream_remote(self, prompt: str, profile: GenerationProfile, deadline: Deadline,
+                               system_instruction: Optional[str] = None) -> Tuple[Iterator[str], Dict[str, Any]]:
+        """提交流式任务，轮询worker写入的部分文本并逐段产出"""
+        result = self._new_result(prompt)
+        result.trace("stream_mode", "流式生成")
+        result["debug_info"]["profile"] = profile.name
+        try:
+            job_id = self.job_queue.submit('stream', self._job_payload(prompt, profile, system_instruction),
+                                           deadline.remaining())
+        except (sqlite3.Error, OSError) as e:
+            self._record_queue_error(result, e)
+            return iter(()), result
+        result["debug_info"]["worker_job"] = job_id
+        
+        def chunk_iterator() -> Iterator[str]:
+            sent = 0
+            job = None
+            queue_error = None
+            try:
+                while True:
+                    try:
+                        job = self.job_queue.get(job_id)
+                    except (sqlite3.Error, OSError) as e:
+                        queue_error = e
+                        break
+                    if job is None:
+                        break
+                    if len(job["partial"]) > sent:
+                        yield job["partial"][sent:]
+                        sent = len(job["partial"])
+                    if job["status"] in JOB_FINISHED_STATES or deadline.expired():
+                        break
+                    time.sleep(EngineConfig.WORKER_POLL_INTERVAL_S)
+            finally:
+                if job is None or job["status"] not in JOB_FINISHED_STATES:
+                    # 超时或调用方放弃消费，worker在下次写入时停止
+                    try:
+                        self.job_queue.cancel(job_id)
+                    except (sqlite3.Error, OSError) as e:
+                        logging.warning(f"Job queue cancel failed for {job_id}: {e}")
+            if queue_error is not None:
+                self._record_queue_error(result, queue_error)
             else:
-                result["debug_info"]["error_category"] = "未知错误"
-            
+                self._apply_job_result(result, job_id, job)
+            if not result["success"] and sent:
+                result["debug_info"]["partial_content"] = job["partial"] if job else ""
+        
+        return chunk_iterator(), result
+
+    def _execute_stream(self, prompt: str, profile: GenerationProfile, deadline: Deadline,
+                        system_instruction: Optional[str] = None) -> Tuple[Iterator[str], Dict[str, Any]]:
+        """执行一次上游流式生成：worker模式下由worker进程执行，否则按配置决定是否对冲"""
+        if self.job_queue is not None:
+            return self._execute_stream_remote(prompt, profile, deadline, system_instruction)
+        if not self._should_hedge(profile):
+            return self._generate_stream_once(prompt, profile, deadline, system_instruction=system_instruction)
+        return self.hedger.stream(
+            lambda: self._generate_stream_once(prompt, profile, deadline, system_instruction=system_instruction),
+            lambda: self._generate_stream_once(prompt, profile, deadline, prefer_alternate=True,
+                                               system_instruction=system_instruction),
+            self._hedge_delay(f"{profile.name}.first_chunk")
+        )
+
+    def _execute_with_hedging(self, prompt: str, profile: GenerationProfile, deadline: Deadline,
+                              system_instruction: Optional[str] = None) -> Dict[str, Any]:
+        """按配置决定是否对冲地执行一次上游生成；两路共享同一截止时间"""
+        if not self._should_hedge(profile):
+            return self._execute_generate(prompt, profile, deadline, system_instruction=system_instruction)
+        return self.hedger.call(
+            lambda: self._execute_generate(prompt, profile, deadline, system_instruction=system_instruction),
+            lambda: self._execute_generate(prompt, profile, deadline, prefer_alternate=True,
+                                           system_instruction=system_instruction),
+            self._hedge_delay(profile.name)
+        )
+
+    def _execute_generate(self, prompt: str, profile: GenerationProfile, deadline: Deadline,
+                          prefer_alternate: bool = False, system_instruction: Optional[str] = None) -> Dict[str, Any]:
+        """
+        执行一次上游生成
+        API异常时在同一次调用内切换到下一个模型，截止时间所剩无几时不再发起新的尝试
+        """
+        result = self._new_result(prompt)
+        result["debug_info"]["profile"] = profile.name
+        
+        if not self._check_ready(result):
             return result
+        
+        started_at = time.time()
+        routing_attempts = []
+        retry_delays = []
+        finished = False
+        for model_name in self._routing_candidates(result, profile, prefer_alternate):
+            retries_done = 0
+            while not finished:
+                if deadline.remaining() < EngineConfig.DEADLINE_MIN_ATTEMPT_S:
+                    self._record_timeout(result, "截止时间内未能得到可用结果")
+                    finished = True
+                    break
+                if not self.router.try_acquire(model_name):
+                    break
+                
+                attempt = self._new_result(prompt, full=result.full)
+                attempt["model_used"] = model_name
+                
+                # 限流准入：该模型配额排队过久时直接尝试下一个模型
+                attempt["debug_info"]["profile"] = profile.name
+                estimated_tokens = self._admit(model_name, self._full_prompt(prompt, system_instruction),
+                                               attempt, profile, deadline)
+                if estimated_tokens is None:
+                    self.router.release(model_name)
+                    routing_attempts.append({"model": model_name, "latency_s": 0.0, "error_category": "限流拒绝"})
+                    result = attempt
+                    result["debug_info"]["routing_attempts"] = routing_attempts
+                    break
+                
+                attempt_started_at = time.time()
+                self._call_model(model_name, prompt, attempt, profile, deadline, system_instruction)
+                latency = time.time() - attempt_started_at
+                self.rate_limiter.settle(model_name, estimated_tokens, attempt["debug_info"].get("token_count"))
+                
+                error_category = attempt["debug_info"].get("error_category")
+                MODEL_LATENCY.observe(latency, model=model_name, outcome="error" if error_category else "ok")
+                routing_attempts.append({
+                    "model": model_name,
+                    "latency_s": round(latency, 3),
+                    "error_category": error_category
+                })
+                result = attempt
+                result["debug_info"]["routing_attempts"] = routing_attempts
+                
+                # 响应内容问题与内容拦截属于正常应答，不计入模型故障，也不重试
+                if error_category is None or self.retry_policy.should_stop(error_category):
+                    self.router.record_success(model_name, latency)
+                    finished = True
+                    break
+                self.router.record_failure(model_name, latency, error_category)
+                
+                # 按错误类型决定退避后重试同一模型，还是切换到下一个模型
+                delay = self.retry_policy.retry_delay(
+                    error_category, retries_done, deadline.remaining() - EngineConfig.DEADLINE_MIN_ATTEMPT_S
+                )
+                if delay is None:
+                    break
+                retries_done += 1
+                retry_delays.append(round(delay, 3))
+                RETRIES.inc(profile=profile.name, category=error_category)
+                time.sleep(delay)
+            if finished:
+                break
+        
+        result["debug_info"]["retry_count"] = len(retry_delays)
+        if retry_delays:
+            result["debug_info"]["retry_delays_s"] = retry_delays
+        
+        if not routing_attempts and not result["error_message"]:
+            # 候选模型都在等待半开探测结果
+            result["error_message"] = "所有模型均处于熔断状态"
+            result["debug_info"]["error_category"] = "熔断"
+        
+        self.profile_stats.record(profile.name, time.time() - started_at, result["success"],
+                                  result["debug_info"].get("token_count"))
+        return result
+
+    def _generate_stream(self, prompt: str, profile_name: str = 'default',
+                         deadline: Union[Deadline, float, None] = None,
+                         system_instruction: Optional[str] = None) -> Tuple[Iterator[str], Dict[str, Any]]:
+        """
+        流式生成方法 - 使用SDK的stream模式逐块返回文本
+        返回(文本块迭代器, 诊断结果)；诊断结果在迭代器耗尽后才完整
+        启用对冲时，首块迟迟未到会再发一路流式请求，先出字的一路胜出
+        截止时间从调用时开始计算，到期后停止接收并保留已收到的部分
+        system_instruction同_generate
+        """
+        profile = get_profile(profile_name)
+        deadline = Deadline.resolve(deadline, profile.timeout_s)
+        full_prompt = self._full_prompt(prompt, system_instruction)
+        use_store = self._uses_response_store(profile) and self.is_initialized
+        if use_store:
+            stored = self._load_stored(full_prompt, profile, 0)
+            if stored is not None:
+                stored.trace("stream_mode", "流式生成")
+                self._record_outcome(stored, profile, deadline)
+                return iter([stored["content"]]), stored
+        
+        chunks, result = self._execute_stream(prompt, profile, deadline, system_instruction)
+        
+        def recording_iterator() -> Iterator[str]:
+            try:
+                yield from chunks
+                if use_store and result["success"]:
+                    self._save_stored(result, full_prompt, profile, 0)
+            finally:
+                # 对冲时两路共享同一结果，只在这里记录一次
+                self._record_outcome(result, profile, deadline)
+        
+        return recording_iterator(), result
+
+    def _generate_stream_once(self, prompt: str, profile: GenerationProfile, deadline: Deadline,
+                              prefer_alternate: bool = False,
+                              system_instruction: Optional[str] = None) -> Tuple[Iterator[str], Dict[str, Any]]:
+        """
+        单路流式生成
+        首个文本块到达前失败可切换模型，之后失败则保留已收到的部分
+        """
+        result = self._new_result(prompt)
+        result.trace("stream_mode", "流式生成")
+        result["debug_info"]["profile"] = profile.name
+        
+        def chunk_iterator() -> Iterator[str]:
+            if not self._check_ready(result):
+                return
+            
+            stream_started_at = time.time()
+            try:
+                yield from stream_attempts()
+            finally:
+                self.profile_stats.record(profile.name, time.time() - stream_started_at, result["success"],
+                                          result["debug_info"].get("token_count"))
+        
+        def stream_attempts() -> Iterator[str]:
+            routing_attempts = []
+            retry_delays = []
+            for model_name in self._routing_candidates(result, profile, prefer_alternate):
+                retries_done = 0
+                while True:
+                    if deadline.remaining() < EngineConfig.DEADLINE_MIN_ATTEMPT_S:
+                        self._record_timeout(result, "截止时间内未能得到可用结果")
+                        return
+                    if not self.router.try_acquire(model_name):
+                        break
+                    
+                    # 每次尝试使用干净的诊断信息，保留流式标记与路由记录
+                    result["debug_info"] = {"profile": profile.name, "routing_attempts": routing_attempts,
+                                            "retry_count": len(retry_delays)}
+                    if retry_delays:
+                        result["debug_info"]["retry_delays_s"] = retry_delays
+                    result.trace("stream_mode", "流式生成")
+                    result["error_message"] = None
+                    result["model_used"] = model_name
+                    
+                    estimated_tokens = self._admit(model_name, self._full_prompt(prompt, system_instruction),
+                                                   result, profile, deadline)
+                    if estimated_tokens is None:
+                        self.router.release(model_name)
+                        routing_attempts.append({"model": model_name, "latency_s": 0.0, "error_category": "限流拒绝"})
+                        break
+                    
+                    collected = []
+                    chunk_count = 0
+                    started_at = time.time()
+                    try:
+                        result.trace("api_call_start", "开始API调用")
+                        
+                        safety_settings, generation_config = self._get_request_settings(profile)
+                        model, request_prompt = self._resolve_model(model_name, prompt, system_instruction, result)
+                        
+                        response = model.generate_content(
+                            request_prompt, 
+                            safety_settings=safety_settings,
+                            generation_config=generation_config,
+                            stream=True,
+                            request_options={'timeout': deadline.remaining()}
+                        )
+                        
+                        for chunk in response:
+                            # 请求超时只约束单次读取，整体截止时间在块之间检查
+                            if deadline.expired():
+                                raise TimeoutError("流式生成超过截止时间")
+                            # 被拦截或空的块没有可用文本，跳过但不中断
+                            if not getattr(chunk, 'parts', None):
+                                continue
+                            text = chunk.text
+                            if not text:
+                                continue
+                            if chunk_count == 0:
+                                first_chunk_latency = time.time() - started_at
+                                result["debug_info"]["first_chunk_latency_s"] = round(first_chunk_latency, 3)
+                                self.profile_stats.observe(f"{profile.name}.first_chunk", first_chunk_latency)
+                            chunk_count += 1
+                            collected.append(text)
+                            yield text
+                        
+                        latency = time.time() - started_at
+                        MODEL_LATENCY.observe(latency, model=model_name, outcome="ok")
+                        routing_attempts.append({"model": model_name, "latency_s": round(latency, 3), "error_category": None})
+                        self.router.record_success(model_name, latency)
+                        
+                        result.trace("api_call_complete", "API调用完成")
+                        result["debug_info"]["chunk_count"] = chunk_count
+                        result["debug_info"]["token_count"] = self._get_token_count(response)
+                        result["debug_info"]["cached_token_count"] = self._get_cached_token_count(response)
+                        self.rate_limiter.settle(model_name, estimated_tokens, result["debug_info"]["token_count"])
+                        result.set_lazy("raw_response", lambda: str(response) if response else "空响应")
+                        
+                        text_content = "".join(collected)
+                        result.trace("text_length", len(text_content))
+                        
+                        if text_content.strip() == "":
+                            result["error_message"] = "API返回空文本内容"
+                            result["debug_info"]["content_status"] = "文本为空"
+                            return
+                        
+                        # 成功情况
+                        result["success"] = True
+                        result["content"] = text_content.strip()
+                        result.trace("final_status", "成功")
+                        return
+                    
+                    except GeneratorExit:
+                        # 调用方中途放弃消费，不计入模型健康统计
+                        self.router.release(model_name)
+                        raise
+                    except Exception as e:
+                        # 流中途失败时保留已收到的部分，供诊断查看
+                        latency = time.time() - started_at
+                        self._record_exception(result, e)
+                        error_category = result["debug_info"]["error_category"]
+                        MODEL_LATENCY.observe(latency, model=model_name, outcome="error")
+                        routing_attempts.append({"model": model_name, "latency_s": round(latency, 3), "error_category": error_category})
+                        if self.retry_policy.should_stop(error_category):
+                            self.router.record_success(model_name, latency)
+                        else:
+                            self.router.record_failure(model_name, latency, error_category)
+                        result["debug_info"]["chunk_count"] = chunk_count
+                        result["debug_info"]["partial_content"] = "".join(collected)
+                        
+                        # 已向用户输出内容后不能再重试或切换模型；内容拦截不重试
+                        if chunk_count > 0 or self.retry_policy.should_stop(error_category):
+                            return
+                        
+                        delay = self.retry_policy.retry_delay(
+                            error_category, retries_done, deadline.remaining() - EngineConfig.DEADLINE_MIN_ATTEMPT_S
+                        )
+                        if delay is None:
+                            break
+                        retries_done += 1
+                        retry_delays.append(round(delay, 3))
+                        result["debug_info"]["retry_count"] = len(retry_delays)
+                        RETRIES.inc(profile=profile.name, category=error_category)
+                        time.sleep(delay)
+
+        return chunk_iterator(), result
+
+    @classmethod
+    def get_instance_count(cls) -> int:
+        """获取进程内已创建的引擎实例数量"""
+        return cls._instance_count
 
     def get_debug_info(self) -> Dict[str, Any]:
         """获取调试信息"""
@@ -179,22 +989,82 @@ class AIEngine:
             'is_initialized': self.is_initialized,
             'error_message': self.error_message,
             'current_model': self.current_model,
-            'model_type': str(type(self.model)) if self.model else None
+            'model_type': str(type(self.model)) if self.model else None,
+            'backend': self.backend.get_stats() if self.backend else None,
+            'engine_instances': AIEngine.get_instance_count(),
+            'model_routing': self.router.get_routing_table() if self.router else {},
+            'rate_limiter': self.rate_limiter.get_stats(),
+            'single_flight': self.single_flight.get_stats(),
+            'profile_stats': self.profile_stats.get_stats(),
+            'hedging': self.hedger.get_stats() if self.hedger else {'enabled': False},
+            'deadlines': self.deadline_stats.get_stats(),
+            'response_store': self.response_store.get_stats(),
+            'context_cache': self.context_cache.get_stats(),
+            'retry_policy': self.retry_policy.get_stats(),
+            'background_executor': get_executor_stats(),
+            'job_queue': (self.job_queue.get_stats(EngineConfig.WORKER_STALE_S)
+                          if self.job_queue else {'enabled': False}),
+            'diagnostics': {
+                'level': self.diagnostics_level,
+                'sample_rate': EngineConfig.DIAGNOSTICS_SAMPLE_RATE,
+                'captured': self.diagnostics_captured
+            },
+            'question_cache': self.question_cache.get_stats()
         }
 
-    def generate_personalized_question(self, context: Dict[str, Any]) -> Dict[str, Any]:
+    def set_question_cache_enabled(self, enabled: bool):
+        """开关质疑问题缓存，关闭时同时清空已缓存的变体"""
+        self.question_cache.enabled = enabled
+        if not enabled:
+            self.question_cache.clear()
+        logging.info(f"Question cache {'enabled' if enabled else 'disabled'}.")
+
+    @staticmethod
+    def _submitted_deadline(deadline: Union[Deadline, float, None]) -> Union[Deadline, None]:
+        """非阻塞接口的截止时间从提交时起算，线程池排队时间计入预算；None沿用各方法的默认预算"""
+        return Deadline(deadline) if isinstance(deadline, (int, float)) else deadline
+
+    def submit_personalized_question(self, context: Dict[str, Any],
+                                     deadline: Union[Deadline, float, None] = None) -> Future:
+        """非阻塞版本的generate_personalized_question：在共享线程池中生成，立即返回Future"""
+        return submit_background(self.generate_personalized_question, context, self._submitted_deadline(deadline))
+
+    def submit_athena_feedback_batch(self, context: Dict[str, Any],
+                                     steps: Optional[Dict[str, Tuple[str, str]]] = None,
+                                     deadline: Union[Deadline, float, None] = None) -> Future:
+        """非阻塞版本的generate_athena_feedback_batch"""
+        return submit_background(self.generate_athena_feedback_batch, context, steps,
+                                 self._submitted_deadline(deadline))
+
+    def submit_personalized_tool(self, context: Dict[str, Any],
+                                 deadline: Union[Deadline, float, None] = None) -> Future:
+        """非阻塞版本的generate_personalized_tool"""
+        return submit_background(self.generate_personalized_tool, context, self._submitted_deadline(deadline))
+
+    def submit_personalized_tool_stream(self, context: Dict[str, Any],
+                                        deadline: Union[Deadline, float, None] = None) -> StreamingJob:
+        """非阻塞的流式备忘录生成：后台线程消费文本块，调用方随时读取已生成的部分（text）"""
+        return StreamingJob(self.generate_personalized_tool_stream, context, self._submitted_deadline(deadline))
+
+    def generate_personalized_question(self, context: Dict[str, Any],
+                                       deadline: Union[Deadline, float, None] = None) -> Dict[str, Any]:
         """生成个性化质疑问题 - Damien角色 - 强制诊断版本"""
         case_id = context.get('case_id', 'unknown')
         user_choice = context.get('act1_choice', '未记录')
         
-        prompt = f"""你是一位名叫Damien的对冲基金经理，专门以尖锐质疑著称。用户在{case_id}案例中选择了"{user_choice}"。
+        # 质疑问题只取决于案例和选择，优先复用缓存的变体
+        cache_key = (case_id, user_choice)
+        cached_result = self.question_cache.get(cache_key)
+        if cached_result is not None:
+            cached_result["debug_info"]["cache_status"] = "缓存命中"
+            return cached_result
         
-请生成一个不超过40字符的尖锐质疑问题，让用户重新思考自己的决策。要求：
-1. 直接针对用户的选择
-2. 语气尖锐但专业
-3. 一句话，40字符以内"""
+        # 从持久化存储取回变体池中尚缺的那一个，冷启动的副本也能积累出不同的变体
+        result = self.generate_question_variant(context, self.question_cache.next_variant_index(cache_key), deadline)
         
-        result = self._generate(prompt)
+        # 只缓存成功结果，fallback不进入变体池
+        if result["success"]:
+            self.question_cache.put(cache_key, result)
         
         # 如果失败，提供fallback但保留错误信息
         if not result["success"]:
@@ -202,17 +1072,60 @@ class AIEngine:
         
         return result
 
-    def generate_athena_feedback(self, context: Dict[str, Any], step_id: str, step_title: str, user_input: str) -> Dict[str, Any]:
-        """生成Athena导师的智慧反馈 - 强制诊断版本"""
+    @staticmethod
+    def _build_question_prompt(context: Dict[str, Any]) -> str:
+        """质疑问题的prompt，只取决于案例和第一幕选择"""
         case_id = context.get('case_id', 'unknown')
+        user_choice = context.get('act1_choice', '未记录')
+        
+        return f"""你是一位名叫Damien的对冲基金经理，专门以尖锐质疑著称。用户在{case_id}案例中选择了"{user_choice}"。
         
-        # 根据案例确定偏误类型
+请生成一个不超过40字符的尖锐质疑问题，让用户重新思考自己的决策。要求：
+1. 直接针对用户的选择
+2. 语气尖锐但专业
+3. 一句话，40字符以内"""
+
+    def generate_question_variant(self, context: Dict[str, Any], variant: int,
+                                  deadline: Union[Deadline, float, None] = None) -> Dict[str, Any]:
+        """生成（或从持久化存储取回）指定序号的质疑问题变体，不经过内存缓存 - 供缓存预热使用"""
+        return self._generate(self._build_question_prompt(context), 'question', deadline, variant=variant)
+
+    # DOUBT思维模型的五个步骤
+    DOUBT_STEP_TITLES = {
+        'D': "Devil's Advocate（魔鬼代言人）",
+        'O': "Opposite Evidence（反向证据搜集）",
+        'U': "Uncertainty Mapping（不确定性地图）",
+        'B': "Base Rate（基础概率重视）",
+        'T': "Time Horizon（时间视野扩展）"
+    }
+
+    @staticmethod
+    def _get_bias_type(case_id: str) -> str:
+        """根据案例确定偏误类型"""
         bias_mapping = {
             'madoff': "光环效应",
             'lehman': "确认偏误", 
             'ltcm': "过度自信效应"
         }
-        bias_type = bias_mapping.get(case_id, "认知偏误")
+        return bias_mapping.get(case_id, "认知偏误")
+
+    @staticmethod
+    def _get_athena_fallback_feedback(step_id: str, bias_type: str) -> str:
+        """单个DOUBT步骤的个性化fallback反馈"""
+        fallback_feedbacks = {
+            'D': f"很好的批判性思考！质疑看似完美的机会，正是对抗{bias_type}的第一步。",
+            'O': f"优秀的警觉性！寻找反向证据能帮你避开{bias_type}的陷阱。",
+            'U': f"诚实面对不确定性需要勇气，这种自省正是智慧决策的基础。",
+            'B': f"用概率思维看待机会，这种理性分析能有效防范{bias_type}。",
+            'T': f"从长远视角审视决策，这种时间维度的思考展现了真正的智慧。"
+        }
+        return fallback_feedbacks.get(step_id, f"很好的思考！继续保持这种理性分析的精神。")
+
+    def generate_athena_feedback(self, context: Dict[str, Any], step_id: str, step_title: str, user_input: str,
+                                 deadline: Union[Deadline, float, None] = None) -> Dict[str, Any]:
+        """生成Athena导师的智慧反馈 - 强制诊断版本"""
+        case_id = context.get('case_id', 'unknown')
+        bias_type = self._get_bias_type(case_id)
         
         prompt = f"""你是一位名叫Athena的AI智慧导师，温暖而睿智。一个学生正在学习对抗{bias_type}，刚刚为DOUBT模型中的"{step_title}"概念，写下了他的思考：
 
@@ -226,40 +1139,103 @@ class AIEngine:
 
 示例风格："这种反思很有价值！你已经开始用批判性思维审视表面的完美，这正是突破{bias_type}的关键第一步。"""
 
-        result = self._generate(prompt)
+        result = self._generate(prompt, 'feedback', deadline)
         
         # 如果失败，提供个性化fallback
         if not result["success"]:
-            fallback_feedbacks = {
-                'D': f"很好的批判性思考！质疑看似完美的机会，正是对抗{bias_type}的第一步。",
-                'O': f"优秀的警觉性！寻找反向证据能帮你避开{bias_type}的陷阱。",
-                'U': f"诚实面对不确定性需要勇气，这种自省正是智慧决策的基础。",
-                'B': f"用概率思维看待机会，这种理性分析能有效防范{bias_type}。",
-                'T': f"从长远视角审视决策，这种时间维度的思考展现了真正的智慧。"
-            }
-            result["fallback_content"] = fallback_feedbacks.get(step_id, f"很好的思考！继续保持这种理性分析的精神。")
+            result["fallback_content"] = self._get_athena_fallback_feedback(step_id, bias_type)
         
         return result
 
-    def generate_personalized_tool(self, context: Dict[str, Any]) -> Dict[str, Any]:
-        """案例感知的Athena角色工具生成 - 强制诊断版本"""
-        
-        # 获取用户信息和案例信息
+    @staticmethod
+    def _parse_json_object(text: str) -> Optional[Dict[str, Any]]:
+        """从模型输出中提取JSON对象，兼容```json代码块包裹"""
+        start = text.find('{')
+        end = text.rfind('}')
+        if start == -1 or end <= start:
+            return None
+        try:
+            parsed = json.loads(text[start:end + 1])
+        except ValueError:
+            return None
+        return parsed if isinstance(parsed, dict) else None
+
+    def get_pending_doubt_steps(self, context: Dict[str, Any]) -> Dict[str, Tuple[str, str]]:
+        """已提交答案(doubt_X)但尚无反馈(feedback_X)的DOUBT步骤"""
+        pending = {}
+        for step_id, step_title in self.DOUBT_STEP_TITLES.items():
+            user_input = context.get(f'doubt_{step_id}')
+            if user_input and not context.get(f'feedback_{step_id}'):
+                pending[step_id] = (step_title, user_input)
+        return pending
+
+    def generate_athena_feedback_batch(self, context: Dict[str, Any],
+                                       steps: Optional[Dict[str, Tuple[str, str]]] = None,
+                                       deadline: Union[Deadline, float, None] = None) -> Dict[str, Any]:
+        """
+        批量生成DOUBT各步骤的Athena反馈 - 一次结构化(JSON)调用
+        steps为 步骤ID -> (步骤标题, 用户思考)；不传时进入增量模式，只处理上下文中待反馈的步骤
+        结果中的feedbacks包含每个步骤的反馈，解析失败的步骤使用该步骤的fallback
+        """
         case_id = context.get('case_id', 'unknown')
-        user_name = context.get("user_name", "用户")
-        user_principle = context.get("user_principle", "理性决策")
-        user_choice = context.get("act1_choice", "未记录")
+        bias_type = self._get_bias_type(case_id)
+        if steps is None:
+            steps = self.get_pending_doubt_steps(context)
         
-        # 诊断用户输入
-        input_diagnostics = {
-            "case_id": case_id,
-            "user_name": user_name,
-            "user_principle": user_principle,
-            "user_choice": user_choice,
-            "context_keys": list(context.keys())
-        }
+        if not steps:
+            result = self._new_result("")
+            result["success"] = True
+            result["feedbacks"] = {}
+            result["feedback_sources"] = {}
+            result["debug_info"]["batch_status"] = "没有待反馈的步骤"
+            return result
         
-        # 根据案例动态确定偏误类型和框架
+        step_lines = "\n".join(
+            f'- "{step_id}"（{step_title}）："{user_input}"'
+            for step_id, (step_title, user_input) in steps.items()
+        )
+        
+        prompt = f"""你是一位名叫Athena的AI智慧导师，温暖而睿智。一个学生正在学习对抗{bias_type}，刚刚为DOUBT模型中的以下概念分别写下了他的思考：
+
+{step_lines}
+
+请为每一条思考各写一句充满智慧和鼓励的点评。要求：
+1. 既要肯定他的努力，又要启发更深层思考
+2. 温暖鼓励的语调，体现导师的智慧
+3. 每条控制在50字以内
+4. 不要重复用户的原话
+
+只输出一个JSON对象，键为步骤字母，值为点评，例如：{{"{next(iter(steps))}": "这种反思很有价值！……"}}"""
+
+        result = self._generate(prompt, 'feedback_batch', deadline,
+                                validate=lambda text: self._parse_json_object(text) is not None)
+        
+        parsed = self._parse_json_object(result["content"]) if result["success"] else None
+        if result["success"] and parsed is None:
+            result["debug_info"]["parse_error"] = "JSON解析失败"
+        
+        feedbacks = {}
+        feedback_sources = {}
+        for step_id in steps:
+            feedback = parsed.get(step_id) if parsed else None
+            if isinstance(feedback, str) and feedback.strip():
+                feedbacks[step_id] = feedback.strip()
+                feedback_sources[step_id] = "ai"
+            else:
+                # 只有解析失败的步骤使用该步骤原有的fallback
+                feedbacks[step_id] = self._get_athena_fallback_feedback(step_id, bias_type)
+                feedback_sources[step_id] = "fallback"
+        
+        result["feedbacks"] = feedbacks
+        result["feedback_sources"] = feedback_sources
+        result["debug_info"]["batch_steps"] = list(steps.keys())
+        result["debug_info"]["fallback_steps"] = [k for k, v in feedback_sources.items() if v == "fallback"]
+        
+        return result
+
+    @staticmethod
+    def _get_case_info(case_id: str) -> Dict[str, Any]:
+        """案例对应的偏误类型与反制框架"""
         case_mapping = {
             'madoff': {
                 "case_name": "Madoff Ponzi Scheme",
@@ -281,12 +1257,40 @@ class AIEngine:
             }
         }
         
-        case_info = case_mapping.get(case_id, {
+        return case_mapping.get(case_id, {
             "case_name": "Financial Investment Case",
             "bias_type": "认知偏误",
             "bias_english": "Cognitive Bias",
             "framework": "理性决策框架"
         })
+
+    def _get_tool_inputs(self, context: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """备忘录的输入，返回(案例信息, 输入诊断)"""
+        
+        # 获取用户信息和案例信息
+        case_id = context.get('case_id', 'unknown')
+        user_name = context.get("user_name", "用户")
+        user_principle = context.get("user_principle", "理性决策")
+        user_choice = context.get("act1_choice", "未记录")
+        
+        # 诊断用户输入
+        input_diagnostics = {
+            "case_id": case_id,
+            "user_name": user_name,
+            "user_principle": user_principle,
+            "user_choice": user_choice,
+            "context_keys": list(context.keys())
+        }
+        
+        # 根据案例动态确定偏误类型和框架
+        return self._get_case_info(case_id), input_diagnostics
+
+    def _build_tool_prompt(self, context: Dict[str, Any]) -> Tuple[str, Dict[str, Any], Dict[str, Any]]:
+        """构建备忘录prompt，返回(prompt, 案例信息, 输入诊断)"""
+        case_info, input_diagnostics = self._get_tool_inputs(context)
+        user_name = input_diagnostics["user_name"]
+        user_principle = input_diagnostics["user_principle"]
+        user_choice = input_diagnostics["user_choice"]
         
         # 构建详细的prompt
         prompt = f"""SYSTEM: 你是一位名叫"Athena"的AI决策导师，你服务过无数诺贝尔奖得主和顶级企业家。你的任务是为你的客户，撰写一份高度个人化、可作为其终身行为准则的《决策心智模型备忘录》。
@@ -316,24 +1320,204 @@ TASK: Generate a personalized "Cognitive Immune System" memo in Markdown format.
 
 请确保所有建议都针对{case_info["bias_type"]}，而不是其他认知偏误。"""
 
-        result = self._generate(prompt)
+        return prompt, case_info, input_diagnostics
+
+    @staticmethod
+    def _build_tool_system_instruction(case_info: Dict[str, Any]) -> str:
+        """备忘录的固定前言：只取决于案例，注册为上下文缓存后每个用户只需发送USER CONTEXT"""
+        return f"""SYSTEM: 你是一位名叫"Athena"的AI决策导师，你服务过无数诺贝尔奖得主和顶级企业家。你的任务是为你的客户，撰写一份高度个人化、可作为其终身行为准则的《决策心智模型备忘录》。
+
+CASE CONTEXT:
+- Case Studied: {case_info["case_name"]} ({case_info["bias_english"]})
+- Target Cognitive Bias: {case_info["bias_type"]}
+- Recommended Framework: {case_info["framework"]}
+
+TASK: For the USER CONTEXT given in each request, generate a personalized "Cognitive Immune System" memo in Markdown format. The memo must strictly follow this structure and be specifically tailored to {case_info["bias_type"]}. Replace <User Name>, <User's Personal Principle> and <User's Initial Decision> with the values from USER CONTEXT:
+
+# 🛡️ 为 <User Name> 定制的【{case_info["bias_type"]}】免疫系统
+
+> 核心原则整合："<User's Personal Principle>"——这正是您对抗{case_info["bias_type"]}的第一道防线。为了将它从'信念'变为'本能'，请在下次遇到类似情况时，将这句话大声朗读出来。
+
+## 💡 基于您本次决策模式的专属建议
+
+(Based on the user's "<User's Initial Decision>" in {case_info["case_name"]}, generate 1-2 unique, actionable suggestions specifically for preventing {case_info["bias_type"]}. Be creative and insightful.)
+
+## ⚙️ 通用反制工具箱 - {case_info["framework"]}
+
+- **工具一：** (Provide one core countermeasure specifically for {case_info["bias_type"]})
+- **工具二：** (Provide another core countermeasure specifically for {case_info["bias_type"]})
+
+请确保所有建议都针对{case_info["bias_type"]}，而不是其他认知偏误。"""
+
+    def _build_memo_request(self, context: Dict[str, Any]) -> Tuple[Optional[str], str, Dict[str, Any], Dict[str, Any]]:
+        """
+        完整备忘录的请求，返回(固定前言, prompt, 案例信息, 输入诊断)
+        首选模型已取得案例前言的上下文缓存时拆分为前言 + 用户部分；否则前言为None，prompt为原始的完整prompt
+        """
+        if self.context_cache.enabled:
+            case_info, input_diagnostics = self._get_tool_inputs(context)
+            system_instruction = self._build_tool_system_instruction(case_info)
+            candidates = get_profile('memo').order_models(self.router.candidates()) if self.router else []
+            if candidates and self.context_cache.acquire(candidates[0], system_instruction,
+                                                         self.models[candidates[0]]):
+                prompt = (
+                    "USER CONTEXT:\n"
+                    f'- User Name: "{input_diagnostics["user_name"]}"\n'
+                    f'- User\'s Personal Principle: "{input_diagnostics["user_principle"]}"\n'
+                    f'- User\'s Initial Decision in the case: "{input_diagnostics["user_choice"]}"'
+                )
+                return system_instruction, prompt, case_info, input_diagnostics
         
+        prompt, case_info, input_diagnostics = self._build_tool_prompt(context)
+        return None, prompt, case_info, input_diagnostics
+
+    def _finalize_tool_result(self, result: Dict[str, Any], context: Dict[str, Any],
+                              case_info: Dict[str, Any], input_diagnostics: Dict[str, Any]):
+        """为备忘录结果补充输入诊断与fallback"""
         # 添加输入诊断信息
         result["input_diagnostics"] = input_diagnostics
         result["case_info"] = case_info
         
         # 如果失败，提供高质量fallback
         if not result["success"]:
-            result["fallback_content"] = self._get_premium_fallback_tool(context, case_id)
+            result["fallback_content"] = self._get_premium_fallback_tool(context, input_diagnostics["case_id"])
+
+    @staticmethod
+    def _build_memo_fields_prompt(case_info: Dict[str, Any], user_choice: str, user_principle: str) -> str:
+        """骨架模式下只请求个性化字段的prompt：建议结合用户的第一幕选择与个人原则"""
+        return f"""你是一位名叫"Athena"的AI决策导师。你的客户在{case_info["case_name"]}案例中做出了选择："{user_choice}"，其个人原则是："{user_principle}"。目标认知偏误：{case_info["bias_type"]}（{case_info["bias_english"]}），推荐框架：{case_info["framework"]}。
+
+请只输出一个JSON对象，不要输出其他内容：
+{{"suggestions": ["基于该选择、结合其个人原则、专门预防{case_info["bias_type"]}的可执行建议，1-2条，每条不超过60字"], "tool_1": "针对{case_info["bias_type"]}的核心反制工具，格式为 工具名——做法，不超过50字", "tool_2": "另一个核心反制工具，格式同上"}}"""
+
+    def _generate_skeleton_tool(self, context: Dict[str, Any],
+                                deadline: Union[Deadline, float, None] = None) -> Dict[str, Any]:
+        """
+        骨架优先的备忘录生成：固定结构由代码渲染，模型只生成建议与两个工具
+        个别字段解析失败时用该案例fallback的对应部分补齐；全部失败时返回fallback
+        """
+        case_info, input_diagnostics = self._get_tool_inputs(context)
+        user_choice = input_diagnostics["user_choice"]
+        prompt = self._build_memo_fields_prompt(case_info, user_choice, input_diagnostics["user_principle"])
+        
+        result = self._generate(prompt, 'memo_fields', deadline,
+                                validate=lambda text: self._parse_json_object(text) is not None)
+        result["debug_info"]["memo_mode"] = "骨架优先"
+        
+        fields = self._parse_json_object(result["content"]) if result["success"] else None
+        if result["success"] and fields is None:
+            result["debug_info"]["parse_error"] = "JSON解析失败"
+        fields = fields or {}
+        
+        _, _, fallback_suggestions, fallback_tools = self._get_fallback_sections(input_diagnostics["case_id"], user_choice)
+        
+        suggestions = fields.get("suggestions")
+        if isinstance(suggestions, str):
+            suggestions = [suggestions]
+        suggestions = [item.strip() for item in suggestions if isinstance(item, str) and item.strip()][:2] \
+            if isinstance(suggestions, list) else []
+        tools = [fields.get(k).strip() for k in ("tool_1", "tool_2")
+                 if isinstance(fields.get(k), str) and fields.get(k).strip()]
+        
+        section_sources = {
+            "suggestions": "ai" if suggestions else "fallback",
+            "tools": "ai" if len(tools) == 2 else "fallback"
+        }
+        result["debug_info"]["section_sources"] = section_sources
         
+        if result["success"] and "ai" in section_sources.values():
+            suggestions_md = (f'基于您选择了"{user_choice}"，我建议您：\n' + "\n".join(f"- {item}" for item in suggestions)
+                              if suggestions else fallback_suggestions)
+            tools_md = (f"- **工具一：** {tools[0]}\n- **工具二：** {tools[1]}"
+                        if len(tools) == 2 else fallback_tools)
+            result["memo_fields"] = fields
+            result["content"] = (
+                self._render_memo_header(input_diagnostics["user_name"], input_diagnostics["user_principle"],
+                                         case_info["bias_type"])
+                + self._render_memo_sections(suggestions_md, case_info["framework"], tools_md)
+            )
+        elif result["success"]:
+            result["success"] = False
+            result["error_message"] = "个性化字段解析失败"
+            FALLBACKS.inc(profile='memo_fields')
+        
+        self._finalize_tool_result(result, context, case_info, input_diagnostics)
         return result
-    
-    def _get_premium_fallback_tool(self, context: Dict[str, Any], case_id: str = 'unknown') -> str:
-        """案例感知的高质量备选工具"""
-        user_name = context.get('user_name', '用户')
-        user_principle = context.get('user_principle', '理性决策')
-        user_choice = context.get('act1_choice', '未记录')
+
+    def generate_personalized_tool(self, context: Dict[str, Any],
+                                   deadline: Union[Deadline, float, None] = None) -> Dict[str, Any]:
+        """案例感知的Athena角色工具生成 - 强制诊断版本"""
+        if EngineConfig.MEMO_SKELETON_ENABLED:
+            return self._generate_skeleton_tool(context, deadline)
+        
+        system_instruction, prompt, case_info, input_diagnostics = self._build_memo_request(context)
+        
+        result = self._generate(prompt, 'memo', deadline, system_instruction=system_instruction)
+        self._finalize_tool_result(result, context, case_info, input_diagnostics)
+        
+        return result
+
+    def generate_personalized_tool_stream(self, context: Dict[str, Any],
+                                          deadline: Union[Deadline, float, None] = None) -> Tuple[Iterator[str], Dict[str, Any]]:
+        """
+        流式版本的备忘录生成
+        返回(文本块迭代器, 诊断结果)；迭代器耗尽后结果中包含完整内容或fallback
+        骨架模式下先立即输出固定的标题与原则部分，个性化字段生成后再输出其余部分
+        """
+        if EngineConfig.MEMO_SKELETON_ENABLED:
+            return self._generate_skeleton_tool_stream(context, deadline)
+        
+        system_instruction, prompt, case_info, input_diagnostics = self._build_memo_request(context)
         
+        chunks, result = self._generate_stream(prompt, 'memo', deadline, system_instruction=system_instruction)
+        
+        def finalizing_iterator() -> Iterator[str]:
+            yield from chunks
+            self._finalize_tool_result(result, context, case_info, input_diagnostics)
+        
+        return finalizing_iterator(), result
+
+    def _generate_skeleton_tool_stream(self, context: Dict[str, Any],
+                                       deadline: Union[Deadline, float, None]) -> Tuple[Iterator[str], Dict[str, Any]]:
+        """骨架模式的流式输出：标题部分不等待模型"""
+        case_info, input_diagnostics = self._get_tool_inputs(context)
+        header = self._render_memo_header(input_diagnostics["user_name"], input_diagnostics["user_principle"],
+                                          case_info["bias_type"])
+        result = GenerationResult()
+        
+        def skeleton_iterator() -> Iterator[str]:
+            yield header
+            result.update(self._generate_skeleton_tool(context, deadline))
+            result.trace("stream_mode", "骨架流式")
+            text = result["content"] if result["success"] else result["fallback_content"]
+            # 已输出的标题与fallback的标题一致时只补全其余部分
+            yield text[len(header):] if text.startswith(header) else "\n\n" + text
+        
+        return skeleton_iterator(), result
+
+    @staticmethod
+    def _render_memo_header(user_name: str, user_principle: str, bias_type: str) -> str:
+        """备忘录的固定开头：标题、核心原则与建议小节标题"""
+        return f"""# 🛡️ 为 {user_name} 定制的【{bias_type}】免疫系统
+
+> 核心原则整合："{user_principle}"——这正是您对抗{bias_type}的第一道防线。为了将它从'信念'变为'本能'，请在下次遇到类似情况时，将这句话大声朗读出来。
+
+## 💡 基于您本次决策模式的专属建议
+
+"""
+
+    @staticmethod
+    def _render_memo_sections(suggestions: str, framework: str, tools: str) -> str:
+        """备忘录的建议与工具箱部分"""
+        return f"""{suggestions}
+
+## ⚙️ 通用反制工具箱 - {framework}
+
+{tools}"""
+
+    @staticmethod
+    def _get_fallback_sections(case_id: str, user_choice: str) -> Tuple[str, str, str, str]:
+        """案例对应的fallback内容，返回(偏误类型, 框架, 建议, 工具)"""
         # 根据案例确定偏误类型和工具
         if case_id == 'lehman':
             bias_type = "确认偏误"
@@ -360,14 +1544,15 @@ TASK: Generate a personalized "Cognitive Immune System" memo in Markdown format.
 - 在面对权威人物时，先问自己："他的专业能力是否与投资决策直接相关？"
 - 建立一个"48小时冷静期"规则，任何重大投资决策都要经过这个时间缓冲"""
         
-        return f"""# 🛡️ 为 {user_name} 定制的【{bias_type}】免疫系统
-
-> 核心原则整合："{user_principle}"——这正是您对抗{bias_type}的第一道防线。为了将它从'信念'变为'本能'，请在下次遇到类似情况时，将这句话大声朗读出来。
-
-## 💡 基于您本次决策模式的专属建议
-
-{suggestions}
-
-## ⚙️ 通用反制工具箱 - {framework}
-
-{tools}"""
+        return bias_type, framework, suggestions, tools
+    
+    def _get_premium_fallback_tool(self, context: Dict[str, Any], case_id: str = 'unknown') -> str:
+        """案例感知的高质量备选工具"""
+        user_name = context.get('user_name', '用户')
+        user_principle = context.get('user_principle', '理性决策')
+        user_choice = context.get('act1_choice', '未记录')
+        
+        bias_type, framework, suggestions, tools = self._get_fallback_sections(case_id, user_choice)
+        
+        return self._render_memo_header(user_name, user_principle, bias_type) + \
+            self._render_memo_sections(suggestions, framework, tools)
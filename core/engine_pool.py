@@ -0,0 +1,160 @@
+# core/engine_pool.py - 进程级共享AI引擎池
+# 所有Streamlit会话共用同一个AIEngine，会话只保留自己的诊断视图
+
+import threading
+import time
+import logging
+from typing import Dict, Any, Optional
+from core.engine import AIEngine
+
+logger = logging.getLogger(__name__)
+
+
+class EnginePool:
+    """
+    进程级AI引擎注册表
+
+    设计原则：
+    1. 只创建一次：genai.configure与模型初始化在进程内只执行一次
+    2. 线程安全：并发会话同时访问时通过锁保证只构建一个实例
+    3. 失败可恢复：初始化失败的引擎在冷却时间后允许重建，避免永久不可用
+    """
+
+    # 初始化失败后的重建冷却时间（秒），防止突发流量下反复重建
+    RETRY_INIT_INTERVAL = 30.0
+
+    _lock = threading.Lock()
+    _engine: Optional[AIEngine] = None
+    _created_at: float = 0.0
+    _session_views = 0
+
+    @classmethod
+    def get_engine(cls) -> AIEngine:
+        """获取共享引擎实例 - 懒加载且线程安全"""
+        engine = cls._engine
+        if engine is not None and (engine.is_initialized or not cls._should_retry()):
+            return engine
+
+        with cls._lock:
+            # 双重检查：等待锁期间可能已由其他会话完成构建
+            engine = cls._engine
+            if engine is None or (not engine.is_initialized and cls._should_retry()):
+                logger.info("EnginePool: 构建共享AI引擎")
+                cls._engine = AIEngine()
+                cls._created_at = time.time()
+            return cls._engine
+
+    @classmethod
+    def _should_retry(cls) -> bool:
+        """初始化失败的引擎是否已过冷却时间"""
+        return time.time() - cls._created_at >= cls.RETRY_INIT_INTERVAL
+
+    @classmethod
+    def create_session_view(cls) -> "SessionEngineView":
+        """为单个会话创建引擎视图"""
+        with cls._lock:
+            cls._session_views += 1
+        return SessionEngineView()
+
+    @classmethod
+    def reset(cls):
+        """丢弃共享引擎，下次访问时重建 - 仅用于紧急情况"""
+        with cls._lock:
+            cls._engine = None
+            cls._created_at = 0.0
+        logger.warning("EnginePool: 共享AI引擎已重置")
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """获取引擎池统计信息"""
+        return {
+            'engine_instances_created': AIEngine.get_instance_count(),
+            'session_views_created': cls._session_views,
+            'shared_engine_ready': cls._engine is not None and cls._engine.is_initialized,
+            'shared_engine_age_s': round(time.time() - cls._created_at, 1) if cls._engine else None
+        }
+
+
+class SessionEngineView:
+    """
+    会话级引擎视图
+
+    对外保持与AIEngine一致的调用接口，实际调用委托给共享引擎；
+    仅记录属于当前用户的诊断信息（调用次数、最近一次结果摘要）。
+    """
+
+    # 需要记录会话诊断的生成方法
+    _TRACKED_METHODS = (
+        '_generate',
+        'generate_personalized_question',
+        'generate_athena_feedback',
+        'generate_athena_feedback_batch',
+        'generate_personalized_tool',
+        'generate_personalized_tool_stream',
+        'submit_personalized_question',
+        'submit_athena_feedback_batch',
+        'submit_personalized_tool',
+        'submit_personalized_tool_stream',
+    )
+
+    def __init__(self):
+        self.session_debug: Dict[str, Any] = {
+            'call_count': 0,
+            'last_calls': {}
+        }
+
+    @property
+    def engine(self) -> AIEngine:
+        """当前会话使用的共享引擎"""
+        return EnginePool.get_engine()
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.engine, name)
+        if name in self._TRACKED_METHODS and callable(attr):
+            return self._track(name, attr)
+        return attr
+
+    def _track(self, name: str, method):
+        """包装生成方法，记录本会话的调用诊断"""
+        def wrapper(*args, **kwargs):
+            result = method(*args, **kwargs)
+            if name.startswith('submit_'):
+                # 非阻塞方法返回Future（流式为StreamingJob），完成后再记录
+                future = getattr(result, 'future', result)
+                future.add_done_callback(lambda f: self._record_future(name, f))
+                return result
+            if name.endswith('_stream'):
+                # 流式方法返回(迭代器, 结果)，结果在迭代器耗尽后才完整
+                chunks, stream_result = result
+                return self._track_stream(name, chunks, stream_result), stream_result
+            self._record_call(name, result)
+            return result
+        return wrapper
+
+    def _track_stream(self, name: str, chunks, result: Dict[str, Any]):
+        """流式迭代结束后记录调用诊断"""
+        yield from chunks
+        self._record_call(name, result)
+
+    def _record_future(self, name: str, future):
+        """后台任务完成时记录调用诊断，取消或异常的任务不记录"""
+        if not future.cancelled() and future.exception() is None:
+            self._record_call(name, future.result())
+
+    def _record_call(self, name: str, result: Any):
+        """记录一次调用的结果摘要"""
+        self.session_debug['call_count'] += 1
+        if isinstance(result, dict):
+            self.session_debug['last_calls'][name] = {
+                'success': result.get('success', False),
+                'model_used': result.get('model_used'),
+                'error_message': result.get('error_message'),
+                'at': time.strftime('%H:%M:%S')
+            }
+
+    def get_debug_info(self) -> Dict[str, Any]:
+        """获取调试信息：共享引擎状态 + 本会话诊断 + 引擎池统计"""
+        debug_info = self.engine.get_debug_info()
+        debug_info['session'] = self.session_debug
+        debug_info['pool'] = EnginePool.get_stats()
+        return debug_info
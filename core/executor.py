@@ -0,0 +1,149 @@
+# core/executor.py - 进程级后台任务执行器
+# 让AI生成与转场动画、用户阅读时间重叠，而不是串行叠加
+
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Optional, Callable, Tuple, Iterator, Dict, Any, List
+from config.settings import EngineConfig
+from core.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+# 线程池饱和度统计：已提交、已开始、已完成、已取消（未开始即取消）、因排队过长被拒绝
+_stats = {'submitted': 0, 'started': 0, 'completed': 0, 'cancelled': 0, 'rejected': 0,
+          'peak_pending': 0, 'total_queue_wait_s': 0.0}
+_stats_lock = threading.Lock()
+
+
+class ExecutorSaturatedError(RuntimeError):
+    """后台线程池排队的任务已达上限"""
+
+
+def get_shared_executor() -> ThreadPoolExecutor:
+    """获取进程级共享线程池 - 懒加载且线程安全"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=EngineConfig.BACKGROUND_WORKERS,
+                    thread_name_prefix="ai-background"
+                )
+                logger.info(f"Executor: 创建后台线程池 ({EngineConfig.BACKGROUND_WORKERS} workers)")
+    return _executor
+
+
+def submit_background(fn: Callable[..., Any], *args, **kwargs) -> Future:
+    """
+    提交后台任务并立即返回Future
+    等待执行的任务达到BACKGROUND_MAX_PENDING时不再排队，返回以ExecutorSaturatedError失败的Future
+    """
+    with _stats_lock:
+        pending = _stats['submitted'] - _stats['started'] - _stats['cancelled']
+        if pending >= EngineConfig.BACKGROUND_MAX_PENDING:
+            _stats['rejected'] += 1
+            rejected: Future = Future()
+            rejected.set_exception(ExecutorSaturatedError(f"后台线程池已饱和（{pending}个任务等待执行）"))
+            return rejected
+        _stats['submitted'] += 1
+        _stats['peak_pending'] = max(_stats['peak_pending'], pending + 1)
+    
+    submitted_at = time.monotonic()
+    
+    def run():
+        with _stats_lock:
+            _stats['started'] += 1
+            _stats['total_queue_wait_s'] += time.monotonic() - submitted_at
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with _stats_lock:
+                _stats['completed'] += 1
+    
+    def on_done(future: Future):
+        if future.cancelled():
+            with _stats_lock:
+                _stats['cancelled'] += 1
+    
+    future = get_shared_executor().submit(run)
+    future.add_done_callback(on_done)
+    return future
+
+
+def get_executor_stats() -> Dict[str, Any]:
+    """获取后台线程池的饱和度统计 - 运行中、排队中的任务数与平均排队时间"""
+    with _stats_lock:
+        stats = dict(_stats)
+    running = stats['started'] - stats['completed']
+    return {
+        'max_workers': EngineConfig.BACKGROUND_WORKERS,
+        'max_pending': EngineConfig.BACKGROUND_MAX_PENDING,
+        'running': running,
+        'pending': stats['submitted'] - stats['started'] - stats['cancelled'],
+        'utilization': round(running / EngineConfig.BACKGROUND_WORKERS, 2) if EngineConfig.BACKGROUND_WORKERS else 0.0,
+        'submitted': stats['submitted'],
+        'completed': stats['completed'],
+        'cancelled': stats['cancelled'],
+        'rejected': stats['rejected'],
+        'peak_pending': stats['peak_pending'],
+        'avg_queue_wait_s': round(stats['total_queue_wait_s'] / stats['started'], 3) if stats['started'] else 0.0
+    }
+
+
+REGISTRY.register_callback("ai_background_running", "后台线程池中运行中的任务数", "gauge",
+                           lambda: {(): get_executor_stats()['running']})
+REGISTRY.register_callback("ai_background_pending", "后台线程池中等待执行的任务数", "gauge",
+                           lambda: {(): get_executor_stats()['pending']})
+REGISTRY.register_callback("ai_background_rejected_total", "后台线程池饱和时拒绝的任务数", "counter",
+                           lambda: {(): get_executor_stats()['rejected']})
+
+
+class StreamingJob:
+    """
+    在后台线程中消费流式生成的任务
+
+    生产端把文本块追加到缓冲区，渲染端可在任务进行中随时接入并读取已生成的全部文本（text）；
+    提供与Future一致的查询接口。
+    """
+
+    def __init__(self, stream_fn: Callable[..., Tuple[Iterator[str], Dict[str, Any]]], *args):
+        self._chunks: List[str] = []
+        self._cancel_requested = threading.Event()
+        self.started_at = time.time()
+        self.future: Future = submit_background(self._run, stream_fn, *args)
+
+    def _run(self, stream_fn, *args) -> Dict[str, Any]:
+        chunks, result = stream_fn(*args)
+        for chunk in chunks:
+            if self._cancel_requested.is_set():
+                # 停止消费即关闭上游流，结果不再使用
+                chunks.close()
+                break
+            self._chunks.append(chunk)
+        return result
+
+    @property
+    def text(self) -> str:
+        """已生成的全部文本"""
+        return "".join(self._chunks)
+
+    def cancel(self) -> bool:
+        self._cancel_requested.set()
+        return self.future.cancel()
+
+    def cancelled(self) -> bool:
+        return self.future.cancelled()
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def exception(self, timeout: Optional[float] = None):
+        return self.future.exception(timeout)
+
+    def result(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        return self.future.result(timeout)
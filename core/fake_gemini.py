@@ -0,0 +1,402 @@
+# core/fake_gemini.py - 本地Gemini替身服务，用于压测与延迟测试
+# 按Gemini REST接口（generateContent / streamGenerateContent）应答，回复内容模仿引擎的几类prompt，
+# 延迟分布、429、空parts、内容拦截与流中断均可配置；相同种子下结果可复现，不消耗真实配额
+#
+# 用法：python -m core.fake_gemini --port 8765 --seed 7 --rate-429 0.05 --empty-parts 0.02
+#       --latency memo=lognormal:8,0.3 --latency gemini-1.5-flash=fixed:0.5
+# 引擎侧设置 GENERATION_BACKEND = 'gemini_rest'、GEMINI_REST_BASE_URL = 'http://127.0.0.1:8765/v1beta'
+
+import argparse
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+import socket
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+# 各类prompt的默认延迟分布（秒）：备忘录明显慢于一句话的调用
+DEFAULT_LATENCIES = {
+    'question': 'lognormal:1.2,0.35',
+    'feedback': 'lognormal:1.2,0.35',
+    'feedback_batch': 'lognormal:2.5,0.35',
+    'memo_fields': 'lognormal:3.0,0.35',
+    'memo': 'lognormal:8.0,0.3',
+    'default': 'lognormal:1.5,0.4',
+}
+
+LatencySampler = Callable[[random.Random], float]
+
+
+def parse_latency(spec: str) -> LatencySampler:
+    """
+    解析延迟分布：fixed:秒 / uniform:下限,上限 / normal:均值,标准差 /
+    lognormal:中位数,sigma / exponential:均值
+    """
+    kind, _, args = spec.partition(':')
+    try:
+        values = [float(v) for v in args.split(',')] if args else []
+    except ValueError:
+        raise ValueError(f"无法解析的延迟分布: {spec}")
+    if kind == 'fixed' and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == 'uniform' and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == 'normal' and len(values) == 2:
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == 'lognormal' and len(values) == 2:
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    if kind == 'exponential' and len(values) == 1:
+        return lambda rng: rng.expovariate(1.0 / values[0])
+    raise ValueError(f"无法解析的延迟分布: {spec}")
+
+
+# =============================================================================
+# 回复内容：按prompt类型模仿模型输出
+# =============================================================================
+
+def classify_prompt(prompt: str) -> str:
+    """识别引擎的prompt类型：质疑问题 / 单步反馈 / 批量反馈 / 备忘录字段 / 完整备忘录"""
+    if 'Damien' in prompt:
+        return 'question'
+    if '"suggestions"' in prompt:
+        return 'memo_fields'
+    if 'Cognitive Immune System' in prompt or 'USER CONTEXT' in prompt:
+        return 'memo'
+    if 'Athena' in prompt and '键为步骤字母' in prompt:
+        return 'feedback_batch'
+    if 'Athena' in prompt and 'DOUBT' in prompt:
+        return 'feedback'
+    return 'default'
+
+
+_QUESTIONS = [
+    "如果回报这么稳定，为什么没人质疑过它的来源？",
+    "你凭什么相信自己看到的不是精心包装的假象？",
+    "这个选择背后，你真正独立验证过哪一条信息？",
+    "如果明天真相曝光，你的理由还站得住吗？",
+    "你是在分析机会，还是在为已有结论找证据？",
+]
+_FEEDBACKS = [
+    "这种反思很有价值！你已经开始用批判性思维审视表面的完美。",
+    "很棒的追问！再想想：哪些证据会让你彻底改变判断？",
+    "你看到了别人忽略的风险，下一步试着给它标上概率。",
+    "能主动寻找反面证据，说明你正在摆脱直觉的牵引。",
+    "把时间拉长来看，这个判断还成立吗？你已经走在正确的路上。",
+]
+_SUGGESTIONS = [
+    "做决定前列出三条能推翻当前判断的证据，并逐条核实来源",
+    "为每个看似完美的机会指定一位唱反调的同事，专门寻找漏洞",
+    "把投资逻辑写下来，七天后在没有新信息的情况下重新审阅",
+    "用同类机会的历史失败率作为起点，再根据独立证据调整判断",
+]
+_TOOLS = [
+    "独立验证清单——任何关键数据至少由两个无利益关联的来源确认",
+    "事前验尸——假设一年后彻底失败，倒推最可能的三个原因",
+    "基础概率锚定——先查同类事件的历史成功率，再讨论个案",
+    "反向论证——用十分钟为相反的决定写出最有力的理由",
+]
+
+
+def _field(prompt: str, pattern: str, default: str) -> str:
+    match = re.search(pattern, prompt)
+    return match.group(1) if match else default
+
+
+def compose_reply(prompt: str, rng: random.Random) -> str:
+    """按prompt类型生成与真实模型结构一致的回复"""
+    kind = classify_prompt(prompt)
+    if kind == 'question':
+        return rng.choice(_QUESTIONS)
+    if kind == 'feedback':
+        return rng.choice(_FEEDBACKS)
+    if kind == 'feedback_batch':
+        steps = re.findall(r'- "([A-Z])"（', prompt) or ['D']
+        return json.dumps({step: rng.choice(_FEEDBACKS) for step in steps}, ensure_ascii=False)
+    if kind == 'memo_fields':
+        tools = rng.sample(_TOOLS, 2)
+        return "```json\n" + json.dumps({
+            "suggestions": rng.sample(_SUGGESTIONS, rng.randint(1, 2)),
+            "tool_1": tools[0],
+            "tool_2": tools[1]
+        }, ensure_ascii=False) + "\n```"
+    if kind == 'memo':
+        user_name = _field(prompt, r'User Name: "([^"]*)"', "用户")
+        principle = _field(prompt, r'Personal Principle: "([^"]*)"', "理性决策")
+        bias_type = _field(prompt, r'Target Cognitive Bias: (\S+)', "认知偏误")
+        framework = _field(prompt, r'Recommended Framework: (\S+)', "理性决策框架")
+        tools = rng.sample(_TOOLS, 2)
+        suggestions = "\n".join(f"{i}. {s}" for i, s in enumerate(rng.sample(_SUGGESTIONS, 2), 1))
+        return (
+            f"# 🛡️ 为 {user_name} 定制的【{bias_type}】免疫系统\n\n"
+            f"> 核心原则整合：\"{principle}\"——这正是您对抗{bias_type}的第一道防线。"
+            f"为了将它从'信念'变为'本能'，请在下次遇到类似情况时，将这句话大声朗读出来。\n\n"
+            f"## 💡 基于您本次决策模式的专属建议\n\n{suggestions}\n\n"
+            f"## ⚙️ 通用反制工具箱 - {framework}\n\n"
+            f"- **工具一：** {tools[0]}\n- **工具二：** {tools[1]}\n"
+        )
+    return "OK"
+
+
+# =============================================================================
+# 故障注入与应答
+# =============================================================================
+
+@dataclass
+class FakeScenario:
+    """替身服务的行为配置"""
+    seed: int = 0
+    latencies: Dict[str, str] = field(default_factory=dict)
+    rate_429: float = 0.0
+    empty_parts: float = 0.0
+    blocked: float = 0.0
+    stream_abort: float = 0.0
+    chunk_chars: int = 16
+    first_chunk_fraction: float = 0.3
+
+    def __post_init__(self):
+        # 用户指定的分布与内置默认值分开保存，否则默认值覆盖全部prompt类型，按模型指定的分布永远不生效
+        self._samplers = {key: parse_latency(spec) for key, spec in self.latencies.items()}
+        self._default_samplers = {key: parse_latency(spec) for key, spec in DEFAULT_LATENCIES.items()}
+
+    def sample_latency(self, model: str, kind: str, rng: random.Random) -> float:
+        """
+        按 指定的prompt类型、指定的模型名、指定的default、内置的prompt类型、内置的default 的顺序选择延迟分布
+        （--latency 不写KEY时为指定的default，覆盖全部prompt类型）
+        """
+        sampler = (self._samplers.get(kind) or self._samplers.get(model) or self._samplers.get('default')
+                   or self._default_samplers.get(kind) or self._default_samplers['default'])
+        return sampler(rng)
+
+
+@dataclass
+class FakeOutcome:
+    """一次请求的应答计划"""
+    kind: str
+    status: str  # ok / 429 / empty / blocked
+    latency_s: float
+    text: str = ""
+    abort_stream: bool = False
+
+
+class FakeGemini:
+    """
+    替身服务的应答逻辑
+
+    可复现：每个请求的随机数由(种子, 模型, prompt, 该prompt第几次出现)决定，
+    与并发到达的先后无关；同一prompt的重试会依次得到不同的结果（如先429再成功）。
+    """
+
+    def __init__(self, scenario: FakeScenario):
+        self.scenario = scenario
+        self._occurrences: Dict[Tuple[str, str], int] = {}
+        self._stats: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def plan(self, model: str, prompt: str) -> FakeOutcome:
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        with self._lock:
+            occurrence = self._occurrences.get((model, digest), 0)
+            self._occurrences[(model, digest)] = occurrence + 1
+        rng = random.Random(f"{self.scenario.seed}|{model}|{digest}|{occurrence}")
+
+        kind = classify_prompt(prompt)
+        latency = self.scenario.sample_latency(model, kind, rng)
+        roll = rng.random()
+        if roll < self.scenario.rate_429:
+            # 配额错误通常很快返回
+            outcome = FakeOutcome(kind, '429', min(latency, 0.05))
+        elif roll < self.scenario.rate_429 + self.scenario.empty_parts:
+            outcome = FakeOutcome(kind, 'empty', latency)
+        elif roll < self.scenario.rate_429 + self.scenario.empty_parts + self.scenario.blocked:
+            outcome = FakeOutcome(kind, 'blocked', min(latency, 0.2))
+        else:
+            outcome = FakeOutcome(kind, 'ok', latency, compose_reply(prompt, rng),
+                                  abort_stream=rng.random() < self.scenario.stream_abort)
+        self._count(f"{kind}.{outcome.status}")
+        return outcome
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] = self._stats.get(key, 0) + 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'requests': sum(self._stats.values()), 'outcomes': dict(self._stats)}
+
+    @staticmethod
+    def usage(prompt: str, text: str) -> Dict[str, int]:
+        # 与引擎的估算口径一致：一个字符约一个令牌
+        return {'promptTokenCount': len(prompt), 'candidatesTokenCount': len(text),
+                'totalTokenCount': len(prompt) + len(text)}
+
+    @staticmethod
+    def response_body(outcome: FakeOutcome, prompt: str, text: str, finish_reason: Optional[str] = 'STOP',
+                      with_usage: bool = True) -> Dict[str, Any]:
+        """与generateContent一致的响应体"""
+        if outcome.status == 'blocked':
+            return {'promptFeedback': {'blockReason': 'SAFETY'},
+                    'usageMetadata': {'promptTokenCount': len(prompt), 'totalTokenCount': len(prompt)}}
+        if outcome.status == 'empty':
+            body = {'candidates': [{'content': {'role': 'model', 'parts': []}, 'finishReason': 'OTHER', 'index': 0}]}
+        else:
+            candidate = {'content': {'role': 'model', 'parts': [{'text': text}]}, 'index': 0}
+            if finish_reason:
+                candidate['finishReason'] = finish_reason
+            body = {'candidates': [candidate]}
+        if with_usage:
+            body['usageMetadata'] = FakeGemini.usage(prompt, text)
+        return body
+
+
+QUOTA_ERROR = {'error': {'code': 429, 'message': 'Resource has been exhausted (e.g. check quota).',
+                         'status': 'RESOURCE_EXHAUSTED'}}
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    """Gemini REST的最小实现：POST /v1beta/models/{model}:generateContent 与 :streamGenerateContent"""
+    protocol_version = 'HTTP/1.1'
+    fake: FakeGemini = None
+
+    def log_message(self, format, *args):
+        logging.debug("[fake-gemini] " + format % args)
+
+    def _send_json(self, status: int, body: Any):
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            self._send_json(200, self.fake.get_stats())
+        elif self.path.rstrip('/') == '/healthz':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': {'code': 404, 'message': 'not found', 'status': 'NOT_FOUND'}})
+
+    def do_POST(self):
+        match = re.match(r'^/v1beta/models/([^/:]+):(generateContent|streamGenerateContent)(\?.*)?$', self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length)
+        if not match:
+            self._send_json(404, {'error': {'code': 404, 'message': 'not found', 'status': 'NOT_FOUND'}})
+            return
+        try:
+            request = json.loads(raw)
+            prompt = "".join(part.get('text', '') for content in request.get('contents', [])
+                             for part in content.get('parts', []))
+        except (ValueError, AttributeError):
+            self._send_json(400, {'error': {'code': 400, 'message': 'invalid JSON payload',
+                                            'status': 'INVALID_ARGUMENT'}})
+            return
+
+        model, method, query = match.group(1), match.group(2), match.group(3) or ''
+        outcome = self.fake.plan(model, prompt)
+        text = outcome.text
+        max_tokens = (request.get('generationConfig') or {}).get('maxOutputTokens')
+        finish_reason = 'STOP'
+        if max_tokens and len(text) > max_tokens:
+            text, finish_reason = text[:max_tokens], 'MAX_TOKENS'
+
+        if outcome.status == '429':
+            time.sleep(outcome.latency_s)
+            self._send_json(429, QUOTA_ERROR)
+        elif method == 'generateContent':
+            time.sleep(outcome.latency_s)
+            self._send_json(200, self.fake.response_body(outcome, prompt, text, finish_reason))
+        else:
+            self._stream(outcome, prompt, text, finish_reason, sse='alt=sse' in query)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def _stream(self, outcome: FakeOutcome, prompt: str, text: str, finish_reason: str, sse: bool):
+        """首块在总延迟的first_chunk_fraction处到达，其余块均匀分布在剩余时间内"""
+        size = max(1, self.fake.scenario.chunk_chars)
+        pieces = [text[i:i + size] for i in range(0, len(text), size)] or [""]
+        first_delay = outcome.latency_s * self.fake.scenario.first_chunk_fraction
+        interval = (outcome.latency_s - first_delay) / max(1, len(pieces) - 1)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream' if sse else 'application/json; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        time.sleep(first_delay)
+        events = []
+        for index, piece in enumerate(pieces):
+            last = index == len(pieces) - 1
+            if index > 0:
+                time.sleep(interval)
+            if outcome.abort_stream and index >= len(pieces) // 2 and index > 0:
+                # 流中途断开：不发送分块结尾，直接关闭连接
+                self.close_connection = True
+                self.wfile.flush()
+                self.connection.shutdown(socket.SHUT_RDWR)
+                return
+            event = self.fake.response_body(outcome, prompt, piece, finish_reason if last else None, with_usage=last)
+            if sse:
+                self._write_chunk(b'data: ' + json.dumps(event, ensure_ascii=False).encode('utf-8') + b'\r\n\r\n')
+            else:
+                events.append(event)
+        if not sse:
+            self._write_chunk(json.dumps(events, ensure_ascii=False).encode('utf-8'))
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+
+def create_server(scenario: FakeScenario, host: str = '127.0.0.1', port: int = 8765) -> ThreadingHTTPServer:
+    """创建替身服务（port为0时随机端口）；调用方负责serve_forever与shutdown"""
+    handler = type('BoundFakeGeminiHandler', (FakeGeminiHandler,), {'fake': FakeGemini(scenario)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="本地Gemini替身服务（压测与延迟测试）")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--seed', type=int, default=0, help="随机种子，相同种子与请求序列得到相同结果")
+    parser.add_argument('--latency', action='append', default=[], metavar='[KEY=]SPEC',
+                        help="延迟分布，KEY为prompt类型或模型名（不写为default），"
+                             "如 memo=lognormal:8,0.3 / gemini-1.5-flash=fixed:0.5 / uniform:0.5,2")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="返回429配额错误的比例")
+    parser.add_argument('--empty-parts', type=float, default=0.0, help="返回空parts响应的比例")
+    parser.add_argument('--blocked', type=float, default=0.0, help="返回prompt被拦截(blockReason)的比例")
+    parser.add_argument('--stream-abort', type=float, default=0.0, help="流式响应中途断开的比例")
+    parser.add_argument('--chunk-chars', type=int, default=16, help="流式响应每块的字符数")
+    args = parser.parse_args(argv)
+
+    latencies = {}
+    for item in args.latency:
+        key, sep, spec = item.partition('=')
+        latencies[key if sep else 'default'] = spec if sep else key
+    scenario = FakeScenario(seed=args.seed, latencies=latencies, rate_429=args.rate_429,
+                            empty_parts=args.empty_parts, blocked=args.blocked,
+                            stream_abort=args.stream_abort, chunk_chars=args.chunk_chars)
+
+    server = create_server(scenario, args.host, args.port)
+    logging.info(f"[fake-gemini] 监听 http://{args.host}:{server.server_port}/v1beta")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,131 @@
+# core/generation_profiles.py - 按调用类型区分的生成配置
+# 40字的质疑问题与2000 token的备忘录不应共用同一个输出上限
+
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Any, Tuple, List, Optional
+
+
+@dataclass(frozen=True)
+class GenerationProfile:
+    """一类调用的生成参数与模型偏好"""
+    name: str
+    max_output_tokens: int
+    temperature: float = 0.8
+    top_p: float = 0.9
+    top_k: int = 40
+    stop_sequences: Tuple[str, ...] = ()
+    preferred_models: Tuple[str, ...] = ()
+    # 调用方未指定截止时间时的默认预算（秒）
+    timeout_s: float = 30.0
+
+    def generation_config(self) -> Dict[str, Any]:
+        """转换为SDK的generation_config"""
+        config = {
+            'temperature': self.temperature,
+            'top_p': self.top_p,
+            'top_k': self.top_k,
+            'max_output_tokens': self.max_output_tokens
+        }
+        if self.stop_sequences:
+            config['stop_sequences'] = list(self.stop_sequences)
+        return config
+
+    def order_models(self, candidates: List[str]) -> List[str]:
+        """偏好模型排在前面，其余保持路由器给出的顺序"""
+        preferred = [m for m in self.preferred_models if m in candidates]
+        return preferred + [m for m in candidates if m not in preferred]
+
+
+# 注意：带思考能力的模型会把思考过程计入输出上限，短调用的上限不宜压得过低
+GENERATION_PROFILES: Dict[str, GenerationProfile] = {
+    # 未指定类型的调用，保持原有参数
+    'default': GenerationProfile(name='default', max_output_tokens=2000),
+    # Damien质疑：一句话，40字以内
+    'question': GenerationProfile(
+        name='question', max_output_tokens=200,
+        stop_sequences=('\n\n',), preferred_models=('gemini-1.5-flash',), timeout_s=15.0
+    ),
+    # Athena单步反馈：一句话，50字以内
+    'feedback': GenerationProfile(
+        name='feedback', max_output_tokens=200,
+        stop_sequences=('\n\n',), preferred_models=('gemini-1.5-flash',), timeout_s=15.0
+    ),
+    # Athena批量反馈：五条点评组成的JSON对象
+    'feedback_batch': GenerationProfile(
+        name='feedback_batch', max_output_tokens=800, temperature=0.7,
+        preferred_models=('gemini-1.5-flash',), timeout_s=20.0
+    ),
+    # 认知免疫系统备忘录：长文本，输出上限与截止时间更宽；不指定偏好模型，沿用MODEL_PRIORITY的顺序
+    'memo': GenerationProfile(name='memo', max_output_tokens=2000, timeout_s=60.0),
+    # 骨架模式下的备忘录个性化字段：建议与两个工具组成的JSON对象
+    'memo_fields': GenerationProfile(name='memo_fields', max_output_tokens=600, timeout_s=30.0),
+    # 引擎健康检查：只需要确认可用
+    'health_check': GenerationProfile(
+        name='health_check', max_output_tokens=20, temperature=0.0,
+        preferred_models=('gemini-1.5-flash',), timeout_s=10.0
+    ),
+}
+
+
+def get_profile(name: Optional[str]) -> GenerationProfile:
+    """按名称获取生成配置，未知名称使用default"""
+    return GENERATION_PROFILES.get(name or 'default', GENERATION_PROFILES['default'])
+
+
+class ProfileStats:
+    """按生成配置统计调用次数、延迟与令牌用量"""
+
+    # 每个序列保留的近期延迟样本数，用于计算分位数
+    RECENT_SAMPLES = 200
+
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._recent: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, series: str, latency_s: float):
+        """记录一个延迟样本（如某配置的总延迟或首块延迟）"""
+        with self._lock:
+            self._recent.setdefault(series, deque(maxlen=self.RECENT_SAMPLES)).append(latency_s)
+
+    def latency_percentile(self, series: str, q: float, min_samples: int = 1) -> Optional[float]:
+        """近期延迟的q分位数，样本不足时返回None"""
+        with self._lock:
+            samples = sorted(self._recent.get(series, ()))
+        if len(samples) < max(1, min_samples):
+            return None
+        index = min(len(samples) - 1, int(q * len(samples)))
+        return samples[index]
+
+    def record(self, profile_name: str, latency_s: float, success: bool, token_count: Optional[int]):
+        if success:
+            self.observe(profile_name, latency_s)
+        with self._lock:
+            stats = self._stats.setdefault(profile_name, {
+                'calls': 0, 'failures': 0, 'total_latency_s': 0.0, 'max_latency_s': 0.0,
+                'total_tokens': 0, 'calls_with_tokens': 0
+            })
+            stats['calls'] += 1
+            if not success:
+                stats['failures'] += 1
+            stats['total_latency_s'] += latency_s
+            stats['max_latency_s'] = max(stats['max_latency_s'], latency_s)
+            if token_count is not None:
+                stats['total_tokens'] += token_count
+                stats['calls_with_tokens'] += 1
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                name: {
+                    'calls': s['calls'],
+                    'failures': s['failures'],
+                    'avg_latency_s': round(s['total_latency_s'] / s['calls'], 3),
+                    'max_latency_s': round(s['max_latency_s'], 3),
+                    'avg_tokens': round(s['total_tokens'] / s['calls_with_tokens'], 1) if s['calls_with_tokens'] else None,
+                    'total_tokens': s['total_tokens']
+                }
+                for name, s in self._stats.items()
+            }
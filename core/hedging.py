@@ -0,0 +1,156 @@
+# core/hedging.py - 对冲请求
+# 主请求超过近期延迟分位数仍未返回时再发一路请求，取先完成的一路
+
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
+from typing import Dict, Any, Callable, Iterator, Tuple, Optional
+
+from core.diagnostics import GenerationResult
+
+# 一路流式生成：返回(文本块迭代器, 诊断结果)
+StreamFactory = Callable[[], Tuple[Iterator[str], Dict[str, Any]]]
+
+
+class Hedger:
+    """
+    对冲请求执行器
+
+    设计原则：
+    1. 延迟触发：只有主请求超过阈值仍未完成才发出对冲请求，正常请求零额外开销
+    2. 先成功者胜：失败的一路不会抢先返回，另一路仍可能给出真实内容
+    3. 败者忽略：同步调用无法中途取消，败者在后台完成后结果被丢弃；流式败者立即停止消费
+    """
+
+    def __init__(self, max_workers: int = 8):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ai-hedge")
+        self._lock = threading.Lock()
+        self.hedged_calls = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+
+    def _count(self, fired: bool = False, won: bool = False):
+        with self._lock:
+            if fired:
+                self.hedges_fired += 1
+            if won:
+                self.hedges_won += 1
+
+    def call(self, primary_fn: Callable[[], Dict[str, Any]], hedge_fn: Callable[[], Dict[str, Any]],
+             delay_s: float) -> Dict[str, Any]:
+        """执行同步生成，主请求超过delay_s未完成时发出对冲请求"""
+        with self._lock:
+            self.hedged_calls += 1
+
+        primary = self._executor.submit(primary_fn)
+        try:
+            return primary.result(timeout=delay_s)
+        except FutureTimeoutError:
+            pass
+
+        self._count(fired=True)
+        hedge = self._executor.submit(hedge_fn)
+        pending = {primary, hedge}
+        finished_result = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if result.get("success"):
+                    won = future is hedge
+                    self._count(won=won)
+                    result["debug_info"]["hedge"] = "对冲请求胜出" if won else "主请求胜出"
+                    return result
+                finished_result = finished_result or result
+
+        finished_result["debug_info"]["hedge"] = "两路请求均失败"
+        return finished_result
+
+    def stream(self, primary_factory: StreamFactory, hedge_factory: StreamFactory,
+               delay_s: float) -> Tuple[Iterator[str], Dict[str, Any]]:
+        """
+        执行流式生成，主请求超过delay_s仍未产出首个文本块时发出对冲请求
+        先产出文本块的一路胜出，另一路停止消费；诊断结果在迭代器耗尽后写入返回的结果
+        """
+        with self._lock:
+            self.hedged_calls += 1
+
+        merged_result = GenerationResult({"debug_info": {}})
+        events: "queue.Queue[Tuple[str, str, Optional[str]]]" = queue.Queue()
+        stop_flags = {'primary': threading.Event(), 'hedge': threading.Event()}
+        results: Dict[str, Dict[str, Any]] = {}
+
+        def pump(tag: str, factory: StreamFactory):
+            chunks, result = factory()
+            results[tag] = result
+            try:
+                for chunk in chunks:
+                    if stop_flags[tag].is_set():
+                        chunks.close()
+                        return
+                    events.put((tag, 'chunk', chunk))
+            finally:
+                events.put((tag, 'end', None))
+
+        def merged_iterator() -> Iterator[str]:
+            self._executor.submit(pump, 'primary', primary_factory)
+            hedge_at = time.time() + delay_s
+            started = {'primary'}
+            ended = set()
+            winner = None
+            try:
+                while True:
+                    timeout = None
+                    if winner is None and 'hedge' not in started:
+                        timeout = max(0.0, hedge_at - time.time())
+                    try:
+                        tag, kind, value = events.get(timeout=timeout)
+                    except queue.Empty:
+                        self._count(fired=True)
+                        started.add('hedge')
+                        self._executor.submit(pump, 'hedge', hedge_factory)
+                        continue
+
+                    if kind == 'chunk':
+                        if winner is None:
+                            winner = tag
+                            for other in stop_flags:
+                                if other != tag:
+                                    stop_flags[other].set()
+                        if tag == winner:
+                            yield value
+                        continue
+
+                    ended.add(tag)
+                    if tag == winner or (winner is None and ended >= started and 'hedge' in started):
+                        break
+                    if winner is None and 'hedge' not in started:
+                        # 主请求未产出任何内容就结束，不再对冲
+                        break
+            finally:
+                for flag in stop_flags.values():
+                    flag.set()
+                final_tag = winner or ('hedge' if 'hedge' in results and results['hedge'].get("success") else 'primary')
+                final_result = results.get(final_tag) or results.get('primary') or {}
+                merged_result.update(final_result)
+                if 'hedge' in started:
+                    won = winner == 'hedge'
+                    self._count(won=won)
+                    if winner is None:
+                        outcome = "两路请求均失败"
+                    else:
+                        outcome = "对冲请求胜出" if won else "主请求胜出"
+                    merged_result.setdefault("debug_info", {})["hedge"] = outcome
+
+        return merged_iterator(), merged_result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取对冲统计信息"""
+        with self._lock:
+            return {
+                'hedged_calls': self.hedged_calls,
+                'hedges_fired': self.hedges_fired,
+                'hedges_won': self.hedges_won,
+                'win_ratio': round(self.hedges_won / self.hedges_fired, 3) if self.hedges_fired else 0.0
+            }
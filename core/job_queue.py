@@ -0,0 +1,264 @@
+# core/job_queue.py - 本地生成任务队列
+# Streamlit进程只负责提交与轮询，上游调用由独立的worker进程池（core.llm_worker）执行
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Any, Optional
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+JOB_FINISHED_STATES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    partial TEXT NOT NULL DEFAULT '',
+    result TEXT,
+    error TEXT,
+    worker_id TEXT,
+    deadline_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    heartbeat_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created_at ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    threads INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    heartbeat_at REAL NOT NULL,
+    jobs_done INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class JobQueue:
+    """
+    SQLite任务队列
+
+    设计原则：
+    1. 多进程共享：与ResponseStore相同，WAL模式 + 每线程一个连接，认领任务在BEGIN IMMEDIATE事务中完成
+    2. 截止时间随任务传递：排队超过截止时间的任务不再执行，直接标记失败
+    3. 可恢复：worker进程崩溃后，心跳过期的运行中任务重新入队
+    4. 流式输出：worker把已生成的文本写入partial，提交方轮询读取增量
+    """
+
+    def __init__(self, path: str, retention_s: float = 3600.0):
+        self.path = path
+        self.retention_s = retention_s
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        """每个线程一个连接（sqlite3连接不能跨线程使用）；目录无法创建时抛出OSError"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    # =====================================================
+    # 提交方接口
+    # =====================================================
+
+    def submit(self, kind: str, payload: Dict[str, Any], timeout_s: float) -> str:
+        """提交任务，返回任务ID"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO jobs (id, kind, payload, status, deadline_at, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(payload, ensure_ascii=False), JOB_QUEUED, now + timeout_s, now)
+        )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """读取任务状态、已生成的部分文本与结果"""
+        row = self._connect().execute(
+            "SELECT status, partial, result, error, created_at, started_at FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def cancel(self, job_id: str) -> bool:
+        """取消尚未结束的任务；运行中的流式任务在下次写入partial时停止"""
+        return self._connect().execute(
+            "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status IN (?, ?)",
+            (JOB_CANCELLED, time.time(), job_id, JOB_QUEUED, JOB_RUNNING)
+        ).rowcount > 0
+
+    def queue_position(self, job_id: str) -> int:
+        """排在该任务前面的等待任务数"""
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < "
+            "(SELECT created_at FROM jobs WHERE id = ?)", (JOB_QUEUED, job_id)
+        ).fetchone()
+        return row[0] if row else 0
+
+    # =====================================================
+    # worker接口
+    # =====================================================
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """认领最早的等待任务；已超过截止时间的等待任务直接标记失败"""
+        conn = self._connect()
+        # 空闲轮询只读，有等待任务时才申请写锁
+        if conn.execute("SELECT 1 FROM jobs WHERE status = ? LIMIT 1", (JOB_QUEUED,)).fetchone() is None:
+            return None
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status = ? AND deadline_at <= ?",
+                (JOB_FAILED, "排队超过截止时间", now, JOB_QUEUED, now)
+            )
+            row = conn.execute(
+                "SELECT id, kind, payload, deadline_at FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                (JOB_QUEUED,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, worker_id = ?, started_at = ?, heartbeat_at = ? WHERE id = ?",
+                    (JOB_RUNNING, worker_id, now, now, row['id'])
+                )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return {'id': row['id'], 'kind': row['kind'], 'payload': json.loads(row['payload']),
+                'deadline_at': row['deadline_at']}
+
+    def update_partial(self, job_id: str, partial: str) -> bool:
+        """写入已生成的部分文本（同时作为心跳）；任务已被取消时返回False"""
+        return self._connect().execute(
+            "UPDATE jobs SET partial = ?, heartbeat_at = ? WHERE id = ? AND status = ?",
+            (partial, time.time(), job_id, JOB_RUNNING)
+        ).rowcount > 0
+
+    def heartbeat(self, job_id: str) -> bool:
+        """运行中任务的心跳；任务已被取消时返回False"""
+        return self._connect().execute(
+            "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = ?",
+            (time.time(), job_id, JOB_RUNNING)
+        ).rowcount > 0
+
+    def complete(self, job_id: str, result: Dict[str, Any]):
+        self._finish(job_id, JOB_DONE, result=json.dumps(result, ensure_ascii=False, default=str))
+
+    def fail(self, job_id: str, error: str):
+        self._finish(job_id, JOB_FAILED, error=error)
+
+    def _finish(self, job_id: str, status: str, result: Optional[str] = None, error: Optional[str] = None):
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ? AND status = ?",
+            (status, result, error, time.time(), job_id, JOB_RUNNING)
+        )
+
+    def requeue_stale(self, stale_s: float) -> int:
+        """
+        心跳过期的运行中任务（worker已崩溃）重新入队
+        已超过截止时间或已输出部分文本（提交方已展示，不能重新生成）的任务标记失败
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? "
+                "WHERE status = ? AND heartbeat_at < ? AND (deadline_at <= ? OR partial != '')",
+                (JOB_FAILED, "worker失去响应", now, JOB_RUNNING, now - stale_s, now)
+            )
+            requeued = conn.execute(
+                "UPDATE jobs SET status = ?, worker_id = NULL WHERE status = ? AND heartbeat_at < ?",
+                (JOB_QUEUED, JOB_RUNNING, now - stale_s)
+            ).rowcount
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        if requeued:
+            logging.warning(f"JobQueue: {requeued}个任务的worker失去响应，已重新入队")
+        return requeued
+
+    def purge(self) -> int:
+        """删除已结束超过保留时间的任务"""
+        return self._connect().execute(
+            "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+            (time.time() - self.retention_s,)
+        ).rowcount
+
+    def register_worker(self, worker_id: str, threads: int):
+        now = time.time()
+        self._connect().execute(
+            "INSERT OR REPLACE INTO workers (worker_id, pid, threads, started_at, heartbeat_at) VALUES (?, ?, ?, ?, ?)",
+            (worker_id, os.getpid(), threads, now, now)
+        )
+
+    def worker_heartbeat(self, worker_id: str, jobs_done: int = 0):
+        """worker进程的心跳，同时刷新它正在执行的全部任务的心跳"""
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            "UPDATE workers SET heartbeat_at = ?, jobs_done = jobs_done + ? WHERE worker_id = ?",
+            (now, jobs_done, worker_id)
+        )
+        conn.execute(
+            "UPDATE jobs SET heartbeat_at = ? WHERE worker_id = ? AND status = ?",
+            (now, worker_id, JOB_RUNNING)
+        )
+
+    def remove_worker(self, worker_id: str):
+        self._connect().execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+
+    # =====================================================
+    # 统计
+    # =====================================================
+
+    def get_stats(self, stale_s: float = 30.0) -> Dict[str, Any]:
+        """队列长度、各状态任务数、存活worker与近期平均执行时间"""
+        now = time.time()
+        try:
+            conn = self._connect()
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            workers, threads = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(threads), 0) FROM workers WHERE heartbeat_at >= ?", (now - stale_s,)
+            ).fetchone()
+            avg_run_s = conn.execute(
+                "SELECT AVG(finished_at - started_at) FROM jobs WHERE status = ? AND finished_at >= ?",
+                (JOB_DONE, now - 300.0)
+            ).fetchone()[0]
+        except (sqlite3.Error, OSError) as e:
+            logging.warning(f"JobQueue stats failed: {e}")
+            return {'path': self.path, 'error': str(e)}
+        return {
+            'path': self.path,
+            'jobs': {status: counts.get(status, 0) for status in (JOB_QUEUED, JOB_RUNNING) + JOB_FINISHED_STATES},
+            'live_workers': workers,
+            'worker_threads': threads,
+            'avg_run_s': round(avg_run_s, 2) if avg_run_s is not None else None
+        }
@@ -0,0 +1,170 @@
+# core/llm_worker.py - 执行生成任务的worker进程池
+# 与Streamlit进程分离：生成吞吐可按CPU核数扩展，慢调用不再占用页面的脚本线程
+#
+# 用法：python -m core.llm_worker --processes 2 --threads 4
+# 需要在config.settings中开启WORKER_MODE_ENABLED，Streamlit进程才会把调用提交到任务队列
+# API Key从环境变量GEMINI_API_KEY读取（或.streamlit/secrets.toml）
+
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from typing import Dict, Any, List, Optional
+
+from config.settings import EngineConfig
+from core.deadline import Deadline
+from core.diagnostics import materialize
+from core.generation_profiles import get_profile
+from core.job_queue import JobQueue
+
+# 引擎初始化失败（如缺少API Key）时的退出码，监督进程据此停止重启
+EXIT_INIT_FAILED = 2
+
+
+def execute_job(engine, queue: JobQueue, job: Dict[str, Any]):
+    """在本进程的引擎上执行一个任务，结果写回队列"""
+    payload = job['payload']
+    profile = get_profile(payload['profile'])
+    # 截止时间从提交时起算，排队时间已经消耗了一部分预算
+    deadline = Deadline(max(0.0, job['deadline_at'] - time.time()))
+    prompt, system_instruction = payload['prompt'], payload.get('system_instruction')
+
+    if job['kind'] == 'generate':
+        result = engine._execute(prompt, profile, deadline, system_instruction)
+    elif job['kind'] == 'stream':
+        chunks, result = engine._execute_stream(prompt, profile, deadline, system_instruction)
+        collected = []
+        flushed_at = time.time()
+        for chunk in chunks:
+            collected.append(chunk)
+            if time.time() - flushed_at >= EngineConfig.WORKER_STREAM_FLUSH_S:
+                if not queue.update_partial(job['id'], "".join(collected)):
+                    # 提交方已取消（超时或离开页面），停止消费即关闭上游流
+                    chunks.close()
+                    return
+                flushed_at = time.time()
+        queue.update_partial(job['id'], "".join(collected))
+    else:
+        queue.fail(job['id'], f"未知的任务类型: {job['kind']}")
+        return
+
+    queue.complete(job['id'], materialize(result))
+
+
+def run_worker_process(queue_path: str, threads: int):
+    """worker进程入口：一个共享引擎 + 若干认领任务的线程"""
+    logging.basicConfig(level=logging.INFO)
+    # worker自身必须在本进程执行调用
+    EngineConfig.WORKER_MODE_ENABLED = False
+    from core.engine import AIEngine
+
+    engine = AIEngine()
+    if not engine.is_initialized:
+        logging.error(engine.error_message)
+        sys.exit(EXIT_INIT_FAILED)
+
+    queue = JobQueue(queue_path, EngineConfig.WORKER_JOB_RETENTION_S)
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    queue.register_worker(worker_id, threads)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    jobs_done = [0]
+    jobs_done_lock = threading.Lock()
+
+    def serve():
+        while not stop.is_set():
+            try:
+                job = queue.claim(worker_id)
+            except Exception as e:
+                logging.warning(f"[worker] 认领任务失败: {e}")
+                job = None
+            if job is None:
+                stop.wait(EngineConfig.WORKER_IDLE_POLL_S)
+                continue
+            try:
+                execute_job(engine, queue, job)
+            except Exception as e:
+                logging.exception(f"[worker] 任务{job['id']}执行失败")
+                queue.fail(job['id'], str(e))
+            with jobs_done_lock:
+                jobs_done[0] += 1
+
+    serving = [threading.Thread(target=serve, name=f"llm-worker-{i}", daemon=True) for i in range(threads)]
+    for thread in serving:
+        thread.start()
+    logging.info(f"[worker] {worker_id} 已启动（{threads}个线程）")
+
+    try:
+        while not stop.wait(EngineConfig.WORKER_HEARTBEAT_S):
+            with jobs_done_lock:
+                done, jobs_done[0] = jobs_done[0], 0
+            queue.worker_heartbeat(worker_id, done)
+    except KeyboardInterrupt:
+        stop.set()
+    finally:
+        # 未完成的任务在心跳过期后由监督进程重新入队
+        for thread in serving:
+            thread.join(timeout=5.0)
+        queue.remove_worker(worker_id)
+        logging.info(f"[worker] {worker_id} 已退出")
+
+
+def supervise(queue_path: str, processes: int, threads: int):
+    """启动并看护worker进程：崩溃的进程自动重启，失去响应的任务重新入队（需在主线程调用）"""
+    # 使用spawn：fork会复制父进程中gRPC等库的线程状态
+    context = multiprocessing.get_context('spawn')
+    queue = JobQueue(queue_path, EngineConfig.WORKER_JOB_RETENTION_S)
+
+    def start() -> multiprocessing.Process:
+        process = context.Process(target=run_worker_process, args=(queue_path, threads), daemon=False)
+        process.start()
+        return process
+
+    workers: List[multiprocessing.Process] = [start() for _ in range(processes)]
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    try:
+        while not stopping.wait(EngineConfig.WORKER_HEARTBEAT_S):
+            for index, process in enumerate(workers):
+                if process.is_alive():
+                    continue
+                if process.exitcode == EXIT_INIT_FAILED:
+                    logging.error("[worker] 引擎初始化失败，停止worker进程池")
+                    stopping.set()
+                    break
+                logging.warning(f"[worker] 进程{process.pid}已退出（{process.exitcode}），重新启动")
+                workers[index] = start()
+            queue.requeue_stale(EngineConfig.WORKER_STALE_S)
+            queue.purge()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in workers:
+            if process.is_alive():
+                process.terminate()
+        for process in workers:
+            process.join(timeout=10.0)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="执行生成任务的worker进程池")
+    parser.add_argument('--processes', type=int, default=EngineConfig.WORKER_PROCESSES, help="worker进程数")
+    parser.add_argument('--threads', type=int, default=EngineConfig.WORKER_THREADS, help="每个进程并发执行的任务数")
+    parser.add_argument('--queue-path', default=EngineConfig.WORKER_QUEUE_PATH,
+                        help="任务队列路径，须与Streamlit进程的WORKER_QUEUE_PATH一致")
+    args = parser.parse_args(argv)
+
+    logging.info(f"[worker] 任务队列: {args.queue_path}")
+    supervise(args.queue_path, max(1, args.processes), max(1, args.threads))
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,143 @@
+# core/model_router.py - 按调用的模型路由与熔断
+# 每次调用都重新评估模型健康度，失败时在同一次调用内切换到下一个模型
+
+import threading
+import time
+from typing import Dict, Any, List, Optional
+
+# 熔断器状态
+CIRCUIT_CLOSED = "closed"        # 正常放行
+CIRCUIT_OPEN = "open"            # 熔断中，跳过该模型
+CIRCUIT_HALF_OPEN = "half_open"  # 冷却结束，放行一次探测请求
+
+
+class ModelHealth:
+    """单个模型的健康统计与熔断器状态"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CIRCUIT_CLOSED
+        self.ewma_latency_s: Optional[float] = None
+        self.ewma_error_rate = 0.0
+        self.calls = 0
+        self.failures = 0
+        self.quota_errors = 0
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.open_count = 0
+        self.probe_in_flight = False
+        self.last_error_category: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'ewma_latency_s': round(self.ewma_latency_s, 3) if self.ewma_latency_s is not None else None,
+            'ewma_error_rate': round(self.ewma_error_rate, 3),
+            'calls': self.calls,
+            'failures': self.failures,
+            'quota_errors': self.quota_errors,
+            'consecutive_failures': self.consecutive_failures,
+            'open_count': self.open_count,
+            'open_for_s': round(time.time() - self.opened_at, 1) if self.opened_at else None,
+            'last_error_category': self.last_error_category
+        }
+
+
+class ModelRouter:
+    """
+    模型优先级列表上的路由器
+
+    设计原则：
+    1. 按优先级尝试：正常模型按原有优先级排列，熔断中的模型被跳过
+    2. 配额错误立即熔断：配额限制短时间内不会恢复，继续请求只会放大失败
+    3. 半开探测：冷却时间结束后只放行一个探测请求，成功则恢复，失败则重新熔断
+    """
+
+    def __init__(self, model_names: List[str], failure_threshold: int = 3,
+                 open_seconds: float = 60.0, ewma_alpha: float = 0.3):
+        self.model_names = list(model_names)
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.ewma_alpha = ewma_alpha
+        self._health: Dict[str, ModelHealth] = {name: ModelHealth(name) for name in self.model_names}
+        self._lock = threading.Lock()
+
+    def candidates(self) -> List[str]:
+        """本次调用可尝试的模型，按优先级排序（半开模型需在尝试前调用try_acquire）"""
+        now = time.time()
+        available = []
+        with self._lock:
+            for name in self.model_names:
+                health = self._health[name]
+                if health.state == CIRCUIT_OPEN and now - health.opened_at >= self.open_seconds:
+                    health.state = CIRCUIT_HALF_OPEN
+                    health.probe_in_flight = False
+
+                if health.state == CIRCUIT_CLOSED:
+                    available.append(name)
+                elif health.state == CIRCUIT_HALF_OPEN and not health.probe_in_flight:
+                    available.append(name)
+        return available
+
+    def try_acquire(self, name: str) -> bool:
+        """即将调用模型前确认放行：半开状态只允许一个探测请求在途"""
+        with self._lock:
+            health = self._health[name]
+            if health.state == CIRCUIT_CLOSED:
+                return True
+            if health.state == CIRCUIT_HALF_OPEN and not health.probe_in_flight:
+                health.probe_in_flight = True
+                return True
+            return False
+
+    def release(self, name: str):
+        """调用被调用方放弃（未得出结论）时释放探测名额"""
+        with self._lock:
+            self._health[name].probe_in_flight = False
+
+    def _update_ewma(self, health: ModelHealth, latency_s: float, is_error: bool):
+        alpha = self.ewma_alpha
+        if health.ewma_latency_s is None:
+            health.ewma_latency_s = latency_s
+        else:
+            health.ewma_latency_s = alpha * latency_s + (1 - alpha) * health.ewma_latency_s
+        health.ewma_error_rate = alpha * (1.0 if is_error else 0.0) + (1 - alpha) * health.ewma_error_rate
+
+    def record_success(self, name: str, latency_s: float):
+        """记录一次成功调用，半开状态下恢复为正常"""
+        with self._lock:
+            health = self._health[name]
+            health.calls += 1
+            health.consecutive_failures = 0
+            self._update_ewma(health, latency_s, is_error=False)
+            if health.state != CIRCUIT_CLOSED:
+                health.state = CIRCUIT_CLOSED
+                health.opened_at = None
+            health.probe_in_flight = False
+
+    def record_failure(self, name: str, latency_s: float, error_category: Optional[str]):
+        """记录一次失败调用，达到阈值、配额错误或探测失败时熔断"""
+        with self._lock:
+            health = self._health[name]
+            health.calls += 1
+            health.failures += 1
+            health.consecutive_failures += 1
+            health.last_error_category = error_category
+            self._update_ewma(health, latency_s, is_error=True)
+
+            is_quota = error_category == "配额限制"
+            if is_quota:
+                health.quota_errors += 1
+
+            if (health.state == CIRCUIT_HALF_OPEN or is_quota
+                    or health.consecutive_failures >= self.failure_threshold):
+                if health.state != CIRCUIT_OPEN:
+                    health.open_count += 1
+                health.state = CIRCUIT_OPEN
+                health.opened_at = time.time()
+            health.probe_in_flight = False
+
+    def get_routing_table(self) -> Dict[str, Dict[str, Any]]:
+        """获取路由表 - 用于调试面板"""
+        with self._lock:
+            return {name: self._health[name].to_dict() for name in self.model_names}
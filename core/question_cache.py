@@ -0,0 +1,107 @@
+# core/question_cache.py - Damien质疑问题结果缓存
+# 质疑问题的prompt只由案例和第一幕选择决定，整个输入空间只有十几个键
+
+import copy
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Hashable, List, Tuple
+
+
+class QuestionCache:
+    """
+    有界LRU + TTL结果缓存，每个键保留一个变体池
+
+    设计原则：
+    1. 变体池：每个键最多缓存N个不同的生成结果，池未满时视为未命中以继续积累变体
+    2. 有界：键数量超过上限时淘汰最久未使用的键
+    3. 过期：变体超过TTL后丢弃，保证内容定期刷新
+    """
+
+    def __init__(self, max_keys: int = 64, ttl_seconds: float = 3600.0,
+                 variants_per_key: int = 3, enabled: bool = True):
+        self.max_keys = max_keys
+        self.ttl_seconds = ttl_seconds
+        self.variants_per_key = max(1, variants_per_key)
+        self.enabled = enabled
+        self._entries: "OrderedDict[Hashable, List[Tuple[float, Dict[str, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _fresh_variants(self, key: Hashable, now: float) -> List[Tuple[float, Dict[str, Any]]]:
+        """清理并返回键下未过期的变体（调用方需持有锁）"""
+        variants = [v for v in self._entries.get(key, []) if now - v[0] < self.ttl_seconds]
+        if variants:
+            self._entries[key] = variants
+        else:
+            self._entries.pop(key, None)
+        return variants
+
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """变体池已满时随机返回一个变体的副本，否则返回None"""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            variants = self._fresh_variants(key, time.time())
+            if len(variants) < self.variants_per_key:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            _, result = random.choice(variants)
+
+        return copy.deepcopy(result)
+
+    def next_variant_index(self, key: Hashable) -> int:
+        """下一个待补充的变体序号，用于从持久化存储中取回不同的变体"""
+        if not self.enabled:
+            return random.randrange(self.variants_per_key)
+        with self._lock:
+            return min(len(self._fresh_variants(key, time.time())), self.variants_per_key - 1)
+
+    def put(self, key: Hashable, result: Dict[str, Any]):
+        """写入一个新变体，变体池已满时替换最旧的变体"""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            now = time.time()
+            variants = self._fresh_variants(key, now)
+            # 合并请求的多个调用方会写入同一结果，重复内容不占用变体名额
+            if any(v[1].get("content") == result.get("content") for v in variants):
+                return
+            variants.append((now, copy.deepcopy(result)))
+            self._entries[key] = variants[-self.variants_per_key:]
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        total = self.hits + self.misses
+        with self._lock:
+            cached_variants = sum(len(v) for v in self._entries.values())
+            keys = len(self._entries)
+        return {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 3) if total else 0.0,
+            'keys': keys,
+            'cached_variants': cached_variants,
+            'evictions': self.evictions,
+            'variants_per_key': self.variants_per_key,
+            'ttl_seconds': self.ttl_seconds
+        }
@@ -0,0 +1,158 @@
+# core/rate_limiter.py - 跨会话的令牌桶限流与准入队列
+# 所有会话共享同一组配额，超出配额的请求排队等待，等待过久则快速回退
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Tuple
+
+
+@dataclass
+class Admission:
+    """一次准入判定的结果"""
+    admitted: bool
+    wait_s: float = 0.0
+    queue_position: int = 0
+    reason: Optional[str] = None
+
+
+class TokenBucket:
+    """
+    按分钟速率补充的令牌桶
+
+    允许水位为负：已准入但尚未到时间的请求先行预留令牌，
+    后来者据此算出自己需要等待的时间，从而形成先来先服务的队列。
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate_per_s = per_minute / 60.0
+        self.level = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate_per_s)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """取得amount个令牌需要等待的秒数"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        deficit = amount - self.level
+        return max(0.0, deficit / self.rate_per_s) if self.rate_per_s > 0 else float('inf')
+
+    def consume(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def refund(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """
+    进程级限流器：每个模型一组请求数/分钟与令牌数/分钟的令牌桶
+
+    设计原则：
+    1. 预留即排队：准入时立即预留令牌并算出等待时间，等待期间计入队列
+    2. 有界队列：排队请求达到上限时直接拒绝
+    3. 截止时间：预计等待超过上限时立即拒绝，由调用方返回fallback内容
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[int, int]], default_limit: Tuple[int, int],
+                 max_queue: int = 200, enabled: bool = True):
+        self.limits = dict(limits)
+        self.default_limit = default_limit
+        self.max_queue = max_queue
+        self.enabled = enabled
+        self._buckets: Dict[str, Tuple[TokenBucket, TokenBucket]] = {}
+        self._waiting: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+        self.queued = 0
+        self.total_wait_s = 0.0
+
+    def _get_buckets(self, model_name: str) -> Tuple[TokenBucket, TokenBucket]:
+        """获取模型的(请求桶, 令牌桶)（调用方需持有锁）"""
+        if model_name not in self._buckets:
+            rpm, tpm = self.limits.get(model_name, self.default_limit)
+            self._buckets[model_name] = (TokenBucket(rpm), TokenBucket(tpm))
+        return self._buckets[model_name]
+
+    def acquire(self, model_name: str, estimated_tokens: int, max_wait_s: float) -> Admission:
+        """
+        申请一次模型调用的准入
+        需要排队时在当前线程等待；队列已满或预计等待超过max_wait_s时立即拒绝
+        """
+        if not self.enabled:
+            return Admission(admitted=True)
+
+        with self._lock:
+            waiting_total = sum(self._waiting.values())
+            if waiting_total >= self.max_queue:
+                self.rejected += 1
+                return Admission(admitted=False, queue_position=waiting_total, reason="排队已满")
+
+            request_bucket, token_bucket = self._get_buckets(model_name)
+            now = time.monotonic()
+            wait_s = max(request_bucket.wait_time(1, now), token_bucket.wait_time(estimated_tokens, now))
+            if wait_s > max_wait_s:
+                self.rejected += 1
+                return Admission(admitted=False, wait_s=wait_s, queue_position=waiting_total,
+                                 reason=f"预计等待{wait_s:.1f}秒超过上限")
+
+            request_bucket.consume(1)
+            token_bucket.consume(estimated_tokens)
+            self.admitted += 1
+            position = self._waiting.get(model_name, 0)
+            if wait_s > 0:
+                self._waiting[model_name] = position + 1
+                self.queued += 1
+                self.total_wait_s += wait_s
+
+        if wait_s > 0:
+            try:
+                time.sleep(wait_s)
+            finally:
+                with self._lock:
+                    self._waiting[model_name] -= 1
+
+        return Admission(admitted=True, wait_s=wait_s, queue_position=position)
+
+    def settle(self, model_name: str, estimated_tokens: int, actual_tokens: Optional[int]):
+        """调用完成后按实际令牌用量修正预留量"""
+        if not self.enabled or actual_tokens is None:
+            return
+        with self._lock:
+            _, token_bucket = self._get_buckets(model_name)
+            difference = estimated_tokens - actual_tokens
+            if difference > 0:
+                token_bucket.refund(difference)
+            else:
+                token_bucket.consume(-difference)
+
+    def get_status(self, model_name: Optional[str] = None) -> Dict[str, Any]:
+        """获取当前排队状态 - 用于界面上的排队提示；指定模型时给出新请求的预计等待"""
+        with self._lock:
+            waiting = {name: count for name, count in self._waiting.items() if count > 0}
+            expected_wait_s = 0.0
+            if model_name is not None:
+                request_bucket, _ = self._get_buckets(model_name)
+                expected_wait_s = request_bucket.wait_time(1, time.monotonic())
+        return {
+            'waiting': sum(waiting.values()),
+            'waiting_by_model': waiting,
+            'expected_wait_s': round(expected_wait_s, 1),
+            'max_queue': self.max_queue
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取限流统计信息"""
+        return {
+            'enabled': self.enabled,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'queued': self.queued,
+            'avg_queue_wait_s': round(self.total_wait_s / self.queued, 2) if self.queued else 0.0,
+            **self.get_status()
+        }
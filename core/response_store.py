@@ -0,0 +1,185 @@
+# core/response_store.py - 跨进程持久化的生成结果存储
+# 多个副本与重启后的进程共享同一份SQLite（WAL模式），冷启动的副本从第一个请求起即可命中
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Any, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    payload BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_accessed_at ON responses (accessed_at);
+"""
+
+
+class ResponseStore:
+    """
+    SQLite持久化结果存储
+
+    设计原则：
+    1. 多进程共享：WAL模式下读写互不阻塞，写冲突由busy_timeout排队
+    2. 压缩存储：结果以zlib压缩的JSON保存
+    3. 有界：超过TTL的条目视为未命中，总大小超过上限时淘汰最久未访问的条目
+    4. 不影响主流程：存储读写失败只记录日志，调用方按未命中处理
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024,
+                 ttl_seconds: float = 7 * 24 * 3600.0, enabled: bool = True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.errors = 0
+
+    @staticmethod
+    def make_key(model_name: str, prompt: str, generation_config: Dict[str, Any], variant: int = 0) -> str:
+        """存储键：模型 + prompt + 生成配置 + 变体序号"""
+        payload = json.dumps({
+            "model": model_name,
+            "prompt": prompt,
+            "generation_config": generation_config,
+            "variant": variant
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        """每个线程一个连接（sqlite3连接不能跨线程使用）；目录无法创建时抛出OSError"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取未过期的结果，未命中或读取失败时返回None"""
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT payload FROM responses WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is None:
+                self._count('misses')
+                return None
+            conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            result = json.loads(zlib.decompress(row[0]).decode('utf-8'))
+        except (sqlite3.Error, OSError, zlib.error, ValueError) as e:
+            self._count('errors')
+            logging.warning(f"Response store read failed: {e}")
+            return None
+
+        self._count('hits')
+        return result
+
+    def put(self, key: str, result: Dict[str, Any]):
+        """写入结果并按总大小与TTL淘汰旧条目"""
+        if not self.enabled:
+            return
+
+        now = time.time()
+        payload = zlib.compress(json.dumps(result, ensure_ascii=False, default=str).encode('utf-8'))
+        try:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, payload, size, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, payload, len(payload), now, now)
+                )
+                evicted = self._evict(conn, now)
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+        except (sqlite3.Error, OSError) as e:
+            self._count('errors')
+            logging.warning(f"Response store write failed: {e}")
+            return
+
+        self._count('writes')
+        self._count('evictions', evicted)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> int:
+        """删除过期条目，再按最久未访问淘汰到总大小上限以内（调用方需在事务中）"""
+        evicted = conn.execute(
+            "DELETE FROM responses WHERE created_at <= ?", (now - self.ttl_seconds,)
+        ).rowcount
+
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return evicted
+
+        rows = conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+        victims = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            victims.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+        return evicted + len(victims)
+
+    def clear(self):
+        """清空存储（所有进程共享，谨慎使用）"""
+        try:
+            self._connect().execute("DELETE FROM responses")
+        except (sqlite3.Error, OSError) as e:
+            self._count('errors')
+            logging.warning(f"Response store clear failed: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取存储统计信息"""
+        entries, total_bytes = 0, 0
+        if self.enabled:
+            try:
+                entries, total_bytes = self._connect().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()
+            except (sqlite3.Error, OSError):
+                pass
+        total = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'path': self.path,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 3) if total else 0.0,
+            'writes': self.writes,
+            'evictions': self.evictions,
+            'errors': self.errors,
+            'entries': entries,
+            'total_bytes': total_bytes,
+            'max_bytes': self.max_bytes
+        }
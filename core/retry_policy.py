@@ -0,0 +1,74 @@
+# core/retry_policy.py - 按错误类型区分的重试策略
+# 网络抖动等短暂故障退避后重试同一模型，配额错误立即切换模型，内容拦截不重试
+
+import random
+import threading
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Tuple
+
+# 失败后的处理动作
+RETRY_ACTION_RETRY = "retry"    # 退避后重试同一模型，次数用尽后切换到下一个模型
+RETRY_ACTION_SWITCH = "switch"  # 立即切换到下一个模型
+RETRY_ACTION_STOP = "stop"      # 不重试也不切换，直接返回（由调用方给出fallback）
+
+
+@dataclass(frozen=True)
+class RetryRule:
+    """一类错误的处理方式"""
+    action: str
+    max_retries: int = 0
+    base_delay_s: float = 0.3
+    max_delay_s: float = 2.0
+
+
+class RetryPolicy:
+    """
+    重试策略
+
+    设计原则：
+    1. 按错误类型决策：规则来自配置，未配置的类型使用默认规则
+    2. 指数退避加抖动：第n次重试等待 base * 2^n（不超过上限）的一半到全部之间的随机时长，避免多个会话同时重试
+    3. 受截止时间约束：退避后剩余时间不足以完成一次尝试时不再重试
+    """
+
+    def __init__(self, rules: Dict[str, Tuple[str, int, float, float]],
+                 default: Tuple[str, int, float, float]):
+        self.rules = {category: RetryRule(*rule) for category, rule in rules.items()}
+        self.default = RetryRule(*default)
+        self._lock = threading.Lock()
+        self.retries: Dict[str, int] = {}
+        self.skipped_by_deadline = 0
+
+    def rule_for(self, error_category: Optional[str]) -> RetryRule:
+        return self.rules.get(error_category, self.default)
+
+    def should_stop(self, error_category: Optional[str]) -> bool:
+        """该类错误是否既不重试也不切换模型"""
+        return self.rule_for(error_category).action == RETRY_ACTION_STOP
+
+    def retry_delay(self, error_category: Optional[str], retries_done: int, budget_s: float) -> Optional[float]:
+        """
+        同一模型的下一次重试前应等待的秒数；不应重试时返回None（调用方切换模型）
+        budget_s为退避可用的时间：截止时间剩余部分减去一次尝试所需的最短时间
+        """
+        rule = self.rule_for(error_category)
+        if rule.action != RETRY_ACTION_RETRY or retries_done >= rule.max_retries:
+            return None
+
+        cap = min(rule.max_delay_s, rule.base_delay_s * (2 ** retries_done))
+        delay = cap / 2 + random.uniform(0, cap / 2)
+        with self._lock:
+            if delay > budget_s:
+                self.skipped_by_deadline += 1
+                return None
+            self.retries[error_category] = self.retries.get(error_category, 0) + 1
+        return delay
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取重试统计信息"""
+        with self._lock:
+            return {
+                'rules': {category: rule.__dict__ for category, rule in self.rules.items()},
+                'retries': dict(self.retries),
+                'skipped_by_deadline': self.skipped_by_deadline
+            }
@@ -0,0 +1,84 @@
+# core/single_flight.py - 相同请求的在途合并
+# 同一时刻发出的相同prompt只向上游发送一次，结果分发给所有等待者
+
+import copy
+import threading
+from typing import Dict, Any, Callable, Hashable, Optional, Tuple
+
+
+class _InFlightCall:
+    """一个在途请求：领头者执行，跟随者等待其结果"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    在途请求合并器
+
+    设计原则：
+    1. 只合并在途请求：请求完成即从表中移除，不充当缓存
+    2. 结果隔离：每个跟随者拿到结果的独立副本，调用方可以放心修改
+    3. 异常传播：领头者失败时，所有跟随者收到同样的异常
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._calls: Dict[Hashable, _InFlightCall] = {}
+        self._lock = threading.Lock()
+        self.leader_calls = 0
+        self.coalesced_calls = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        执行fn或加入相同key的在途请求，返回(结果, 是否为合并得到的结果)
+        跟随者最多等待timeout秒，超时抛出TimeoutError（领头者不受影响）
+        """
+        if not self.enabled:
+            return fn(), False
+
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _InFlightCall()
+                self._calls[key] = call
+                self.leader_calls += 1
+            else:
+                call.waiters += 1
+                self.coalesced_calls += 1
+
+        if not is_leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError("等待合并请求的结果超时")
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result), True
+
+        try:
+            result = fn()
+            # 保存一份不会被领头者后续修改的副本供跟随者复制
+            call.result = copy.deepcopy(result)
+            return result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取合并统计信息"""
+        with self._lock:
+            in_flight = len(self._calls)
+        return {
+            'enabled': self.enabled,
+            'upstream_calls': self.leader_calls,
+            'saved_calls': self.coalesced_calls,
+            'in_flight': in_flight
+        }
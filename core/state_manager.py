@@ -5,13 +5,44 @@
 """
 
 import streamlit as st
-from typing import Optional, Dict
+import time
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, Callable, Hashable, Tuple
 from core.models import ViewState, Case
-from core.engine import AIEngine
+from core.engine_pool import EnginePool, SessionEngineView
+from core.executor import ExecutorSaturatedError, StreamingJob
+from core.metrics import REGISTRY
+from config.settings import EngineConfig
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 状态流转指标
+SESSIONS_STARTED = REGISTRY.counter("app_sessions_started_total", "新建的会话状态数")
+SCRIPT_RUNS = REGISTRY.counter("app_script_runs_total", "Streamlit脚本执行次数（含rerun）")
+CASES_ENTERED = REGISTRY.counter("app_case_entered_total", "进入案例的次数", ("case",))
+ACTS_ADVANCED = REGISTRY.counter("app_act_advanced_total", "进入各幕的次数", ("case", "act"))
+
+@dataclass
+class BackgroundJob:
+    """会话内的后台任务：任务键、Future（流式为StreamingJob）、首次提交时间与重新提交方式"""
+    job_key: Hashable
+    job: Any
+    submitted_at: float
+    submit: Callable[[], Any]
+    saturation_retries: int = 0
+
+    def rejected(self) -> bool:
+        """是否因线程池饱和被拒绝"""
+        return self.job.done() and not self.job.cancelled() and \
+            isinstance(self.job.exception(), ExecutorSaturatedError)
+
+    def failed(self) -> bool:
+        """是否已失败或被取消（饱和被拒绝不算，由轮询重新提交）"""
+        if not self.job.done() or self.rejected():
+            return False
+        return self.job.cancelled() or self.job.exception() is not None
+
 class StateManager:
     """
     统一状态管理器 - 认知黑匣子应用的状态管理核心
@@ -22,6 +53,9 @@ class StateManager:
     3. 防御性编程：所有状态访问都有边界检查
     """
     
+    # 备忘录生成依赖的全部上下文字段，任一变化都需要重新生成
+    TOOL_CONTEXT_KEYS = ('case_id', 'user_name', 'user_principle', 'act1_choice')
+    
     def __init__(self):
         """初始化状态管理器，确保核心状态存在"""
         self._ensure_state_initialized()
@@ -31,13 +65,14 @@ class StateManager:
         """确保核心状态已初始化 - 防御性编程"""
         if 'view_state' not in st.session_state:
             st.session_state.view_state = ViewState()
+            SESSIONS_STARTED.inc()
             logger.info("StateManager: 初始化新的ViewState")
     
     def _ensure_ai_engine_initialized(self):
-        """确保AI引擎已初始化 - 分离关注点"""
+        """确保AI引擎已初始化 - 分离关注点（会话只持有共享引擎的视图）"""
         if 'ai_engine' not in st.session_state:
-            st.session_state.ai_engine = AIEngine()
-            logger.info("StateManager: 初始化AI引擎")
+            st.session_state.ai_engine = EnginePool.create_session_view()
+            logger.info("StateManager: 绑定共享AI引擎")
     
     @property
     def current_state(self) -> ViewState:
@@ -45,8 +80,8 @@ class StateManager:
         return st.session_state.view_state
     
     @property
-    def ai_engine(self) -> AIEngine:
-        """获取AI引擎实例"""
+    def ai_engine(self) -> SessionEngineView:
+        """获取AI引擎实例（共享引擎的会话视图）"""
         return st.session_state.ai_engine
     
     @property
@@ -83,11 +118,15 @@ class StateManager:
             
             # 原子化状态重置
             st.session_state.view_state.reset_for_new_case(case_id)
+            CASES_ENTERED.inc(case=case_id)
             
             # 清除可能的案例对象缓存
             if 'case_obj' in st.session_state:
                 del st.session_state.case_obj
             
+            # 上一个案例的后台任务已无意义
+            self.cancel_background_jobs()
+            
             # 强制重新渲染
             st.rerun()
             
@@ -108,6 +147,7 @@ class StateManager:
             st.session_state.view_state.reset_to_selection()
             
             # 清除所有案例相关缓存
+            self.cancel_background_jobs()
             for key in ['case_obj']:
                 if key in st.session_state:
                     del st.session_state[key]
@@ -124,6 +164,7 @@ class StateManager:
         try:
             logger.info(f"StateManager: 从第{self.current_state.act_num}幕进入下一幕")
             self.current_state.advance_act()
+            ACTS_ADVANCED.inc(case=self.current_state.case_id, act=self.current_state.act_num)
             st.rerun()
         except Exception as e:
             logger.error(f"StateManager: 下一幕切换失败 {e}")
@@ -210,6 +251,10 @@ class StateManager:
         try:
             self.current_state.update_context(key, value)
             logger.debug(f"StateManager: 更新上下文 {key} = {value}")
+            
+            # 第三幕中备忘录输入变化时，刷新后台预生成任务
+            if key in self.TOOL_CONTEXT_KEYS and self.get_current_act_num() == 3:
+                self.start_tool_pregeneration()
         except Exception as e:
             logger.error(f"StateManager: 上下文更新失败 {e}")
     
@@ -221,10 +266,143 @@ class StateManager:
         """获取完整上下文 - 用于AI调用"""
         return self.current_state.context.copy()
     
+    # =====================================================
+    # 后台生成任务 - 让AI调用与转场动画重叠
+    # =====================================================
+    
+    def _get_background_jobs(self) -> Dict[str, BackgroundJob]:
+        """获取会话内的后台任务表：槽位 -> BackgroundJob"""
+        if 'background_jobs' not in st.session_state:
+            st.session_state.background_jobs = {}
+        return st.session_state.background_jobs
+    
+    def _register_background_job(self, slot: str, job_key: Hashable, submit: Callable[[], Any]):
+        """
+        在槽位中登记后台任务
+        相同任务键的任务在运行、已成功或等待饱和重试时直接复用；任务键变化或任务失败时取消旧任务并重新提交
+        """
+        jobs = self._get_background_jobs()
+        existing = jobs.get(slot)
+        if existing:
+            if existing.job_key == job_key and not existing.failed():
+                return
+            existing.job.cancel()
+            logger.info(f"StateManager: 后台任务 {slot} 上下文已变化或已失败，重新提交")
+        
+        jobs[slot] = BackgroundJob(job_key, submit(), time.time(), submit)
+        logger.info(f"StateManager: 启动后台任务 {slot}")
+    
+    def _ensure_background_job(self, slot: str, job_key: Hashable, submit: Callable[[], Any]):
+        """轮询前使用：只在槽位为空或任务键变化时登记，已结束的任务留给轮询处理"""
+        existing = self._get_background_jobs().get(slot)
+        if existing is None or existing.job_key != job_key:
+            self._register_background_job(slot, job_key, submit)
+    
+    def _poll_background_job(self, slot: str, job_key: Hashable, timeout: float) -> Tuple[bool, Optional[Any]]:
+        """
+        非阻塞地查询后台任务，返回(是否已结束, 结果)
+        任务失败或超过timeout（从首次提交算起）仍未完成时视为已结束、结果为None，由调用方使用fallback；
+        线程池饱和被拒绝的任务重新提交，超过BACKGROUND_SATURATION_RETRIES次后同样视为失败
+        """
+        jobs = self._get_background_jobs()
+        entry = jobs.get(slot)
+        if not entry or entry.job_key != job_key:
+            return False, None
+        
+        timed_out = time.time() - entry.submitted_at >= timeout
+        if entry.rejected():
+            if timed_out or entry.saturation_retries >= EngineConfig.BACKGROUND_SATURATION_RETRIES:
+                jobs.pop(slot, None)
+                logger.warning(f"StateManager: 后台任务 {slot} 因线程池饱和多次被拒绝，使用备选结果")
+                return True, None
+            entry.saturation_retries += 1
+            entry.job = entry.submit()
+            return False, None
+        
+        job = entry.job
+        if not job.done():
+            if not timed_out:
+                return False, None
+            job.cancel()
+            jobs.pop(slot, None)
+            logger.warning(f"StateManager: 后台任务 {slot} 等待超时")
+            return True, None
+        
+        jobs.pop(slot, None)
+        if entry.failed():
+            logger.error(f"StateManager: 后台任务 {slot} 失败 {None if job.cancelled() else job.exception()}")
+            return True, None
+        return True, job.result()
+    
+    def _tool_job_key(self, context: Dict[str, Any]) -> tuple:
+        return tuple(context.get(key) for key in self.TOOL_CONTEXT_KEYS)
+    
+    def _submit_tool_job(self, context: Dict[str, Any]) -> Callable[[], StreamingJob]:
+        return lambda: self.ai_engine.submit_personalized_tool_stream(context)
+    
+    def start_tool_pregeneration(self):
+        """
+        第三幕期间预生成第四幕备忘录
+        上下文完整（已记录第一幕选择）时启动，上下文变化时自动取消并重新生成
+        """
+        context = self.get_full_context()
+        if not context.get('act1_choice'):
+            return
+        self._register_background_job('tool', self._tool_job_key(context), self._submit_tool_job(context))
+    
+    def attach_tool_job(self) -> StreamingJob:
+        """第四幕接入备忘录生成任务：复用进行中的预生成任务，没有则立即启动（任务仍留在任务表中）"""
+        context = self.get_full_context()
+        self._ensure_background_job('tool', self._tool_job_key(context), self._submit_tool_job(context))
+        return self._get_background_jobs()['tool'].job
+    
+    def poll_tool_job(self) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """非阻塞地取回备忘录结果，返回(是否已结束, 结果)；没有生成任务时立即启动"""
+        context = self.get_full_context()
+        job_key = self._tool_job_key(context)
+        self._ensure_background_job('tool', job_key, self._submit_tool_job(context))
+        return self._poll_background_job('tool', job_key, EngineConfig.TOOL_WAIT_TIMEOUT_S)
+    
+    def cancel_background_jobs(self):
+        """取消会话内所有后台任务（已开始执行的任务结果将被丢弃）"""
+        # 备忘录生成失败标记只对当前案例有效
+        st.session_state.pop('tool_generation_failed', None)
+        jobs = st.session_state.get('background_jobs')
+        if not jobs:
+            return
+        for entry in jobs.values():
+            entry.job.cancel()
+        jobs.clear()
+    
+    def prefetch_question(self, act1_choice: Optional[str] = None):
+        """预取Damien质疑问题 - 在第一幕确认后、转场动画期间即开始生成"""
+        context = self.get_full_context()
+        if act1_choice is not None:
+            context['act1_choice'] = act1_choice
+        self._register_background_job('question', self._question_job_key(context),
+                                      self._submit_question_job(context))
+    
+    def _question_job_key(self, context: Dict[str, Any]) -> tuple:
+        return (context.get('case_id'), context.get('act1_choice'))
+    
+    def _submit_question_job(self, context: Dict[str, Any]) -> Callable[[], Any]:
+        return lambda: self.ai_engine.submit_personalized_question(context)
+    
+    def poll_prefetched_question(self) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """非阻塞地取回质疑问题，返回(是否已结束, 结果)；没有预取任务时立即启动"""
+        context = self.get_full_context()
+        job_key = self._question_job_key(context)
+        self._ensure_background_job('question', job_key, self._submit_question_job(context))
+        return self._poll_background_job('question', job_key, EngineConfig.PREFETCH_WAIT_TIMEOUT_S)
+    
     # =====================================================
     # UI状态管理
     # =====================================================
     
+    def record_script_run(self):
+        """记录一次脚本执行（每次rerun都会重新执行整个脚本）"""
+        SCRIPT_RUNS.inc()
+    
     def toggle_debug_mode(self):
         """切换调试模式"""
         self.current_state.show_debug = not self.current_state.show_debug
@@ -297,6 +475,7 @@ class StateManager:
         logger.warning("StateManager: 执行完全状态重置")
         
         # 清除所有session_state
+        self.cancel_background_jobs()
         keys_to_clear = ['view_state', 'case_obj', 'ai_engine']
         for key in keys_to_clear:
             if key in st.session_state:
@@ -340,6 +519,7 @@ class StateManager:
         
         # 更新目标幕数
         self.current_state.act_num = to_act
+        ACTS_ADVANCED.inc(case=self.current_state.case_id, act=to_act)
         
         # 如果跳转到新案例，重置解锁状态
         if to_act == 1:
@@ -42,7 +42,9 @@ try:
     from core.models import Act, Case, ViewState  # 新增ViewState
     from core.state_manager import StateManager    # 重构后的StateManager
     from core.engine import AIEngine
-    from config.settings import AppConfig
+    from core.diagnostics import materialize, DIAGNOSTICS_LEVELS
+    from core.metrics import start_metrics_server
+    from config.settings import AppConfig, EngineConfig
     from core.transition_manager import TransitionManager
     from core.value_confirmation import ValueConfirmationManager
 except ImportError as e:
@@ -612,35 +614,61 @@ def render_act1_interaction():
         options,
         key="act1_choice_radio",
         horizontal=True,
-        label_visibility="collapsed"
+        label_visibility="collapsed",
+        on_change=_prefetch_on_select if EngineConfig.PREFETCH_ON_SELECT else None
     )
     
     # CXO-03: 替换原来的确认按钮为带转场效果的按钮
     if st.button("✅ 确认我的决策", type="primary", key="confirm_act1_choice"):
         sm.update_context('act1_choice', choice)
+        # 质疑问题在转场动画期间后台生成，第二幕直接取结果
+        sm.prefetch_question()
         TransitionManager.show_transition(1, 2)
         sm.advance_to_next_act_with_transition(1, 2)
 
+def render_admission_status(placeholder):
+    """AI请求排队时显示队列位置与预计等待时间"""
+    status = get_state_manager().ai_engine.get_admission_status()
+    if status.get('waiting', 0) > 0:
+        placeholder.caption(f"⏳ 当前体验人数较多，前方约有 {status['waiting']} 个AI请求在排队，"
+                            f"预计等待 {status['expected_wait_s']:.0f} 秒")
+    else:
+        placeholder.empty()
+
+def _prefetch_on_select():
+    """单选项变化时预取质疑问题"""
+    get_state_manager().prefetch_question(st.session_state.get("act1_choice_radio"))
+
+@st.fragment(run_every=AppConfig.UI_POLL_INTERVAL_S)
+def render_question_progress():
+    """第二幕等待质疑问题的进度片段 - 结果就绪后整页重新运行"""
+    sm = get_state_manager()
+    finished, result = sm.poll_prefetched_question()
+    if not finished:
+        st.info("🤖 Damien正在分析您的决策逻辑...")
+        render_admission_status(st.empty())
+        return
+    
+    if result is None:
+        # 创建失败结果
+        result = {
+            "success": False,
+            "content": "",
+            "error_message": "AI调用失败或等待超时",
+            "fallback_content": "这个'完美'的机会，最让你不安的是什么？"
+        }
+    sm.update_context('ai_question_result', result)
+    sm.show_challenge_modal()
+    st.rerun()
+
 def render_act2_interaction():
     """第二幕的交互逻辑 - 新增CXO-03转场"""
     sm = get_state_manager()
     
     if not sm.get_context('ai_question_result'):
-        with st.spinner("🤖 Damien正在分析您的决策逻辑..."):
-            try:
-                result = sm.ai_engine.generate_personalized_question(sm.get_full_context())
-                sm.update_context('ai_question_result', result)
-                sm.show_challenge_modal()
-            except Exception as e:
-                # 创建失败结果
-                result = {
-                    "success": False,
-                    "content": "",
-                    "error_message": f"AI调用异常: {str(e)}",
-                    "fallback_content": "这个'完美'的机会，最让你不安的是什么？"
-                }
-                sm.update_context('ai_question_result', result)
-                sm.show_challenge_modal()
+        # 生成进行中：由自动刷新的片段轮询结果，脚本线程不阻塞
+        render_question_progress()
+        return
     
     result = sm.get_context('ai_question_result')
     
@@ -675,12 +703,35 @@ def render_act2_interaction():
 def render_act3_interaction():
     """第三幕的交互逻辑 - 已有DOUBT模型 + 新增CXO-03转场"""
     sm = get_state_manager()
+    # 备忘录的输入在第三幕已经齐备，提前在后台生成
+    sm.start_tool_pregeneration()
     # ... 现有的DOUBT模型训练逻辑保持不变 ...
     if st.button("⚡ 生成我的专属智慧", type="primary", key="generate_tool"):
         context = sm.get_full_context()
         TransitionManager.show_transition(3, 4)
         sm.advance_to_next_act_with_transition(3, 4)
 
+@st.fragment(run_every=AppConfig.UI_POLL_INTERVAL_S)
+def render_tool_progress():
+    """第四幕备忘录生成进度片段 - 每次刷新渲染已生成的部分，结束后整页重新运行"""
+    sm = get_state_manager()
+    # 先查询第三幕已启动的预生成任务（没有则立即启动），未结束时接入任务渲染已生成的部分
+    finished, tool_result = sm.poll_tool_job()
+    if not finished:
+        tool_job = sm.attach_tool_job()
+        if tool_job.text:
+            st.markdown(tool_job.text + " ▌")
+        else:
+            st.caption("AI大师正在为您铸造认知武器...")
+            render_admission_status(st.empty())
+        return
+    
+    if tool_result:
+        sm.update_context('personalized_tool_result', tool_result)
+    else:
+        st.session_state.tool_generation_failed = True
+    st.rerun()
+
 def render_act4_interaction():
     """第四幕的交互逻辑 - 简化版价值确认体验"""
     sm = get_state_manager()
@@ -689,19 +740,16 @@ def render_act4_interaction():
     
     # 检查是否需要生成工具
     tool_result = sm.get_context('personalized_tool_result')
-    if not tool_result:
+    if not tool_result and not st.session_state.get('tool_generation_failed', False):
         st.info("🔄 正在为您定制专属智慧...")
-        
-        # 生成个性化工具
-        with st.spinner("AI大师正在为您铸造认知武器..."):
-            context = sm.get_full_context()
-            tool_result = sm.ai_engine.generate_personalized_tool(context)
-            sm.update_context('personalized_tool_result', tool_result)
-            st.rerun()
+        # 生成进行中：由自动刷新的片段边生成边渲染，脚本线程不阻塞
+        render_tool_progress()
+        return
     
     if not tool_result:
         st.error("❌ 工具生成失败，请重试")
         if st.button("🔄 重新生成", key="retry_tool_generation"):
+            st.session_state.tool_generation_failed = False
             sm.update_context('personalized_tool_result', None)
             st.rerun()
         return
@@ -709,7 +757,7 @@ def render_act4_interaction():
     # 显示AI调用诊断（调试模式）
     if sm.is_debug_mode():
         with st.expander("🔍 AI工具生成诊断", expanded=False):
-            st.json(tool_result)
+            st.json(materialize(tool_result))
     
     # 获取工具内容
     tool_content = tool_result.get('content', '') or tool_result.get('fallback_content', '')
@@ -878,9 +926,33 @@ def render_debug_panel():
                 st.json({
                     'is_initialized': debug_info['is_initialized'],
                     'current_model': debug_info['current_model'],
-                    'error': debug_info['error_message']
+                    'backend': debug_info.get('backend', {}),
+                    'error': debug_info['error_message'],
+                    'engine_pool': debug_info.get('pool', {}),
+                    'question_cache': debug_info.get('question_cache', {}),
+                    'rate_limiter': debug_info.get('rate_limiter', {}),
+                    'single_flight': debug_info.get('single_flight', {}),
+                    'hedging': debug_info.get('hedging', {}),
+                    'response_store': debug_info.get('response_store', {}),
+                    'context_cache': debug_info.get('context_cache', {}),
+                    'job_queue': debug_info.get('job_queue', {}),
+                    'background_executor': debug_info.get('background_executor', {}),
+                    'diagnostics': debug_info.get('diagnostics', {}),
+                    'session_calls': debug_info.get('session', {})
                 })
         
+        if sm.ai_engine:
+            engine_debug_info = sm.ai_engine.get_debug_info()
+            # 诊断级别作用于所有会话共享的引擎，只读显示，通过EngineConfig.DIAGNOSTICS_LEVEL配置
+            st.caption(f"诊断采集级别: {engine_debug_info.get('diagnostics', {}).get('level')}"
+                       f"（可选 {' / '.join(DIAGNOSTICS_LEVELS)}，通过配置DIAGNOSTICS_LEVEL修改）")
+            st.write("**模型路由表:**")
+            st.json(engine_debug_info.get('model_routing', {}))
+            st.write("**生成配置统计:**")
+            st.json(engine_debug_info.get('profile_stats', {}))
+            st.write("**截止时间预算消耗:**")
+            st.json(engine_debug_info.get('deadlines', {}))
+        
         st.write("**上下文数据:**")
         context = sm.get_full_context()
         if context:
@@ -905,7 +977,7 @@ def render_debug_panel():
         with col3:
             if st.button("🧪 测试AI引擎"):
                 with st.spinner("测试中..."):
-                    result = sm.ai_engine._generate("请回答'AI引擎正常'")
+                    result = sm.ai_engine._generate("请回答'AI引擎正常'", 'health_check')
                     if result.get("success"):
                         st.success(f"✅ AI测试成功: {result.get('content', '')}")
                     else:
@@ -988,8 +1060,13 @@ def main():
     # 注入高级CSS样式
     inject_premium_css()
     
+    # 指标端点（进程内只启动一次）
+    if AppConfig.METRICS_ENABLED:
+        start_metrics_server(AppConfig.METRICS_HOST, AppConfig.METRICS_PORT)
+    
     # 获取状态管理器（自动初始化）
     sm = get_state_manager()
+    sm.record_script_run()
     
     try:
         if sm.is_in_selection_view():